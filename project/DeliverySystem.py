@@ -8,6 +8,13 @@ January 24th, 2022
 """
 
 from utils.brick import Motor, BP, EV3ColorSensor, TouchSensor, configure_ports, wait_ready_sensors
+from utils.pipeline import Pipeline
+from utils.session_log import SessionLog
+from utils.tracing import Tracer, span
+from utils.metrics import REGISTRY, MetricsExporter, METRICS_PORT
+from logic import ColorClassifier, StreamingColorDetector
+from collections import deque
+import threading
 import time
 import math as m
 import argparse
@@ -15,10 +22,14 @@ import argparse
 
 def add_argparser():
     parser = argparse.ArgumentParser()
-    parser.add_argument('-f','--file-output', type=str, required=False, default='music.log', help='Path to output file to write.')
+    parser.add_argument('-f','--file-output', type=str, required=False, default=None, help='Path to a text file to also write the r, g, b values to.')
+    parser.add_argument('--session-log', type=str, required=False, default=time.strftime('session-%Y-%m-%d.log'), help='binary log the cubes are appended to, see utils.session_log')
     parser.add_argument('--ts_delay', type=float, required=False, default='0.5', help='touch sensor delay')
     parser.add_argument('--color_delay', type=float, required=False, default='0.01', help='color sensor delay')
     parser.add_argument('--batch_size', type=int, required=False, default='5', help='number of samples to take per touch sensor press')
+    parser.add_argument('--pipeline', action='store_true', help='sample the next cube while the previous one is pushed')
+    parser.add_argument('--metrics-port', type=int, required=False, default=METRICS_PORT, help='local port of the metrics endpoint, 0 to disable')
+    parser.add_argument('--metrics-json', type=str, required=False, default='metrics.json', help='file the metrics are written to every few seconds')
     return parser
 
 
@@ -28,9 +39,10 @@ motor_G = Motor("B")
 motor_B = Motor("C")
 # Set target speed first, 360 deg/sec
 # Reset power limit to limitless with 0, default values:(power=0, dps=0)
-motor_R.set_limits(dps=5500)
-motor_G.set_limits(dps=5500)
-motor_B.set_limits(dps=6500)
+# The pistons follow a trapezoidal motion profile: full speed, without overshooting their target
+motor_R.set_profile(kind="trapezoidal", max_dps=Motor.MAX_SPEED)
+motor_G.set_profile(kind="trapezoidal", max_dps=Motor.MAX_SPEED)
+motor_B.set_profile(kind="trapezoidal", max_dps=Motor.MAX_SPEED)
 # set current position to absolute pos 0deg
 '''
 motor_R.set_position_relative(-20)
@@ -49,10 +61,33 @@ COLORS = {'R': (1.0, 0.1, 0.1),
           'G': (0.1, 1.0, 0.1), 
           'B': (0.3, 0.6, 0.7), 
           'Y': (0.8, 0.6, 0.0),}
+CLASSIFIER = ColorClassifier(COLORS)
 
 # mapping colors to sounds
 LOOKUPTABLE = {'R': 0, 'G': 110, 'B': 240}
 
+# where the cycle time of each cube goes, reported on exit or on `kill -USR1`
+TRACER = Tracer()
+
+# metrics, served on --metrics-port
+CUBES = REGISTRY.counter("sort_cubes_total", "Cubes sorted, by color", labels=("color",))
+REJECTS = REGISTRY.counter("sort_rejects_total", "Cubes not sorted, by reason", labels=("reason",))
+CYCLE_SECONDS = REGISTRY.histogram("sort_cycle_seconds", "Seconds from the touch sensor press to the end of the cube")
+FINISHED = deque()  # time.monotonic() at which each cube of the last minute finished
+FINISHED_LOCK = threading.Lock()  # the gauge is read on the metrics threads
+
+
+def cubes_per_minute():
+    "Count the cubes finished over the last minute."
+    now = time.monotonic()
+    with FINISHED_LOCK:
+        while FINISHED and now - FINISHED[0] > 60:
+            FINISHED.popleft()
+        return len(FINISHED)
+
+
+REGISTRY.gauge("sort_cubes_per_minute", "Cubes finished over the last minute", function=cubes_per_minute)
+
 
 '''
 Sorting Tray Module
@@ -62,27 +97,24 @@ the sorting tray will rotate by an angle associated to that respective color to
 from the sorting tray on to the respective color channel.
 
 Input: normalized rgb values
-Output: call to set_position subroutine
+Output: the classification, and the piston moves
 '''
 def color2position(r, g, b):
     print(r, g, b)
-    minsqerror = 1e99
-    bestfit = 'r'
-    for c in COLORS.keys():
-        sqerror = (r-COLORS[c][0])**2 + (g-COLORS[c][1])**2 +(b-COLORS[c][2])**2
-        if sqerror < minsqerror:
-            bestfit = c
-            minsqerror = sqerror
+    with span("classify"):
+        result = CLASSIFIER.classify((r, g, b))
+    bestfit = result.color
     
     print(f'Identified Color {bestfit}')
     print(f'Moving To Position: {LOOKUPTABLE[bestfit]}')
+    moves = ()
     if(bestfit=="R"):
-        piston_movement_R(0)
+        moves = piston_movement_R(0)
     elif(bestfit=="B"):
-        piston_movement_B(0)
+        moves = piston_movement_B(0)
     elif(bestfit=="G"):
-        piston_movement_G(0)  
-    time.sleep(2)
+        moves = piston_movement_G(0)  
+    return result, moves
 
     
 
@@ -104,10 +136,16 @@ def piston_movement_R(i):
 
     # TO BE TESTED #
     # move with just enough force to push out the cube from the unsorted channel on to the sorting tray
-    motor_R.set_position_relative(60)
-    time.sleep(1)
-    motor_R.set_position_relative(-60)
-    time.sleep(1)
+    # waits until the piston is out, at most 1 second, then until it is back
+    with span("push command"):
+        push = motor_R.move_by(60, timeout=1)
+    with span("push settle"):
+        push.wait()
+    with span("return command"):
+        back = motor_R.move_to(push.target - 60, timeout=1)
+    with span("return settle"):
+        back.wait()
+    return push, back
     
     
     # Optional logging    
@@ -129,10 +167,16 @@ def piston_movement_B(i):
 
     # TO BE TESTED #
     # move with just enough force to push out the cube from the unsorted channel on to the sorting tray
-    motor_B.set_position_relative(90)
-    time.sleep(1)
-    motor_B.set_position_relative(-90)
-    time.sleep(1)
+    # waits until the piston is out, at most 1 second, then until it is back
+    with span("push command"):
+        push = motor_B.move_by(90, timeout=1)
+    with span("push settle"):
+        push.wait()
+    with span("return command"):
+        back = motor_B.move_to(push.target - 90, timeout=1)
+    with span("return settle"):
+        back.wait()
+    return push, back
     
     # Optional logging    
     '''
@@ -153,10 +197,16 @@ def piston_movement_G(i):
 
     # TO BE TESTED #
     # move with just enough force to push out the cube from the unsorted channel on to the sorting tray
-    motor_G.set_position_relative(80)
-    time.sleep(1)
-    motor_G.set_position_relative(-80)
-    time.sleep(1)
+    # waits until the piston is out, at most 1 second, then until it is back
+    with span("push command"):
+        push = motor_G.move_by(80, timeout=1)
+    with span("push settle"):
+        push.wait()
+    with span("return command"):
+        back = motor_G.move_to(push.target - 80, timeout=1)
+    with span("return settle"):
+        back.wait()
+    return push, back
     
     # Optional logging    
     '''
@@ -166,6 +216,89 @@ def piston_movement_G(i):
         print("actual speed=", motor_left.get_dps(), "actual power=", motor_left.get_power(), "status=", motor_left.get_status())
     '''
 
+
+PISTONS = {'R': piston_movement_R, 'G': piston_movement_G, 'B': piston_movement_B}
+
+
+def collect_color_sample(samples=None):
+    """
+    Sample the color sensor until the color is clear. Return the normalized (r, g, b), or None.
+    The raw readings are appended to samples, if given.
+    """
+    print("Collect Color samples")
+    detector = StreamingColorDetector(CLASSIFIER, max_samples=9) # stops sampling once the color is clear
+    while not detector.done:
+        with span("sample delay"):
+            wait_ready_sensors() # safety measures
+            time.sleep(0.1)
+        with span("sample"):
+            new_color_data = COLOR_SENSOR_SORT.get_rgb()  # RGB value[0, 255] 
+        print(new_color_data)
+        if samples is not None:
+            samples.append(new_color_data)
+        detector.add(new_color_data) # None readings are skipped
+
+    # the median is robust to outliers, unlike the sum
+    if detector.estimate() is None:
+        print('Got None!')
+        REJECTS.labels("no_sample").inc()
+        return None
+    r, g, b = detector.estimate()
+
+    # normalize to account for different brightness 
+    denominator = m.sqrt(r ** 2 + g ** 2 + b ** 2)
+
+    # we may encounter zero division here
+    if denominator == 0:
+        print('Got Zero Denominator!')
+        REJECTS.labels("zero_denominator").inc()
+        return None
+
+    # normalize 
+    return r/denominator, g/denominator, b/denominator
+
+
+def start_trace(number):
+    "Start the trace of a cube from the time its touch sensor press was read, with that delay as the touch span."
+    event = TOUCH_SENSOR_SORT.last_press
+    now = time.monotonic()
+    if event is None:
+        return TRACER.start(number)
+    trace = TRACER.start(number, start=event.time)
+    trace.add("touch", event.time, now)
+    return trace
+
+
+def finish_trace(trace):
+    "End the trace of a cube, and count its cycle time."
+    trace.finish()
+    CYCLE_SECONDS.observe(trace.end - trace.start)
+    with FINISHED_LOCK:
+        FINISHED.append(trace.end)
+    cubes_per_minute()  # forgets the older cubes
+
+
+def count_cube(color):
+    "Count a classified cube as sorted, or as rejected if no piston sorts its color."
+    if color in PISTONS:
+        CUBES.labels(color).inc()
+    else:
+        REJECTS.labels("no_piston").inc()
+
+
+def log_cube(session_log, cube):
+    "Append a cube dict (see the pipeline stages) to the session log, and count it as rejected if it hit an error."
+    moves = cube.get("moves", ())
+    status = next((move.status for move in moves if not move.reached), "reached")
+    session_log.write(time=cube["start"], cube=cube["number"], samples=cube["samples"], rgb=cube.get("rgb"),
+                      color=cube.get("color"), confidence=cube.get("confidence"),
+                      targets={move.motor._port_name(): move.target for move in moves[:1]}, # the push
+                      statuses={move.motor._port_name(): status for move in moves[:1]},
+                      stages=cube["stages"], outcome=cube.get("outcome", "sorted"))
+    if cube.get("outcome") == "error":
+        REJECTS.labels("error").inc()
+
+
 '''
 Request Sorting Module + Color Detection Module A
 
@@ -176,59 +309,154 @@ Readings taken from color sensor are then handled by our color detection module
 '''
 def color_movement(args):
     "Collect color sensor data."
+    output_file = open(args.file_output, "w+") if args.file_output else None
+    session_log = SessionLog(args.session_log)
+    number = 0
     try:
-        output_file = open(args.file_output, "w+")
         while True: # polling loop
-            if TOUCH_SENSOR_SORT.is_pressed():
+            if TOUCH_SENSOR_SORT.wait_for_press(): # sleeps until the next press
                 start = time.time()
-               
-                print("Touch sensor pressed")
-                print("Collect Color samples")
-                r, g, b = 0, 0, 0
-                for i in range(9): # sample a batch to ensure outliers can be smoothed out by averaging
-                        wait_ready_sensors() # safety measures
-                        time.sleep(0.1)
-                        new_color_data = COLOR_SENSOR_SORT.get_rgb()  # RGB value[0, 255] 
-                        print(new_color_data)
-
-                        # we may encounter None here
-                        try:
-                            r += float(new_color_data[0])
-                            g += float(new_color_data[1])
-                            b += float(new_color_data[2])
-                        except Exception as e:
-                            print(f'Got None! {e}')
+                number += 1
+                cube = {"start": start, "number": number, "samples": [], "stages": {}, "outcome": "error"}
+                trace = start_trace(number)
+
+                try: # logs and traces the cube even if a step fails
+                    with trace.active():
+                        print("Touch sensor pressed")
+                        stage_start = time.monotonic()
+                        rgb = collect_color_sample(cube["samples"])
+                        cube["stages"]["detect"] = time.monotonic() - stage_start
+                        if rgb is None:
+                            cube["outcome"] = "dropped"
                             continue
-                
+                        r, g, b = rgb
+
+                        stage_start = time.monotonic()
+                        result, cube["moves"] = color2position(r, g, b)
+                        cube["stages"]["actuate"] = time.monotonic() - stage_start
+                        cube.update(rgb=rgb, color=result.color, confidence=result.confidence,
+                                    outcome="sorted" if result.color in PISTONS else "dropped")
+                        count_cube(result.color)
+
+                        if output_file:
+                            output_file.write(f"{r}, {g}, {b}\n")
+                        with span("idle"):
+                            time.sleep(1)
+                finally:
+                    log_cube(session_log, cube)
+                    finish_trace(trace)
+                print(f'Time elapsed {time.time()-start}')
 
-                # normalize to account for different brightness 
-                denominator = m.sqrt(r ** 2 + g ** 2 + b ** 2)
 
-                # we may encounter zero division here
-                if denominator == 0:
-                        print('Got Zero Denominator!')
-                        continue
+    except Exception as e:  # capture all exceptions including KeyboardInterrupt (Ctrl-C)
+            print(e)
+            pass
+
+    finally:
+            print("Done collecting Color samples")
+            session_log.close()
+            if output_file:
+                output_file.close()
 
-                # normalize 
-                r = r/denominator
-                g = g/denominator
-                b = b/denominator
 
-                move = color2position(r, g, b)
-                
-                output_file.write(f"{r}, {g}, {b}\n")
-                time.sleep(1) 
-                print(f'Time elapsed {time.time()-start}')
+'''
+Pipelined Sorting
 
+Same steps as color_movement, each running on its own thread: the next cube is sampled
+while the piston is still pushing the previous one. Each stage takes and returns a dict
+describing the cube, or returns None to drop it.
+'''
+def logged_stage(name, stage, session_log, last=False):
+    """
+    Wrap a stage to time it in cube['stages'] and as a span of the cube trace,
+    and log the cube once it is dropped, stopped by an error, or done after the last stage.
+    """
+    def run(cube):
+        start = time.monotonic()
+        outcome = "error"
+        try:
+            with cube["trace"].active(), span(name):
+                result = stage(cube)
+            outcome = "sorted" if result is not None else "dropped"
+            return result
+        finally:
+            cube["stages"][name] = time.monotonic() - start
+            if outcome != "sorted" or last:
+                cube["outcome"] = outcome
+                log_cube(session_log, cube)
+                finish_trace(cube["trace"])
+    return run
+
+
+def detect_stage(cube):
+    cube["rgb"] = collect_color_sample(cube["samples"])
+    return cube if cube["rgb"] is not None else None
+
+
+def classify_stage(cube):
+    print(*cube["rgb"])
+    result = CLASSIFIER.classify(cube["rgb"])
+    cube["color"], cube["confidence"] = result.color, result.confidence
+    print(f'Identified Color {cube["color"]}')
+    count_cube(cube["color"])
+    return cube if cube["color"] in PISTONS else None
+
+
+def route_stage(cube):
+    print(f'Moving To Position: {LOOKUPTABLE[cube["color"]]}')
+    cube["piston"] = PISTONS[cube["color"]]
+    return cube
+
+
+def actuate_stage(cube):
+    cube["moves"] = cube["piston"](0)
+    return cube
+
+
+def confirm_stage(cube, output_file):
+    for move in cube["moves"]:
+        if not move.reached:
+            print(f'Piston {cube["color"]} {move.status} after {move.elapsed:.2f} s')
+    if output_file:
+        r, g, b = cube["rgb"]
+        output_file.write(f"{r}, {g}, {b}\n")
+    print(f'Time elapsed {time.time()-cube["start"]}')
+    return cube
+
+
+def color_movement_pipeline(args):
+    "Collect color sensor data and sort cubes, with the steps for consecutive cubes overlapping."
+    output_file = open(args.file_output, "w+") if args.file_output else None
+    session_log = SessionLog(args.session_log)
+    stages = [("detect", detect_stage),
+              ("classify", classify_stage),
+              ("route", route_stage),
+              ("actuate", actuate_stage),
+              ("confirm", lambda cube: confirm_stage(cube, output_file))]
+    pipeline = Pipeline([(name, logged_stage(name, stage, session_log, last=name == "confirm"))
+                         for name, stage in stages])
+    pipeline.start()
+    number = 0
+    try:
+        while True: # polling loop
+            if TOUCH_SENSOR_SORT.wait_for_press(): # sleeps until the next press
+                print("Touch sensor pressed")
+                number += 1
+                # waits while the previous cube is being sampled
+                pipeline.put({"start": time.time(), "number": number, "samples": [], "stages": {},
+                              "trace": start_trace(number)})
 
     except Exception as e:  # capture all exceptions including KeyboardInterrupt (Ctrl-C)
             print(e)
-            pass
 
     finally:
+            pipeline.close()
+            print(pipeline.report())
             print("Done collecting Color samples")
-            output_file.close()
-                    
+            session_log.close()
+            if output_file:
+                output_file.close()
+
 
 def test_motor(pos):
     
@@ -241,7 +469,13 @@ def test_motor(pos):
 if __name__ == "__main__":
     parser = add_argparser()
     args, _ = parser.parse_known_args()
-    color_movement(args)
+    TRACER.install()
+    exporter = MetricsExporter(port=args.metrics_port or None, json_path=args.metrics_json).start()
+    if args.pipeline:
+        color_movement_pipeline(args)
+    else:
+        color_movement(args)
+    exporter.close()
        
     
     
@@ -8,6 +8,7 @@ January 24th, 2022
 """
 
 from utils.brick import Motor, BP, EV3ColorSensor, TouchSensor, configure_ports, wait_ready_sensors
+from logic import ColorClassifier, StreamingColorDetector, TrayPlanner
 import time
 import math as m
 import argparse
@@ -42,16 +43,21 @@ motor_push.reset_encoder()
 TOUCH_SENSOR_SORT, COLOR_SENSOR_SORT = configure_ports(PORT_1=TouchSensor, PORT_2=EV3ColorSensor)
 # Works with motor_push.set_position(0)
 PISTON_ANGLE = [-90,  -130,  -180,  -250, -280, -360]
+PUSH_TIMEOUT = 2 # seconds before giving up on a push or on pulling the piston back
 
 # colorss
 COLORS = {'R': (1.0, 0.1, 0.1),
           'G': (0.1, 1.0, 0.1), 
           'B': (0.3, 0.6, 0.7), 
           'Y': (0.8, 0.6, 0.0),}
+CLASSIFIER = ColorClassifier(COLORS)
 
 # mapping colors to sounds
 LOOKUPTABLE_B = {'R': 0, 'G': 60, 'B': -50}
 LOOKUPTABLE_C = {'R': 0, 'G': -60, 'B': 50}
+# the tray goes straight from one bin to the next, with both motors arriving together
+TRAY_MOTORS = (motor_rotate_b, motor_rotate_c)
+TRAY_PLANNER = TrayPlanner({color: (LOOKUPTABLE_B[color], LOOKUPTABLE_C[color]) for color in LOOKUPTABLE_B})
 
 '''
 Sorting Tray Module
@@ -65,24 +71,25 @@ Output: call to set_position subroutine
 '''
 def color2position(r, g, b, cubenumber):
     print(r, g, b)
-    minsqerror = 1e99
-    bestfit = 'R'
-    for c in COLORS.keys():
-        sqerror = (r-COLORS[c][0])**2 + (g-COLORS[c][1])**2 +(b-COLORS[c][2])**2
-        if sqerror < minsqerror:
-            bestfit = c
-            minsqerror = sqerror
+    bestfit = CLASSIFIER.classify((r, g, b)).color
 
     print(f'Identified Color {bestfit}')
-    print(f'Moving To Position: {LOOKUPTABLE_C[bestfit]}')
-    motor_rotate_c.set_position(LOOKUPTABLE_C[bestfit])
-    motor_rotate_b.set_position(LOOKUPTABLE_B[bestfit])
-    time.sleep(2)
-    motor_push.set_position_relative(PISTON_ANGLE[cubenumber])
-    time.sleep(2)
-    motor_rotate_b.set_position(0)
-    motor_rotate_c.set_position(0)
-    motor_push.set_position(0)
+    if not rotate_tray(bestfit):
+        return
+    motor_push.move_by(PISTON_ANGLE[cubenumber], timeout=PUSH_TIMEOUT).wait()
+    motor_push.move_to(0, timeout=PUSH_TIMEOUT).wait()
+
+
+def rotate_tray(color):
+    "Turn the tray from where it is to the bin of color. Return True once both motors got there."
+    plan = TRAY_PLANNER.plan([motor.get_encoder() for motor in TRAY_MOTORS], color)
+    if plan is None:
+        print(f'No bin for color {color}')
+        return False
+    print(f'Moving To Position: {plan.targets}, expected {plan.duration:.2f} s')
+    moves = [motor.move_to(target, dps=dps, timeout=plan.duration * 2 + 0.5)
+             for motor, target, dps in zip(TRAY_MOTORS, plan.targets, plan.dps)]
+    return all([move.wait() for move in moves])
 
 '''
 Request Sorting Module + Color Detection Module A
@@ -98,25 +105,23 @@ def color_movement(args):
     try:
         output_file = open(args.file_output, "w+")
         while True: # polling loop
-            if TOUCH_SENSOR_SORT.is_pressed():
+            if TOUCH_SENSOR_SORT.wait_for_press(): # sleeps until the next press
                 start = time.time()
                 print("Touch sensor pressed")
                 print("Collect Color samples")
-                r, g, b = 0, 0, 0
-                for i in range(9): # sample a batch to ensure outliers can be smoothed out by averaging
+                detector = StreamingColorDetector(CLASSIFIER, max_samples=9) # stops sampling once the color is clear
+                while not detector.done:
                         wait_ready_sensors() # safety measures
                         time.sleep(0.1)
                         new_color_data = COLOR_SENSOR_SORT.get_rgb()  # RGB value[0, 255] 
                         print(new_color_data)
+                        detector.add(new_color_data) # None readings are skipped
 
-                        # we may encounter None here
-                        try:
-                            r += float(new_color_data[0])
-                            g += float(new_color_data[1])
-                            b += float(new_color_data[2])
-                        except Exception as e:
-                            print(f'Got None! {e}')
-                            continue
+                # the median is robust to outliers, unlike the sum
+                if detector.estimate() is None:
+                        print('Got None!')
+                        continue
+                r, g, b = detector.estimate()
                 
 
                 # normalize to account for different brightness 
@@ -5,8 +5,8 @@ Author: Anjun Hu
 January 24th, 2022
 """
 
-from project.utils.brick import EV3GyroSensor
-from utils.brick import Motor, BP, EV3ColorSensor, TouchSensor, configure_ports, wait_ready_sensors
+from utils.brick import Motor, BP, EV3ColorSensor, EV3GyroSensor, TouchSensor, configure_ports, wait_ready_sensors
+from logic import ColorClassifier, StreamingColorDetector, TrayPlanner, PushController
 import time
 import math as m
 import argparse
@@ -18,6 +18,7 @@ def add_argparser():
     parser.add_argument('--ts_delay', type=float, required=False, default='0.5', help='touch sensor delay')
     parser.add_argument('--color_delay', type=float, required=False, default='0.01', help='color sensor delay')
     parser.add_argument('--batch_size', type=int, required=False, default='5', help='number of samples to take per touch sensor press')
+    parser.add_argument('--push-log', type=str, required=False, default=None, help='Path to write the step response of each push to, for tuning.')
     return parser
 
 
@@ -46,10 +47,17 @@ COLORS = {'R': (1.0, 0.1, 0.1),
           'G': (0.1, 1.0, 0.1), 
           'B': (0.3, 0.6, 0.7), 
           'Y': (0.8, 0.6, 0.0),}
-threshhold = 30#can be altered
+CLASSIFIER = ColorClassifier(COLORS)
+threshold = 30#can be altered
+PUSH_CONTROL_INTERVAL = 0.005 # seconds between gyro readings while pushing
+PUSH_TIMEOUT = 5 # seconds before giving up on a push
+PUSH_SETTLE_TIME = 0.2 # seconds the gyro is still recorded after stopping, to see the overshoot
 # mapping colors to sounds
 LOOKUPTABLE_B = {'R': 0, 'G': 60, 'B': -50}
 LOOKUPTABLE_C = {'R': 0, 'G': -60, 'B': 50}
+# the tray goes straight from one bin to the next, with both motors arriving together
+TRAY_MOTORS = (motor_rotate_b, motor_rotate_c)
+TRAY_PLANNER = TrayPlanner({color: (LOOKUPTABLE_B[color], LOOKUPTABLE_C[color]) for color in LOOKUPTABLE_B})
 
 '''
 Sorting Tray Module
@@ -59,29 +67,54 @@ from the sorting tray on to the respective color channel.
 Input: normalized rgb values
 Output: call to set_position subroutine
 '''
-def color2position(r, g, b, cubenumber):
+def color2position(r, g, b, cubenumber, push_log=None):
     print(r, g, b)
-    minsqerror = 1e99
-    bestfit = 'R'
-    for c in COLORS.keys():
-        sqerror = (r-COLORS[c][0])**2 + (g-COLORS[c][1])**2 +(b-COLORS[c][2])**2
-        if sqerror < minsqerror:
-            bestfit = c
-            minsqerror = sqerror
+    bestfit = CLASSIFIER.classify((r, g, b)).color
 
     print(f'Identified Color {bestfit}')
-    print(f'Moving To Position: {LOOKUPTABLE_C[bestfit]}')
-    motor_rotate_c.set_position(LOOKUPTABLE_C[bestfit])
-    motor_rotate_b.set_position(LOOKUPTABLE_B[bestfit])
-    time.sleep(2)
-    while(GYROS_SENSOR.get_abs_measure()<threshold):
-
-        motor_push.set_position_relative(1)
-        time.sleep(0.5)
-    time.sleep(2)
-    motor_rotate_b.set_position(0)
-    motor_rotate_c.set_position(0)
-    motor_push.set_position(0)
+    if not rotate_tray(bestfit):
+        return
+    controller = push_until_tilted(threshold)
+    print(controller.summary())
+    if push_log is not None:
+        controller.write_csv(push_log, label=cubenumber)
+    motor_push.move_to(0, timeout=1).wait()
+
+
+def push_until_tilted(target):
+    "Push until the gyro angle reaches target, fast at first and slowing down near it. Return the controller."
+    controller = PushController(target)
+    deadline = time.monotonic() + PUSH_TIMEOUT
+    try:
+        while not controller.done and time.monotonic() < deadline:
+            measure = GYROS_SENSOR.get_both_measure() # [angle, rate] without switching modes
+            if measure is not None:
+                angle, rate = measure
+                motor_push.set_dps(controller.step(time.monotonic(), angle, rate))
+            time.sleep(PUSH_CONTROL_INTERVAL)
+    finally:
+        motor_push.set_dps(0)
+    if not controller.done:
+        print(f'Push did not reach {target} in {PUSH_TIMEOUT} s')
+    settled = time.monotonic() + PUSH_SETTLE_TIME
+    while time.monotonic() < settled: # keep recording to see how far the gyro goes after stopping
+        measure = GYROS_SENSOR.get_both_measure()
+        if measure is not None:
+            controller.step(time.monotonic(), *measure)
+        time.sleep(PUSH_CONTROL_INTERVAL)
+    return controller
+
+
+def rotate_tray(color):
+    "Turn the tray from where it is to the bin of color. Return True once both motors got there."
+    plan = TRAY_PLANNER.plan([motor.get_encoder() for motor in TRAY_MOTORS], color)
+    if plan is None:
+        print(f'No bin for color {color}')
+        return False
+    print(f'Moving To Position: {plan.targets}, expected {plan.duration:.2f} s')
+    moves = [motor.move_to(target, dps=dps, timeout=plan.duration * 2 + 0.5)
+             for motor, target, dps in zip(TRAY_MOTORS, plan.targets, plan.dps)]
+    return all([move.wait() for move in moves])
 
 '''
 Request Sorting Module + Color Detection Module A
@@ -93,28 +126,29 @@ Readings taken from color sensor are then handled by our color detection module
 def color_movement(args):
     cubenumber = 0
     "Collect color sensor data."
+    push_log = None
     try:
         output_file = open(args.file_output, "w+")
+        if args.push_log:
+            push_log = open(args.push_log, "w")
         while True: # polling loop
-            if TOUCH_SENSOR_SORT.is_pressed():
+            if TOUCH_SENSOR_SORT.wait_for_press(): # sleeps until the next press
                 start = time.time()
                 print("Touch sensor pressed")
                 print("Collect Color samples")
-                r, g, b = 0, 0, 0
-                for i in range(9): # sample a batch to ensure outliers can be smoothed out by averaging
+                detector = StreamingColorDetector(CLASSIFIER, max_samples=9) # stops sampling once the color is clear
+                while not detector.done:
                         wait_ready_sensors() # safety measures
                         time.sleep(0.1)
                         new_color_data = COLOR_SENSOR_SORT.get_rgb()  # RGB value[0, 255] 
                         print(new_color_data)
+                        detector.add(new_color_data) # None readings are skipped
 
-                        # we may encounter None here
-                        try:
-                            r += float(new_color_data[0])
-                            g += float(new_color_data[1])
-                            b += float(new_color_data[2])
-                        except Exception as e:
-                            print(f'Got None! {e}')
-                            continue
+                # the median is robust to outliers, unlike the sum
+                if detector.estimate() is None:
+                        print('Got None!')
+                        continue
+                r, g, b = detector.estimate()
                 
 
                 # normalize to account for different brightness 
@@ -130,7 +164,7 @@ def color_movement(args):
                 g = g/denominator
                 b = b/denominator
 
-                move = color2position(r, g, b, min(len(PISTON_ANGLE),cubenumber))
+                move = color2position(r, g, b, min(len(PISTON_ANGLE),cubenumber), push_log)
                 
                 output_file.write(f"{r}, {g}, {b}\n")
                 time.sleep(1) 
@@ -144,6 +178,8 @@ def color_movement(args):
     finally:
             print("Done collecting Color samples")
             output_file.close()
+            if push_log is not None:
+                push_log.close()
                     
 
 if __name__ == "__main__":
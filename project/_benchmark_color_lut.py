@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark of color classification: the direct ColorClassifier against a compiled ColorLookupTable,
+on replayed samples from an 'r, g, b' log file, or on simulated cube readings if no log is given.
+
+Usage: python3 _benchmark_color_lut.py [log file] [--bins 32] [--samples 20000]
+"""
+
+from logic import COLORS, ColorClassifier, ColorLookupTable, read_rgb_log
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+CUBE_RGB = [(110, 14, 12), (15, 95, 18), (22, 48, 60), (120, 90, 5)]  # red, green, blue, yellow
+
+
+def simulated_samples(n: int, seed: int = 0) -> np.ndarray:
+    "Readings of random cubes with sensor noise and brightness changes."
+    rng = np.random.default_rng(seed)
+    cubes = np.array(CUBE_RGB, dtype=float)[rng.integers(len(CUBE_RGB), size=n)]
+    brightness = rng.uniform(0.5, 2.0, size=(n, 1))
+    return np.clip(cubes * brightness + rng.normal(0, 6, size=(n, 3)), 0, 255)
+
+
+def timed(func, *args) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def benchmark(samples: np.ndarray, bins: int = 32, threshold: float = 0.3) -> dict:
+    classifier = ColorClassifier(COLORS, threshold=threshold)
+    results = {}
+    results["compile"], table = timed(ColorLookupTable.compile, classifier, bins)
+    fd, path = tempfile.mkstemp(suffix=".lut")
+    os.close(fd)
+    try:
+        table.save(path)
+        results["load (mmap)"], table = timed(ColorLookupTable.load, path)
+        rows = [tuple(sample) for sample in samples.tolist()]
+        results["direct, per sample"], direct = timed(lambda: [classifier.classify(s).color for s in rows])
+        results["lookup table, per sample"], lut = timed(lambda: [table.classify(s) for s in rows])
+        results["direct, batch"], direct_batch = timed(classifier.classify_batch, samples)
+        results["lookup table, batch"], lut_batch = timed(table.classify_batch, samples)
+        results["agreement"] = float(np.mean(direct_batch.colors == lut_batch))
+        del table  # release the memory map before removing the file
+    finally:
+        os.remove(path)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("log", nargs="?", help="'r, g, b' log file to replay, eg, music.log")
+    parser.add_argument("--bins", type=int, default=32, help="cells per color component")
+    parser.add_argument("--samples", type=int, default=20000, help="number of simulated samples without a log")
+    args = parser.parse_args()
+
+    samples = read_rgb_log(args.log) if args.log else simulated_samples(args.samples)
+    print(f"{len(samples)} samples, {args.bins}x{args.bins}x{args.bins} lookup table")
+    results = benchmark(samples, args.bins)
+    for name, value in results.items():
+        if name == "agreement":
+            print(f"{name:>26}: {value * 100:.2f}% same verdicts")
+        elif "per sample" in name or "batch" in name:
+            print(f"{name:>26}: {value * 1000:8.2f} ms ({value * 1e6 / len(samples):.3f} us/sample)")
+        else:
+            print(f"{name:>26}: {value * 1000:8.2f} ms")
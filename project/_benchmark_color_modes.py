@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark of color sensor reads mixing ambient light and RGB, run on the simulated BrickPi3 with a virtual clock:
+the getters one after the other against a ColorReadScheduler serving the same reads in batches.
+
+Each round asks for the ambient light and the RGB values of a cube, as a brightness-corrected reading would.
+
+Usage: python3 _benchmark_color_modes.py [--rounds 20] [--batch 5] [--max-age 0.05]
+"""
+
+from utils import brick
+from utils.brick import EV3ColorSensor, ColorReadScheduler, COLOR_CACHE_MAX_AGE
+from utils.simulation import SimulatedBrickPi3, VirtualClock
+import argparse
+import time
+
+
+def run(rounds: int, batch: int, max_age: float, scheduled: bool) -> tuple[float, int, float]:
+    "Return the virtual seconds taken, the number of mode switches, and the seconds spent in them."
+    clock = VirtualClock()
+    sim = SimulatedBrickPi3(clock=clock)
+    previous = brick.set_backend(sim)
+    try:
+        with clock.patch_time_module():
+            sim.set_sensor_value(2, [110, 14, 12])
+            color = EV3ColorSensor(2)
+            color.wait_ready()
+            scheduler = ColorReadScheduler(color, max_age)
+            start = time.monotonic()
+            for i in range(rounds):
+                if scheduled:
+                    scheduler.request(EV3ColorSensor.Mode.AMBIENT)
+                    scheduler.request(EV3ColorSensor.Mode.COMPONENT)
+                    if (i + 1) % batch == 0:
+                        scheduler.run()
+                else:
+                    color.get_ambient()
+                    color.get_rgb()
+                time.sleep(0.01)  # time between rounds
+            scheduler.run()
+            return time.monotonic() - start, color.mode_switches, color.mode_switch_time
+    finally:
+        brick.set_backend(previous)
+        brick.Sensor.ALL_SENSORS["2"] = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=20, help="ambient and RGB reads to make")
+    parser.add_argument("--batch", type=int, default=5, help="rounds queued before the scheduler serves them")
+    parser.add_argument("--max-age", type=float, default=COLOR_CACHE_MAX_AGE, help="staleness bound of the cache")
+    args = parser.parse_args()
+
+    print(f"{args.rounds} rounds of an ambient and an RGB read")
+    for name, scheduled in [("getters", False), (f"scheduler, batches of {args.batch}", True)]:
+        elapsed, switches, switch_time = run(args.rounds, args.batch, args.max_age, scheduled)
+        print(f"{name:>24}: robot {elapsed:6.2f} s, {switches:3} mode switches taking {switch_time:6.2f} s "
+              f"({switch_time / elapsed * 100:.0f}%)")
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark of post-processing a long gyro trace with utils.filters: integration, IntegrationTracker
+and a window filter, on Python lists against NumPy arrays.
+
+Usage: python3 _benchmark_filters.py [--samples 300000] [--width 25]
+"""
+
+from utils.filters import IntegrationTracker, MedianFilter, MeanFilter, integration
+import argparse
+import time
+
+import numpy as np
+
+SAMPLE_TIME = 0.01  # seconds between gyro readings
+
+
+def simulated_trace(n: int, seed: int = 0) -> np.ndarray:
+    "Gyro angular speeds (deg/s) of a robot turning back and forth, with sensor noise."
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) * SAMPLE_TIME
+    return 90 * np.sin(t) + rng.normal(0, 2, n)
+
+
+def timed(func, *args) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def track(values, typed: bool) -> IntegrationTracker:
+    tracker = IntegrationTracker(typed=typed)
+    tracker.extend(values)
+    return tracker
+
+
+def benchmark(trace: np.ndarray, width: int = 25) -> dict:
+    samples = trace.tolist()
+    results = {}
+    results["integration, list"], a = timed(integration, samples, SAMPLE_TIME)
+    results["integration, array"], b = timed(integration, trace, SAMPLE_TIME)
+    assert np.allclose(a, b)
+    results["IntegrationTracker, list"], a = timed(track, samples, False)
+    results["IntegrationTracker, typed"], b = timed(track, trace, True)
+    assert np.allclose(a[:], b.to_numpy())
+    for cls in (MeanFilter, MedianFilter):
+        results[f"{cls.__name__}, list"], a = timed(lambda: cls(samples, width)[:])
+        results[f"{cls.__name__}, array"], b = timed(lambda: cls(trace, width)[:])
+        assert np.allclose(a, b)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=300000, help="number of gyro readings")
+    parser.add_argument("--width", type=int, default=25, help="window filter width")
+    args = parser.parse_args()
+
+    trace = simulated_trace(args.samples)
+    print(f"{len(trace)} samples ({len(trace) * SAMPLE_TIME / 3600:.1f} h at {1 / SAMPLE_TIME:.0f} Hz)")
+    for name, value in benchmark(trace, args.width).items():
+        print(f"{name:>28}: {value * 1000:8.2f} ms")
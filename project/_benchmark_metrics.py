@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark of the cost of metrics: how long one counter increment, gauge update or histogram observation takes,
+and a call to the simulated BrickPi3 (without its SPI latency) through the locked, counted Brick handle or directly.
+
+Usage: python3 _benchmark_metrics.py [--repeat 200000]
+"""
+
+from utils import brick
+from utils.metrics import Registry
+from utils.simulation import SimulatedBrickPi3, VirtualClock
+import argparse
+import time
+
+
+def per_call(func, repeat: int) -> float:
+    "Return the seconds per call of func."
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def benchmark(repeat: int) -> dict:
+    registry = Registry()
+    cubes = registry.counter("sort_cubes_total", "Cubes sorted", labels=("color",))
+    red = cubes.labels("R")
+    queue = registry.gauge("queue", "Items waiting")
+    cycle = registry.histogram("cycle_seconds", "Cycle time")
+    empty = per_call(lambda: None, repeat)
+    results = {
+        "counter, labels each time": per_call(lambda: cubes.labels("R").inc(), repeat) - empty,
+        "counter, labels kept": per_call(lambda: red.inc(), repeat) - empty,
+        "gauge set": per_call(lambda: queue.set(3), repeat) - empty,
+        "histogram observe": per_call(lambda: cycle.observe(0.42), repeat) - empty,
+    }
+
+    sim = SimulatedBrickPi3(clock=VirtualClock(), spi_latency=0)
+    previous = brick.set_backend(sim)
+    try:
+        counted = brick.Brick()
+        results["bus call, locked and counted"] = per_call(lambda: counted.get_motor_status(sim.PORT_A), repeat // 10)
+        results["bus call, direct"] = per_call(lambda: sim.get_motor_status(sim.PORT_A), repeat // 10)
+    finally:
+        brick.set_backend(previous)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=200000, help="updates to time")
+    args = parser.parse_args()
+
+    for name, seconds in benchmark(args.repeat).items():
+        print(f"{name:>29}: {seconds * 1e6:.2f} us")
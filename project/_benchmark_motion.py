@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark of motor moves with and without motion profiles, run on the simulated BrickPi3 with a virtual clock.
+
+Each profile moves a motor back and forth by the piston and tray distances of the sort scripts, and reports
+how long the moves take until the motor has settled on its target, and how far past the target it went.
+"direct" is how the scripts moved before motion profiles: a high speed limit and the motor's own position control.
+
+Usage: python3 _benchmark_motion.py [--dps 1560] [--acceleration 10000] [--jerk 200000]
+"""
+
+from utils import brick
+from utils.brick import Motor, ProfiledMove, MOVE_POLL_INTERVAL
+from utils.motion import MotionProfile
+from utils.simulation import SimulatedBrickPi3, VirtualClock
+import argparse
+import statistics
+import time
+
+DISTANCES = [60, 80, 90, 110, 240]  # degrees, pistons of DeliverySystem and the tray
+DIRECT_DPS = 5500  # speed limit DeliverySystem used for its pistons
+
+
+def run_moves(profile: MotionProfile | None, distances: list[float]) -> list[tuple[float, float]]:
+    "Move out and back by each distance. Return the (seconds, overshoot in degrees) of every move."
+    clock = VirtualClock()
+    sim = SimulatedBrickPi3(clock=clock)
+    previous = brick.set_backend(sim)
+    results = []
+    try:
+        with clock.patch_time_module():
+            motor = Motor("A")
+            for distance in distances:
+                for step in (distance, -distance):
+                    start = motor.get_encoder()
+                    if profile is None:
+                        move = motor.move_to(start + step, dps=DIRECT_DPS)
+                    else:
+                        move = ProfiledMove(motor, profile.trajectory(start, start + step), profile, thread=False)
+                        move.start()
+                    furthest = 0.0
+                    while not move.poll():
+                        furthest = max(furthest, (sim.motors[0].position - move.target) * (1 if step > 0 else -1))
+                        time.sleep(MOVE_POLL_INTERVAL)
+                    results.append((move.elapsed, furthest))
+    finally:
+        brick.set_backend(previous)
+        brick.Motor.ALL_MOTORS["A"] = None
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dps", type=float, default=Motor.MAX_SPEED, help="cruise speed of the profiles")
+    parser.add_argument("--acceleration", type=float, default=MotionProfile().acceleration)
+    parser.add_argument("--jerk", type=float, default=MotionProfile().jerk, help="jerk of the S-curve profile")
+    args = parser.parse_args()
+
+    profiles = {
+        "direct": None,
+        "trapezoidal": MotionProfile("trapezoidal", args.dps, args.acceleration),
+        "s-curve": MotionProfile("s-curve", args.dps, args.acceleration, args.jerk),
+    }
+    print(f"{len(DISTANCES) * 2} moves of {', '.join(map(str, DISTANCES))} degrees, out and back")
+    print(f"{'profile':>12} {'mean s':>8} {'max s':>8} {'mean overshoot':>15} {'max overshoot':>14}")
+    for name, profile in profiles.items():
+        results = run_moves(profile, DISTANCES)
+        times, overshoots = zip(*results)
+        print(f"{name:>12} {statistics.mean(times):>8.3f} {max(times):>8.3f} "
+              f"{statistics.mean(overshoots):>15.2f} {max(overshoots):>14.2f}")
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark of port configuration on the simulated BrickPi3: the computer time and memory it takes to create
+the sensors and motors of the sort scripts, without waiting for the sensors (wait=False),
+and the robot startup time with four sensors, waited for one after the other or in parallel.
+
+Usage: python3 _benchmark_ports.py [--repeat 2000]
+"""
+
+from utils import brick
+from utils.brick import EV3ColorSensor, EV3GyroSensor, EV3UltrasonicSensor, Motor, TouchSensor, configure_ports
+from utils.simulation import SimulatedBrickPi3, VirtualClock
+import argparse
+import time
+import tracemalloc
+
+
+def configure():
+    return configure_ports(PORT_1=TouchSensor, PORT_2=EV3ColorSensor, PORT_3=EV3GyroSensor,
+                           PORT_A=Motor, PORT_B=Motor, PORT_C=Motor, PORT_D=Motor, wait=False, print_status=False)
+
+
+def benchmark(repeat: int) -> dict:
+    previous = brick.set_backend(SimulatedBrickPi3(clock=VirtualClock(), spi_latency=0))
+    try:
+        configure()  # first configuration, outside of the measures
+        start = time.perf_counter()
+        for _ in range(repeat):
+            configure()
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        devices = [configure() for _ in range(100)]
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        memory = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+        del devices
+    finally:
+        brick.set_backend(previous)
+        for port in brick.Sensor.ALL_SENSORS:
+            brick.Sensor.ALL_SENSORS[port] = None
+        for port in brick.Motor.ALL_MOTORS:
+            brick.Motor.ALL_MOTORS[port] = None
+    return {"time": elapsed / repeat, "memory": memory / 100}
+
+
+def startup(parallel: bool) -> tuple[float, list]:
+    "Return the virtual seconds configure_ports takes with every sensor type, and the configured sensors."
+    clock = VirtualClock()
+    previous = brick.set_backend(SimulatedBrickPi3(clock=clock))
+    try:
+        with clock.patch_time_module():
+            start = clock.time()
+            devices = configure_ports(PORT_1=TouchSensor, PORT_2=EV3ColorSensor, PORT_3=EV3GyroSensor,
+                                      PORT_4=EV3UltrasonicSensor, PORT_A=Motor, parallel=parallel, print_status=False)
+            return clock.time() - start, devices[:4]
+    finally:
+        brick.set_backend(previous)
+        for port in brick.Sensor.ALL_SENSORS:
+            brick.Sensor.ALL_SENSORS[port] = None
+        brick.Motor.ALL_MOTORS["A"] = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=2000, help="number of port configurations to time")
+    args = parser.parse_args()
+
+    result = benchmark(args.repeat)
+    print(f"configure_ports with 3 sensors and 4 motors: {result['time'] * 1e6:.1f} us, "
+          f"{result['memory'] / 1024:.1f} KiB per configuration")
+    for parallel in (False, True):
+        elapsed, sensors = startup(parallel)
+        ready = ", ".join(f"{type(sensor).__name__} {sensor.ready_time:.2f} s" for sensor in sensors
+                          if sensor.ready_time is not None)
+        name = "parallel" if parallel else "sequential"
+        print(f"startup, {name}: robot {elapsed:.2f} s" + (f" ({ready})" if ready else ""))
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark of the color_movement sort loops, run on the simulated BrickPi3 with a virtual clock.
+
+Each run presses the touch sensor once per cube, shows the color sensor a red, green or blue cube,
+and reports how long the loop and each sort cycle take on the robot (virtual time) and on this computer (wall time).
+
+The pipelined DeliverySystem runs several threads, so it runs on a sped-up real clock instead of a virtual one.
+With presses closer together than one sort cycle, it sorts more of the cubes than the serial loop.
+
+Usage: python3 _benchmark_sort_loop.py [number of cubes] [--period seconds between presses]
+"""
+
+from utils import brick
+from utils.session_log import read_session_log
+from utils.simulation import SimulatedBrickPi3, VirtualClock, RealClock, StopSimulation
+import argparse
+import contextlib
+import importlib
+import io
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+SCRIPTS = [("DeliverySystem", []), ("DeliverySystem", ["--pipeline"]), ("color_detection_A", [])]
+CUBE_PERIOD = 10  # seconds between touch sensor presses, longer than one sort cycle
+REAL_CLOCK_SPEED = 10  # how much faster than real time scripts with threads run
+PRESS_DURATION = 0.05
+CUBE_RGB = [(110, 14, 12), (15, 95, 18), (22, 48, 60)]  # red, green, blue
+
+
+def simulate_operator(sim: SimulatedBrickPi3, cubes: int, period: float = CUBE_PERIOD, seed: int = 0):
+    "Script the touch sensor on port 1 and the color sensor on port 2 for the given number of cubes."
+    rng = random.Random(seed)
+    start = sim.clock.time()
+    end = period * (cubes + 1)
+
+    def touch(sim):
+        t = sim.clock.time() - start
+        if t > end:
+            raise StopSimulation("all cubes sorted")
+        return int(t >= period and t % period < PRESS_DURATION)
+
+    def color(sim):
+        cube = int((sim.clock.time() - start) // period) % len(CUBE_RGB)
+        return [max(0, c + rng.randint(-4, 4)) for c in CUBE_RGB[cube]]
+
+    sim.set_sensor_function(1, touch)
+    sim.set_sensor_function(2, color)
+
+
+def benchmark(script: str, cubes: int = 10, period: float = CUBE_PERIOD, argv: list[str] = ()) -> dict:
+    "Import the given script on a fresh simulator and run its color_movement loop."
+    pipelined = "--pipeline" in argv
+    clock = RealClock(speed=REAL_CLOCK_SPEED) if pipelined else VirtualClock()
+    sim = SimulatedBrickPi3(clock=clock)
+    previous = brick.set_backend(sim)
+    simulate_operator(sim, cubes, period)
+    start_time = clock.time()
+    saved = brick.Sensor.status_reads_saved
+    output = io.StringIO()
+    fd, log_path = tempfile.mkstemp(suffix=".log")
+    os.close(fd)
+    session_path = log_path + ".slog"
+    start = time.perf_counter()
+    try:
+        with clock.patch_time_module(), contextlib.redirect_stdout(output):
+            sys.modules.pop(script, None)
+            module = importlib.import_module(script)
+            args, _ = module.add_argparser().parse_known_args(["--file-output", log_path, "--session-log", session_path,
+                                                                *argv])
+            try:
+                if pipelined:
+                    module.color_movement_pipeline(args)
+                else:
+                    module.color_movement(args)
+            except SystemExit:
+                pass
+    finally:
+        wall_time = time.perf_counter() - start
+        brick.set_backend(previous)
+        os.remove(log_path)
+        logged = 0
+        if os.path.exists(session_path):
+            logged = len(read_session_log(session_path, mmap=False))
+            os.remove(session_path)
+    cycle_times = [float(t) for t in re.findall(r"Time elapsed ([0-9.]+)", output.getvalue())]
+    return {
+        "script": " ".join([script, *argv]),
+        "cubes": output.getvalue().count("Identified Color"),
+        "logged": logged,
+        "cycle_time": sum(cycle_times) / max(len(cycle_times), 1),
+        "robot_time": clock.time() - start_time,
+        "wall_time": wall_time,
+        "spi_transfers": sim.spi_transfers,
+        "saved_transfers": brick.Sensor.status_reads_saved - saved,
+        "report": re.findall(r"^ +stage .*?per minute.*?$", output.getvalue(), re.M | re.S),
+        "trace": module.TRACER.report() if hasattr(module, "TRACER") else None,
+    }
+
+
+def print_result(result: dict):
+    cubes = max(result["cubes"], 1)
+    print(f"{result['script']:>28}: {result['cubes']} cubes, "
+          f"robot {result['robot_time']:.1f} s ({result['cycle_time']:.2f} s/cube), computer {result['wall_time'] * 1000:.1f} ms "
+          f"({result['wall_time'] * 1000 / cubes:.2f} ms/cube), {result['spi_transfers']} SPI transfers "
+          f"({result['saved_transfers']} saved by cached sensor readiness)"
+          + (f", {result['logged']} cubes in the session log" if result["logged"] else ""))
+    for report in result["report"]:
+        print(report)
+    if result["trace"]:
+        print(result["trace"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("cubes", type=int, nargs="?", default=10, help="number of cubes to sort")
+    parser.add_argument("--period", type=float, default=CUBE_PERIOD, help="seconds between touch sensor presses")
+    args = parser.parse_args()
+    for script, argv in SCRIPTS:
+        print_result(benchmark(script, args.cubes, args.period, argv))
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark of sound synthesis: the pure Python wave generator against the NumPy one,
+and the cost of creating the same Sound again once its wave is cached.
+
+Usage: python3 _benchmark_sound.py [--duration 1] [--fs 8000]
+"""
+
+from utils import sound
+import argparse
+import time
+
+
+def timed(func, *args) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def benchmark(duration: float = 1, fs: int = 8000) -> dict:
+    params = (duration, sound.vol_to_amp(40), sound.NOTES["A4"], 10.0, 10, 0, 0, 1, 0.01, fs)
+    results = {}
+    results["python, one note"], python_wave = timed(sound._gen_wave, *params)
+    results["numpy, one note"], numpy_wave = timed(sound._gen_wave_numpy, *params)
+    results["identical samples"] = python_wave == numpy_wave
+
+    sound._cached_wave.cache_clear()
+    results["preload_all_pitches"], _ = timed(sound.preload_all_pitches, duration, 40, 0, 0, 0, 0, 1, 0.01, fs)
+    results["preload_all_pitches, cached"], _ = timed(sound.preload_all_pitches, duration, 40, 0, 0, 0, 0, 1, 0.01, fs)
+    results["Sound(), cached"], _ = timed(sound.Sound, duration, 40, "A4", 0, 0, 0, 0, 1, 0.01, fs)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=1, help="note duration in seconds")
+    parser.add_argument("--fs", type=int, default=8000, help="sample rate")
+    args = parser.parse_args()
+
+    print(f"{len(sound.NOTE_NAMES)} notes of {args.duration} s at {args.fs} Hz")
+    for name, value in benchmark(args.duration, args.fs).items():
+        if isinstance(value, bool):
+            print(f"{name:>28}: {value}")
+        else:
+            print(f"{name:>28}: {value * 1000:8.2f} ms")
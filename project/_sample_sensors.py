@@ -19,6 +19,7 @@ wait_ready_sensors() # init sensors
 
 touch.get_raw_value() # => 0 or 1
 touch.is_pressed()    # => False or True
+touch.wait_for_press(timeout=5) # => sleeps until pressed, False if not pressed within 5 seconds
 
 #############################
 ### EV3 Ultrasonic Sensor ###
@@ -8,6 +8,7 @@ January 24th, 2022
 """
 
 from utils.brick import Motor, BP, EV3ColorSensor, TouchSensor, configure_ports, wait_ready_sensors
+from logic import ColorClassifier, StreamingColorDetector
 import time
 import math as m
 import argparse
@@ -38,6 +39,7 @@ COLORS = {'R': (1.0, 0.1, 0.1),
           'G': (0.1, 1.0, 0.1), 
           'B': (0.3, 0.6, 0.7), 
           'Y': (0.8, 0.6, 0.0),}
+CLASSIFIER = ColorClassifier(COLORS)
 
 # mapping colors to sounds
 LOOKUPTABLE = {'R': 0, 'G': 120, 'B': 240}
@@ -55,17 +57,10 @@ Output: call to set_position subroutine
 '''
 def color2position(r, g, b):
     print(r, g, b)
-    minsqerror = 1e99
-    bestfit = 'r'
-    for c in COLORS.keys():
-        sqerror = (r-COLORS[c][0])**2 + (g-COLORS[c][1])**2 +(b-COLORS[c][2])**2
-        if sqerror < minsqerror:
-            bestfit = c
-            minsqerror = sqerror
+    bestfit = CLASSIFIER.classify((r, g, b)).color
     print(f'Identified Color {bestfit}')
-    print(f'Moving To Position: {LOOKUPTABLE[c]}')
-    motor_left.wait_is_moving()
-    motor_left.set_position(LOOKUPTABLE[c])
+    print(f'Moving To Position: {LOOKUPTABLE[bestfit]}')
+    motor_left.set_position(LOOKUPTABLE[bestfit])
 
 
 '''
@@ -107,25 +102,23 @@ def color_movement(args):
     try:
         output_file = open(args.file_output, "w+")
         while True: # polling loop
-            if TOUCH_SENSOR.is_pressed():
-                start = time()
+            if TOUCH_SENSOR.wait_for_press(): # sleeps until the next press
+                start = time.time()
                 print("Touch sensor pressed")
                 print("Collect Color samples")
-                r, g, b = 0, 0, 0
-                for i in range(args.batch_size): # sample a batch to ensure outliers can be smoothed out by averaging
+                detector = StreamingColorDetector(CLASSIFIER, max_samples=args.batch_size) # stops sampling once the color is clear
+                while not detector.done:
                     wait_ready_sensors() # safety measures
-                    sleep(args.color_delay)
+                    time.sleep(args.color_delay)
                     new_color_data = COLOR_SENSOR.get_rgb()  # RGB value[0, 255] 
                     print(new_color_data)
+                    detector.add(new_color_data) # None readings are skipped
 
-                    # we may encounter None here
-                    try:
-                        r += float(new_color_data[0])
-                        g += float(new_color_data[1])
-                        b += float(new_color_data[2])
-                    except Exception as e:
-                        print(f'Got None! {e}')
-                        continue
+                # the median is robust to outliers, unlike the sum
+                if detector.estimate() is None:
+                    print('Got None!')
+                    continue
+                r, g, b = detector.estimate()
 
                 # normalize to account for different brightness 
                 denominator = m.sqrt(r ** 2 + g ** 2 + b ** 2)
@@ -140,10 +133,10 @@ def color_movement(args):
                 g = g/denominator
                 b = b/denominator
 
-                move = color2move(r, g, b)
+                move = color2position(r, g, b)
                 output_file.write(f"{r}, {g}, {b}\n")
-                sleep(args.ts_delay) 
-                print(f'Time elapsed {time()-start}')
+                time.sleep(args.ts_delay) 
+                print(f'Time elapsed {time.time()-start}')
 
 
     except Exception as e:  # capture all exceptions including KeyboardInterrupt (Ctrl-C)
@@ -5,6 +5,15 @@ It is often faster to test these computations on a computer than on the robot.
 """
 
 # The brick and sound modules must NOT be imported here, but other imports are allowed
+from __future__ import annotations
+
+from typing import NamedTuple, Sequence
+import json
+import struct
+
+import numpy as np
+
+from utils.filters import RobustAggregator
 
 
 # This is a trivial function included here as an example. Feel free to modify or remove it
@@ -18,3 +27,481 @@ def get_bin_for_color(color: str) -> int:
     if color not in BIN_FOR:
         raise ValueError(f"No bin for color {color}")
     return BIN_FOR[color]
+
+
+# Reference colors of the cubes, as normalized (r, g, b) readings of the color sensor
+COLORS: dict[str, tuple[float, float, float]] = {
+    'R': (1.0, 0.1, 0.1),
+    'G': (0.1, 1.0, 0.1),
+    'B': (0.3, 0.6, 0.7),
+    'Y': (0.8, 0.6, 0.0),
+}
+
+UNKNOWN = "Unknown"  # verdict for samples too far from every reference color
+
+
+def normalize_rgb(samples) -> np.ndarray:
+    """
+    Scale (r, g, b) samples to unit length to account for different brightness.
+    Takes one sample or an (N, 3) array of samples. All-zero samples become NaN.
+    """
+    samples = np.asarray(samples, dtype=float)
+    norms = np.sqrt(np.sum(samples ** 2, axis=-1, keepdims=True))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(norms > 0, samples / norms, np.nan)
+
+
+def read_rgb_log(path: str) -> np.ndarray:
+    "Read a log of 'r, g, b' lines, like the ones written by the sort scripts, into an (N, 3) array."
+    return np.loadtxt(path, delimiter=",", usecols=(0, 1, 2), ndmin=2)
+
+
+class Classification(NamedTuple):
+    """
+    Result of classifying one sample.
+
+    color - name of the nearest reference color, or UNKNOWN
+    distance - distance from the normalized sample to the nearest reference color
+    confidence - from 0 (as close to the second nearest color) to 1 (exactly on the nearest color)
+    distances - distance to every reference color, by name
+    """
+    color: str
+    distance: float
+    confidence: float
+    distances: dict[str, float]
+
+
+class BatchClassification(NamedTuple):
+    """
+    Result of classifying N samples at once, as arrays.
+
+    colors - (N,) array of color names, or UNKNOWN
+    indices - (N,) array of indices into ColorClassifier.names, -1 for UNKNOWN
+    distance - (N,) distances to the nearest reference color
+    confidence - (N,) confidences, see Classification
+    distances - (N, K) distances to each of the K reference colors
+    """
+    colors: np.ndarray
+    indices: np.ndarray
+    distance: np.ndarray
+    confidence: np.ndarray
+    distances: np.ndarray
+
+
+class ColorClassifier:
+    """
+    Nearest-centroid color classifier. Samples are normalized to unit length, then matched to the
+    closest reference color (centroid) by Euclidean distance. Samples further than threshold from
+    every centroid, or all-zero samples, are classified as UNKNOWN.
+
+    Example:
+
+    classifier = ColorClassifier(COLORS, threshold=0.3)
+    classifier.classify((120, 15, 10)).color                 # => 'R'
+    classifier.classify_batch(read_rgb_log("music.log")).colors  # every sample of a log
+    """
+
+    def __init__(self, centroids: dict[str, Sequence[float]] = None, threshold: float = None):
+        """
+        centroids - reference colors by name, as normalized (r, g, b), default COLORS
+        threshold - largest distance to the nearest centroid for a known color, None for no limit
+        """
+        if centroids is None:
+            centroids = COLORS
+        if not centroids:
+            raise ValueError("ColorClassifier needs at least one reference color")
+        self.names = list(centroids.keys())
+        self.centroids = np.array([centroids[name] for name in self.names], dtype=float)
+        self.threshold = threshold
+        self._names = np.array(self.names + [UNKNOWN])
+
+    @classmethod
+    def from_calibration(cls, samples: dict[str, Sequence[Sequence[float]]], threshold: float = None):
+        """
+        Create a classifier from calibration readings: for each color name, a list of (r, g, b) samples
+        of that color. The centroid of each color is the mean of its normalized samples.
+        """
+        centroids = {}
+        for name, color_samples in samples.items():
+            normalized = normalize_rgb(np.asarray(color_samples, dtype=float).reshape(-1, 3))
+            centroids[name] = tuple(np.nanmean(normalized, axis=0))
+        return cls(centroids, threshold)
+
+    def to_dict(self) -> dict:
+        "Calibration table of this classifier, as a dict that can be saved as JSON."
+        return {"centroids": {name: list(map(float, c)) for name, c in zip(self.names, self.centroids)},
+                "threshold": self.threshold}
+
+    def save(self, path: str):
+        "Save the calibration table of this classifier to a JSON file."
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path: str):
+        "Create a classifier from a calibration table saved with save()."
+        with open(path) as f:
+            table = json.load(f)
+        return cls(table["centroids"], table.get("threshold"))
+
+    def classify_batch(self, samples) -> BatchClassification:
+        "Classify an (N, 3) array of (r, g, b) samples, raw or normalized, in one vectorized pass."
+        samples = normalize_rgb(np.asarray(samples, dtype=float).reshape(-1, 3))
+        differences = samples[:, np.newaxis, :] - self.centroids[np.newaxis, :, :]
+        distances = np.sqrt(np.einsum("nkc,nkc->nk", differences, differences))
+        valid = ~np.isnan(distances).any(axis=1)
+        filled = np.where(valid[:, np.newaxis], distances, np.inf)
+        indices = np.argmin(filled, axis=1)
+        distance = filled[np.arange(len(filled)), indices]
+        if len(self.names) > 1:
+            second = np.partition(filled, 1, axis=1)[:, 1]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                confidence = np.where(second > 0, 1 - distance / second, 0.0)
+        else:
+            confidence = np.ones(len(filled))
+        unknown = ~valid
+        if self.threshold is not None:
+            unknown |= distance > self.threshold
+        indices = np.where(unknown, -1, indices)
+        confidence = np.where(unknown, 0.0, np.nan_to_num(confidence))
+        distance = np.where(valid, distance, np.nan)
+        return BatchClassification(self._names[indices], indices, distance, confidence, distances)
+
+    def classify(self, sample: Sequence[float]) -> Classification:
+        "Classify one (r, g, b) sample, raw or normalized."
+        result = self.classify_batch([sample])
+        distances = {name: float(d) for name, d in zip(self.names, result.distances[0])}
+        return Classification(str(result.colors[0]), float(result.distance[0]),
+                              float(result.confidence[0]), distances)
+
+
+class StreamingColorDetector:
+    """
+    Decides the color of a cube from color sensor samples given one at a time, and stops as soon as
+    the decision is clear, instead of always averaging a fixed number of samples.
+
+    Samples are aggregated with a running median (or trimmed mean), so that outliers do not count,
+    and missing readings (None, or [None, None, None]) are skipped. After min_samples valid samples,
+    the estimate is classified after each new sample, and detection is done once the classification
+    confidence reaches the given confidence and the color is known, or after max_samples samples.
+
+    Example:
+
+    detector = StreamingColorDetector(ColorClassifier(COLORS))
+    while not detector.done:
+        time.sleep(0.1)
+        detector.add(COLOR_SENSOR.get_rgb())
+    detector.result.color  # eg, 'R'
+    """
+
+    def __init__(self, classifier: ColorClassifier, confidence: float = 0.5, min_samples: int = 3,
+                 max_samples: int = 9, method: str = "median"):
+        """
+        classifier - classifier for the aggregated samples
+        confidence - classification confidence (see Classification) needed to stop early
+        min_samples - valid samples needed before stopping early
+        max_samples - samples (valid or missing) after which detection stops in any case
+        method - "median" or "trimmed_mean", see utils.filters.RobustAggregator
+        """
+        self.classifier = classifier
+        self.confidence = confidence
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.aggregator = RobustAggregator(method)
+        self.samples = 0
+        self.result: Classification = None
+        self.done = False
+
+    def add(self, sample) -> Classification | None:
+        "Add one (r, g, b) sample. Return the final classification once done, None while more samples are needed."
+        if self.done:
+            return self.result
+        self.samples += 1
+        self.aggregator.append(list(sample[:3]) if sample is not None else None)
+        if len(self.aggregator) >= self.min_samples or self.samples >= self.max_samples:
+            self.result = self.classify()
+            if self.result.color != UNKNOWN and self.result.confidence >= self.confidence:
+                self.done = True
+        if self.samples >= self.max_samples:
+            self.done = True
+        return self.result if self.done else None
+
+    def estimate(self) -> list[float] | None:
+        "Robust (r, g, b) estimate of the samples so far, or None without any valid sample."
+        return self.aggregator.estimate()
+
+    def classify(self) -> Classification:
+        "Classify the current estimate. UNKNOWN without any valid sample."
+        estimate = self.estimate()
+        return self.classifier.classify(estimate if estimate is not None else (0, 0, 0))
+
+
+class ColorLookupTable:
+    """
+    Color classifier compiled into a 3-D lookup table: the (r, g, b) space from 0 to max_value is cut
+    into bins x bins x bins cells, and each cell stores the index of the color its center is classified as.
+    Classifying a sample is then a single table lookup, with no square roots or distances.
+
+    Tables can be saved to a file and memory-mapped when loaded, so scripts start without recompiling.
+
+    Example:
+
+    table = ColorLookupTable.compile(ColorClassifier(COLORS, threshold=0.3))  # 32x32x32 cells, 32 KiB
+    table.save("colors.lut")
+    table = ColorLookupTable.load("colors.lut")
+    table.classify((120, 15, 10))  # => 'R'
+    """
+    MAGIC = b"CLUT"
+    _ALIGNMENT = 64
+    _UNKNOWN_INDEX = 255
+
+    def __init__(self, table: np.ndarray, names: Sequence[str], max_value: float = 255):
+        """
+        table - (bins, bins, bins) array of uint8 color indices, 255 for UNKNOWN
+        names - color name for each index
+        max_value - largest value of a sample component, larger values fall in the last cell
+        """
+        self.table = table
+        self.names = list(names)
+        self.bins = table.shape[0]
+        self.max_value = max_value
+        self._scale = self.bins / max_value
+        self._flat = table.reshape(-1)
+        self._names = np.array(self.names + [UNKNOWN] * (256 - len(self.names)))
+
+    @classmethod
+    def compile(cls, classifier: ColorClassifier, bins: int = 32, max_value: float = 255):
+        "Classify the center of every cell with the given classifier and store the results."
+        if len(classifier.names) >= cls._UNKNOWN_INDEX:
+            raise ValueError(f"ColorLookupTable holds at most {cls._UNKNOWN_INDEX - 1} colors")
+        centers = (np.arange(bins) + 0.5) * max_value / bins
+        r, g, b = np.meshgrid(centers, centers, centers, indexing="ij")
+        indices = classifier.classify_batch(np.stack([r, g, b], axis=-1).reshape(-1, 3)).indices
+        table = np.where(indices < 0, cls._UNKNOWN_INDEX, indices).astype(np.uint8).reshape(bins, bins, bins)
+        return cls(table, classifier.names, max_value)
+
+    def _cell(self, value: float) -> int:
+        i = int(value * self._scale)
+        return 0 if i < 0 else self.bins - 1 if i >= self.bins else i
+
+    def classify(self, sample: Sequence[float]) -> str:
+        "Classify one (r, g, b) sample with a single table lookup. Return a color name or UNKNOWN."
+        r, g, b = sample[:3]
+        index = self._flat[(self._cell(r) * self.bins + self._cell(g)) * self.bins + self._cell(b)]
+        return str(self._names[index])
+
+    def classify_batch(self, samples) -> np.ndarray:
+        "Classify an (N, 3) array of (r, g, b) samples. Return an (N,) array of color names."
+        cells = np.clip((np.asarray(samples, dtype=float).reshape(-1, 3) * self._scale).astype(np.intp),
+                        0, self.bins - 1)
+        return self._names[self.table[cells[:, 0], cells[:, 1], cells[:, 2]]]
+
+    def save(self, path: str):
+        "Save the table: a small JSON header, followed by the raw table bytes."
+        header = json.dumps({"names": self.names, "bins": self.bins, "max_value": self.max_value}).encode()
+        offset = -(-(len(self.MAGIC) + 4 + len(header)) // self._ALIGNMENT) * self._ALIGNMENT
+        with open(path, "wb") as f:
+            f.write(self.MAGIC + struct.pack("<I", len(header)) + header)
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(np.ascontiguousarray(self.table, dtype=np.uint8).tobytes())
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        "Load a table saved with save(). With mmap, the table is memory-mapped instead of read."
+        with open(path, "rb") as f:
+            if f.read(len(cls.MAGIC)) != cls.MAGIC:
+                raise ValueError(f"{path} is not a color lookup table")
+            (length,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(length))
+        bins = header["bins"]
+        offset = -(-(len(cls.MAGIC) + 4 + length) // cls._ALIGNMENT) * cls._ALIGNMENT
+        if mmap:
+            table = np.memmap(path, dtype=np.uint8, mode="r", offset=offset, shape=(bins, bins, bins))
+        else:
+            table = np.fromfile(path, dtype=np.uint8, offset=offset).reshape(bins, bins, bins)
+        return cls(table, header["names"], header["max_value"])
+
+
+# Motion of the sorting tray, turned by two motors together
+TRAY_MAX_DPS = 1500  # degrees per second, the speed limit of the tray motors
+TRAY_ACCELERATION = 15000  # degrees per second squared, estimate to tune with the measured travel times
+TRAY_SETTLE_TIME = 0.15  # seconds for the position control to settle at the target, after the speed profile
+
+
+def travel_time(distance: float, max_dps: float, acceleration: float) -> float:
+    """
+    Seconds to move a motor by distance degrees, starting and ending at rest, with a trapezoidal
+    speed profile: accelerate to max_dps, cruise, then decelerate. Short moves never reach max_dps.
+    """
+    distance = abs(distance)
+    if distance * acceleration >= max_dps ** 2:
+        return distance / max_dps + max_dps / acceleration
+    return 2 * (distance / acceleration) ** 0.5
+
+
+class TrayMove(NamedTuple):
+    """
+    A planned tray rotation to the bin of a color.
+
+    start - encoder positions of the tray motors before the move
+    targets - encoder positions to move each motor to
+    dps - speed limit for each motor, so that they all arrive at the same time
+    duration - predicted seconds for the move
+    """
+    color: str
+    start: tuple[float, ...]
+    targets: tuple[float, ...]
+    dps: tuple[int, ...]
+    duration: float
+
+
+class TrayPlanner:
+    """
+    Plans tray rotations between bins, for a tray turned by several motors together.
+
+    Each move goes straight from the current pose, read from the motor encoders, to the next bin,
+    without going back to 0 in between. The motor with the longest way to go runs at max_dps,
+    and the others slower, so that all the motors arrive at the same time. The predicted duration
+    is the travel_time of the longest way plus settle_time.
+
+    Example:
+
+    planner = TrayPlanner({'R': (0, 0), 'G': (60, -60), 'B': (-50, 50)})
+    move = planner.plan((60, -60), 'B')
+    move.targets   # (-50, 50)
+    move.dps       # (1500, 1500)
+    move.duration  # 0.321 s, including the settle_time
+    """
+
+    def __init__(self, bins: dict[str, Sequence[float]], max_dps: float = TRAY_MAX_DPS,
+                 acceleration: float = TRAY_ACCELERATION, settle_time: float = TRAY_SETTLE_TIME):
+        self.bins = {color: tuple(targets) for color, targets in bins.items()}
+        self.max_dps = max_dps
+        self.acceleration = acceleration
+        self.settle_time = settle_time
+
+    def plan(self, pose: Sequence[float], color: str) -> TrayMove | None:
+        "Plan the move from the given encoder positions to the bin of color. None if there is no such bin."
+        if color not in self.bins:
+            return None
+        targets = self.bins[color]
+        distances = [abs(target - position) for target, position in zip(targets, pose)]
+        longest = max(distances)
+        if longest == 0:
+            return TrayMove(color, tuple(pose), targets, tuple(round(self.max_dps) for _ in targets), 0.0)
+        dps = tuple(max(1, round(self.max_dps * d / longest)) for d in distances)
+        duration = travel_time(longest, self.max_dps, self.acceleration) + self.settle_time
+        return TrayMove(color, tuple(pose), targets, dps, duration)
+
+
+# Closed-loop push, guided by an angle measure such as the gyro sensor
+PUSH_MAX_DPS = 500  # degrees per second of the push motor far from the target
+PUSH_MIN_DPS = 40  # degrees per second of the push motor when close to the target
+PUSH_SLOW_ZONE = 10  # degrees of the measured angle before the target where the push slows down
+PUSH_LOOKAHEAD = 0.03  # seconds of the measured rate the angle is expected to keep changing after stopping
+PUSH_MAX_OVERSHOOT = 3  # degrees of the measured angle past the target that are acceptable
+
+
+class PushSample(NamedTuple):
+    "One step of a push: measured angle and rate, and the commanded motor speed."
+    time: float
+    angle: float
+    rate: float
+    dps: float
+
+
+class PushController:
+    """
+    Drives a push motor until a measured angle, eg, of the gyro sensor, reaches a target angle.
+
+    Far from the target, the motor runs at max_dps. Within slow_zone degrees of the target, the speed goes
+    down in proportion to the remaining angle, to min_dps. The motor is stopped as soon as the angle,
+    plus what the measured rate adds within lookahead seconds, reaches the target.
+    The speed is always positive, for a motor that moves the angle towards the target when turning forwards.
+    Every step is recorded in samples, to look at the step response (time_to_target, overshoot, error)
+    and tune the parameters.
+
+    Example:
+
+    controller = PushController(target=30)
+    while not controller.done:
+        angle, rate = GYRO_SENSOR.get_both_measure()
+        MOTOR.set_dps(controller.step(time.monotonic(), angle, rate))
+        time.sleep(0.005)
+    print(controller.summary())
+    """
+
+    def __init__(self, target: float, max_dps: float = PUSH_MAX_DPS, min_dps: float = PUSH_MIN_DPS,
+                 slow_zone: float = PUSH_SLOW_ZONE, lookahead: float = PUSH_LOOKAHEAD,
+                 max_overshoot: float = PUSH_MAX_OVERSHOOT):
+        self.target = target
+        self.max_dps = max_dps
+        self.min_dps = min_dps
+        self.slow_zone = slow_zone
+        self.lookahead = lookahead
+        self.max_overshoot = max_overshoot
+        self.samples: list[PushSample] = []
+        self.direction = 1  # 1 if the angle goes up towards the target, set by the first step
+        self.stopped: float = None  # time the motor was stopped
+
+    @property
+    def done(self) -> bool:
+        return self.stopped is not None
+
+    def speed(self, angle: float, rate: float = 0.0) -> float:
+        "Motor speed for the given angle and rate, 0 once the target is reached."
+        remaining = (self.target - angle) * self.direction
+        if remaining - rate * self.direction * self.lookahead <= 0:
+            return 0
+        if remaining >= self.slow_zone:
+            return self.max_dps
+        return max(self.min_dps, self.max_dps * remaining / self.slow_zone)
+
+    def step(self, time: float, angle: float, rate: float = 0.0) -> float:
+        "Record a measure and return the motor speed to command. Once done, always 0."
+        if not self.samples:
+            self.direction = 1 if self.target >= angle else -1
+        dps = 0 if self.done else self.speed(angle, rate)
+        if dps == 0 and not self.done:
+            self.stopped = time
+        self.samples.append(PushSample(time, angle, rate, dps))
+        return dps
+
+    @property
+    def time_to_target(self) -> float | None:
+        "Seconds from the first step until the motor was stopped at the target, None if it was not."
+        if not self.done:
+            return None
+        return self.stopped - self.samples[0].time
+
+    @property
+    def error(self) -> float:
+        "Degrees between the last measured angle and the target, positive past the target."
+        if not self.samples:
+            return 0.0
+        return (self.samples[-1].angle - self.target) * self.direction
+
+    @property
+    def overshoot(self) -> float:
+        "Degrees the angle went past the target, 0 if it did not reach it."
+        if not self.samples:
+            return 0.0
+        furthest = max(sample.angle * self.direction for sample in self.samples)
+        return max(0.0, furthest - self.target * self.direction)
+
+    @property
+    def within_overshoot(self) -> bool:
+        return self.overshoot <= self.max_overshoot
+
+    def summary(self) -> str:
+        reached = self.time_to_target
+        reached = f"{reached:.3f} s" if reached is not None else "not reached"
+        bound = "" if self.within_overshoot else f" (more than {self.max_overshoot})"
+        return (f"push to {self.target}: {reached}, overshoot {self.overshoot:.1f}{bound}, "
+                f"error {self.error:.1f}, {len(self.samples)} steps")
+
+    def write_csv(self, file, label=""):
+        "Write the samples as 'label, time, angle, rate, dps' lines, time from the first step."
+        start = self.samples[0].time if self.samples else 0
+        for sample in self.samples:
+            file.write(f"{label}, {sample.time - start:.4f}, {sample.angle}, {sample.rate}, {sample.dps}\n")
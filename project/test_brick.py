@@ -0,0 +1,648 @@
+#!/usr/bin/env python3
+
+"""
+File containing tests for utils.brick, run against the simulated BrickPi3 so they do not require
+the robot hardware and can therefore be run on a computer.
+"""
+
+from utils import brick
+from utils.brick import Motor, ProfiledMove, ColorReadScheduler, TouchSensor, EV3ColorSensor, EV3GyroSensor, configure_ports
+from utils.motion import MotionProfile
+from utils.replay import diff_sessions, replay_decisions, replay_session, script_classifier, simulated_script
+from utils.session_log import SessionLog, read_session_log, STAGES, OUTCOMES
+from utils.simulation import SimulatedBrickPi3, VirtualClock, RealClock, StopSimulation
+from logic import TrayPlanner, PushController
+
+import asyncio
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import time
+import pytest
+
+IMPORT_BUDGET = 0.5  # seconds, generous for slow computers without compiled bytecode
+
+
+@pytest.fixture
+def sim():
+    "Simulated brick on a virtual clock, used by every device created during the test."
+    clock = VirtualClock()
+    sim = SimulatedBrickPi3(clock=clock)
+    previous = brick.set_backend(sim)
+    with clock.patch_time_module():
+        yield sim
+    brick.set_backend(previous)
+    brick.use_snapshots(None)
+    brick.stop_sampling()
+    for port in brick.Sensor.ALL_SENSORS:
+        brick.Sensor.ALL_SENSORS[port] = None
+    for port in brick.Motor.ALL_MOTORS:
+        brick.Motor.ALL_MOTORS[port] = None
+
+
+def test_import_is_fast_and_lazy(tmp_path):
+    "Test that importing utils.brick is fast and has no side effects until the first device is created."
+    script = (
+        "import time, sys\n"
+        "start = time.perf_counter()\n"
+        "from utils import brick\n"
+        "print(time.perf_counter() - start)\n"
+        "import os\n"
+        "print('BP' in vars(brick), os.path.exists(os.path.expanduser(brick.PID_FILE)), 'asyncio' in sys.modules)\n"
+        "brick.TouchSensor(1)\n"
+        "print(open(os.path.expanduser(brick.PID_FILE)).read().strip() == str(os.getpid()))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)), env={**os.environ, "HOME": str(tmp_path)})
+    import_time, lazy, created = result.stdout.splitlines()
+    assert float(import_time) < IMPORT_BUDGET
+    assert lazy == "False False False"  # no BrickPi3, no PID file, no asyncio
+    assert created == "True"
+
+
+def test_configure_ports_waits_for_color_sensor(sim):
+    "Test that configure_ports returns devices once the color sensor reports valid data."
+    touch, color, motor = configure_ports(PORT_1=TouchSensor, PORT_2=EV3ColorSensor, PORT_A=Motor,
+                                          print_status=False)
+    assert isinstance(motor, Motor)
+    assert touch.get_status() == brick.Sensor.Status.VALID_DATA
+    assert color.get_status() == brick.Sensor.Status.VALID_DATA
+    assert sim.clock.time() >= sim.configure_time["COLOR"]
+
+
+def test_configure_ports_waits_for_sensors_in_parallel(sim, capsys):
+    "Test that sensors are waited for at once, in about the time of the slowest one, with one overall timeout."
+    sim.set_sensor_state(3, sim.SENSOR_STATE.NOT_CONFIGURED)  # a gyro that never gets ready is not waited for
+    devices = configure_ports(PORT_1=TouchSensor, PORT_2=EV3ColorSensor, PORT_3=EV3GyroSensor,
+                              PORT_4=brick.EV3UltrasonicSensor, PORT_B=Motor)
+    assert [type(device) for device in devices] == [TouchSensor, EV3ColorSensor, EV3GyroSensor,
+                                                    brick.EV3UltrasonicSensor, Motor]
+    assert devices[1].ready and devices[3].ready and devices[0].ready_time is devices[2].ready_time is None
+    slowest = max(sim.configure_time[kind] for kind in ["COLOR", "ULTRASONIC"])
+    assert sim.clock.time() == pytest.approx(slowest, abs=0.03)
+    assert devices[1].ready_time == pytest.approx(sim.configure_time["COLOR"], abs=0.02)
+    output = capsys.readouterr().out
+    assert "Port 4 (EV3UltrasonicSensor): 0.2" in output and "Port 3" not in output
+
+    start = sim.clock.time()
+    color = configure_ports(PORT_2=EV3ColorSensor, timeout=0.05, print_status=False)
+    assert isinstance(color, EV3ColorSensor) and color.ready_time is None and not color.ready
+    assert sim.clock.time() - start == pytest.approx(0.05, abs=0.02)
+    assert "port 2 not ready after 0.05 s" in capsys.readouterr().out
+
+
+def test_scripted_sensors(sim):
+    "Test that touch, color and gyro sensors return their scripted values."
+    sim.set_sensor_timeline(1, [(0, 0), (5, 1), (5.5, 0)])
+    sim.set_sensor_stream(2, [[100, 10, 5], [90, 12, 6]])
+    sim.set_sensor_value(3, [42, 7])
+    touch, color, gyro = configure_ports(PORT_1=TouchSensor, PORT_2=EV3ColorSensor, PORT_3=EV3GyroSensor,
+                                         print_status=False)
+    gyro.wait_ready()
+
+    assert not touch.is_pressed()
+    time.sleep(5.1 - time.time())
+    assert touch.is_pressed()
+    time.sleep(1)
+    assert not touch.is_pressed()
+
+    assert color.get_rgb() == [100, 10, 5]
+    assert color.get_rgb() == [90, 12, 6]
+    assert color.get_rgb() == [90, 12, 6]  # last value repeats
+
+    assert gyro.get_both_measure() == [42, 7]
+    assert gyro.get_abs_measure() == 42
+
+
+def test_color_reads_are_grouped_by_mode(sim):
+    "Test that the scheduler serves mixed ambient and RGB reads with one mode switch, and counts it."
+    sim.set_sensor_value(2, [110, 14, 12])
+    color = EV3ColorSensor(2)
+    color.wait_ready()
+    for _ in range(3):  # the getters switch every time
+        color.get_ambient(), color.get_rgb()
+    assert color.mode_switches == 6 and color.mode_switch_time >= 6 * 0.15
+
+    time.sleep(0.1)  # the cached values get stale
+    scheduler = ColorReadScheduler(color, max_age=0.05)
+    reads = [scheduler.request(mode) for mode in ["ambient", "component", "ambient", "component"]]
+    scheduler.run()
+    assert [read.value for read in reads[1::2]] == [[110, 14, 12]] * 2 and all(read.done for read in reads)
+    stats = scheduler.stats()
+    assert stats.requests == 4 and stats.reads == 2 and stats.mode_switches == 1
+    assert stats.switch_time == pytest.approx(0.15, abs=0.02)
+
+    assert color.mode == "ambient"  # the current mode was served first, without a switch
+    scheduler.read("ambient")
+    assert scheduler.stats().reads == 2  # fresh in the cache
+    assert scheduler.read("component") == [110, 14, 12]  # stale after the switch to ambient
+    assert scheduler.stats().reads == 3 and scheduler.stats().mode_switches == 2
+
+
+def test_sensor_not_ready_returns_none(sim):
+    "Test that reading a sensor before it is configured gives None like on the robot."
+    color = EV3ColorSensor(2)
+    assert color.get_status() == brick.Sensor.Status.CONFIGURING
+    assert color.get_value() is None
+    color.wait_ready()
+    assert color.get_value() == [0, 0, 0, 0]
+
+
+def test_devices_share_one_brick_handle(sim):
+    "Test that sensors and motors use one handle to the current BrickPi3, without copies of its state."
+    touch, color, motor = configure_ports(PORT_1=TouchSensor, PORT_2=EV3ColorSensor, PORT_A=Motor, wait=False,
+                                          print_status=False)
+    assert touch.brick is color.brick is motor.brick is brick.Brick()
+    assert touch.brick.bp is sim and "SensorType" not in vars(touch.brick)
+    assert touch.brick.SensorType is sim.SensorType
+    touch.brick.spi_latency = 0.002  # not a copy: changes the simulator itself
+    assert sim.spi_latency == 0.002
+
+    previous = brick.set_backend(SimulatedBrickPi3(clock=sim.clock))
+    assert brick.Brick() is not touch.brick and brick.Brick().bp is not sim
+    brick.set_backend(previous)
+
+
+def test_sensor_readiness_is_cached(sim):
+    "Test that wait_ready_sensors skips sensors known to be ready, until a mode change or an error reply."
+    touch, color = configure_ports(PORT_1=TouchSensor, PORT_2=EV3ColorSensor, print_status=False)
+    brick.wait_ready_sensors()
+    assert touch.ready and color.ready
+    transfers, saved = sim.spi_transfers, brick.Sensor.status_reads_saved
+    for _ in range(9):
+        brick.wait_ready_sensors()
+    assert sim.spi_transfers == transfers and brick.Sensor.status_reads_saved == saved + 18
+
+    color.set_mode("ambient")
+    assert not color.ready
+    brick.wait_ready_sensors()
+    assert color.ready and sim.spi_transfers > transfers + 1
+
+    sim.set_sensor_type(sim.PORT_2, sim.SENSOR_TYPE.EV3_COLOR_AMBIENT)  # reconfigured behind its back
+    assert color.get_value() is None and not color.ready
+    color.wait_ready()
+    assert color.get_value() is not None and color.ready
+
+
+def test_motor_moves_to_position(sim):
+    "Test that a motor reaches its target at the speed limit and updates its encoder."
+    motor = Motor("A")
+    motor.set_limits(dps=360)
+    motor.set_position_relative(180)
+    time.sleep(0.25)
+    assert motor.is_moving()
+    assert 0 < motor.get_position() < 180
+    assert motor.get_speed() == pytest.approx(360, abs=1)
+    time.sleep(1)
+    assert motor.get_position() == 180
+    assert not motor.is_moving()
+
+    motor.reset_encoder()
+    assert motor.get_encoder() == 0
+    motor.set_position(-90)
+    time.sleep(1)
+    assert motor.get_encoder() == -90
+    assert sim.get_motor_position(sim.PORT_A) == pytest.approx(-90)
+
+
+def test_stalled_motor_is_overloaded(sim):
+    "Test that a blocked motor reports the OVERLOADED flag and does not move."
+    motor = Motor("D")
+    sim.set_motor_stalled(sim.PORT_D)
+    motor.set_position(90)
+    time.sleep(1)
+    flags, power, encoder, dps = motor.get_status()
+    assert flags & sim.MOTOR_STATUS_FLAG.OVERLOADED
+    assert encoder == 0 and dps == 0
+
+
+def test_move_completes_when_settled(sim):
+    "Test that a move is done as soon as the motor settles at its target, and can be awaited."
+    motor = Motor("A")
+    motor.set_limits(dps=360)
+    move = motor.move_by(90)
+    assert not move.done()
+    assert move.wait()
+    assert move.status == move.REACHED and abs(move.position - 90) <= move.tolerance
+    assert 0.25 < move.elapsed < 0.5  # 90 degrees at 360 dps, and no fixed delay
+    assert motor.move_to(0).wait() and abs(motor.get_encoder()) <= move.tolerance
+
+
+def test_move_detects_stall_and_timeout(sim):
+    "Test that a blocked motor ends its move as stalled, and that timeouts end or stop waiting on a move."
+    motor = Motor("B")
+    sim.set_motor_stalled(sim.PORT_B)
+    move = motor.move_by(90, timeout=2)
+    assert not move.wait()
+    assert move.status == move.STALLED and move.elapsed < 0.5
+
+    sim.set_motor_stalled(sim.PORT_B, False)
+    motor.set_limits(dps=100)
+    move = motor.move_to(180)
+    assert not move.wait(timeout=0.2) and move.status == move.MOVING
+    assert move.wait()
+    assert not motor.move_to(0, timeout=0.1).wait()
+
+
+def test_bus_and_motor_metrics(sim):
+    "Test that bus calls, bus errors, OVERLOADED flags and finished moves are counted in the metrics registry."
+    def count(metric, *labels):
+        return metric.labels(*labels).value
+
+    calls, moves, overloaded = (count(brick.BUS_CALLS, "get_motor_status"), count(brick.MOTOR_MOVES, "C", "stalled"),
+                                count(brick.MOTOR_OVERLOADED, "C"))
+    motor = Motor("C")
+    sim.set_motor_stalled(sim.PORT_C)
+    assert not motor.move_by(90, timeout=2).wait()
+    assert count(brick.MOTOR_MOVES, "C", "stalled") == moves + 1
+    assert count(brick.MOTOR_OVERLOADED, "C") == overloaded + 1  # once per rising edge, not per reading
+    assert count(brick.BUS_CALLS, "get_motor_status") > calls + 1
+
+    def failing(sim):
+        raise IOError("No SPI response")
+    errors = count(brick.BUS_ERRORS, "get_sensor")
+    sim.set_sensor_function(3, failing)
+    gyro = EV3GyroSensor(3)
+    gyro.wait_ready()
+    with pytest.raises(IOError):
+        gyro.get_abs_measure()
+    assert count(brick.BUS_ERRORS, "get_sensor") == errors + 1
+    assert 'brick_io_errors_total{method="get_sensor"}' in brick.REGISTRY.exposition()
+
+    status_calls, transfers = count(brick.BUS_CALLS, "get_sensor_status"), count(brick.BUS_CALLS, "spi_transfer_array")
+    gyro.get_status()
+    assert count(brick.BUS_CALLS, "get_sensor_status") == status_calls + 1
+    assert count(brick.BUS_CALLS, "spi_transfer_array") == transfers  # counted once, as get_sensor_status
+
+    def no_response(data_out):
+        raise IOError("No SPI response")
+    sim.spi_transfer_array = no_response
+    status_errors, transfer_errors = (count(brick.BUS_ERRORS, "get_sensor_status"),
+                                      count(brick.BUS_ERRORS, "spi_transfer_array"))
+    with pytest.raises(IOError):
+        gyro.get_status()
+    assert count(brick.BUS_ERRORS, "get_sensor_status") == status_errors + 1
+    assert count(brick.BUS_ERRORS, "spi_transfer_array") == transfer_errors
+
+
+def test_synchronized_tray_move(sim):
+    "Test that planned tray moves bring both motors to their bin together, in about the predicted time."
+    motors = Motor("B"), Motor("C")
+    planner = TrayPlanner({'G': (600, -300), 'B': (-500, 500)}, max_dps=1500, acceleration=sim.motors[0].acceleration)
+    for color in ['G', 'B']:
+        plan = planner.plan([motor.get_encoder() for motor in motors], color)
+        moves = [motor.move_to(target, dps=dps) for motor, target, dps in zip(motors, plan.targets, plan.dps)]
+        assert all([move.wait() for move in moves])
+        assert [round(motor.get_encoder() / 10) * 10 for motor in motors] == list(plan.targets)
+        assert abs(moves[0].finished - moves[1].finished) < 0.05
+        assert max(move.elapsed for move in moves) == pytest.approx(plan.duration, abs=0.1)
+
+
+def test_push_controller_stops_near_gyro_target(sim):
+    "Test that the push controller drives a motor until a linked gyro reaches the target, without overshooting."
+    sim.set_sensor_function(3, lambda sim: [sim.get_motor_position(sim.PORT_D) / 4,
+                                            sim.get_motor_velocity(sim.PORT_D) / 4])
+    motor, gyro = Motor("D"), EV3GyroSensor(3)
+    gyro.wait_ready()
+    controller = PushController(target=30)
+    while not controller.done:
+        angle, rate = gyro.get_both_measure()
+        motor.set_dps(controller.step(time.monotonic(), angle, rate))
+        time.sleep(0.005)
+    motor.set_dps(0)
+    time.sleep(0.5)
+    controller.step(time.monotonic(), *gyro.get_both_measure())
+    assert controller.within_overshoot and abs(controller.error) < controller.max_overshoot
+    assert controller.time_to_target < 1  # 120 degrees of the motor, mostly at full speed
+
+
+def test_profiled_move_follows_trajectory(sim):
+    "Test that a profiled move tracks its trajectory and settles on the target without overshooting."
+    motor = Motor("A")
+    motor.set_limits(dps=900)
+    profile = MotionProfile("s-curve", max_dps=1000, acceleration=8000)
+    move = ProfiledMove(motor, profile.trajectory(0, 240), profile, thread=False).start()
+    assert motor.limits == (0, 1200)  # room for the position correction
+    furthest = 0
+    while not move.poll():
+        furthest = max(furthest, sim.motors[0].position)
+        time.sleep(0.005)
+    assert move.reached and abs(motor.get_encoder() - 240) <= move.tolerance
+    assert furthest < 240 + 5 and move.tracking_error < 20
+    assert move.elapsed == pytest.approx(move.trajectory.duration, abs=0.1)
+    assert motor.limits == (0, 900) and sim.motors[0].dps_limit == 900  # put back for later moves
+
+    timed_out = ProfiledMove(motor, profile.trajectory(240, 0), profile, timeout=0.05, thread=False).start()
+    assert not timed_out.wait() and timed_out.status == timed_out.TIMEOUT
+    assert sim.motors[0].dps_limit == 900
+    time.sleep(0.5)
+    assert abs(motor.get_encoder()) <= timed_out.tolerance  # the motor still gets to the target
+
+
+def test_spi_latency_advances_virtual_clock(sim):
+    "Test that each SPI transfer is counted and takes the configured latency."
+    touch = TouchSensor(1)
+    touch.wait_ready()
+    sim.spi_latency = 0.001
+    start_time, start_transfers = time.time(), sim.spi_transfers
+    for _ in range(10):
+        touch.is_pressed()
+    assert sim.spi_transfers - start_transfers == 10
+    assert time.time() - start_time == pytest.approx(0.01)
+
+
+def test_stop_simulation_from_sensor_script(sim):
+    "Test that a sensor script can end a polling loop."
+    def touch_script(sim):
+        if sim.clock.time() > 1:
+            raise StopSimulation()
+        return 0
+    sim.set_sensor_function(1, touch_script)
+    touch = TouchSensor(1)
+    touch.wait_ready()
+    with pytest.raises(StopSimulation):
+        while True:
+            touch.is_pressed()
+
+
+def test_read_all_uses_one_transfer_per_device(sim):
+    "Test that read_all reads every configured device once and returns an immutable snapshot."
+    sim.set_sensor_value(1, 1)
+    sim.set_sensor_value(2, [100, 10, 5])
+    sim.set_sensor_value(3, [42, 7])
+    configure_ports(PORT_1=TouchSensor, PORT_2=EV3ColorSensor, PORT_3=EV3GyroSensor,
+                    PORT_A=Motor, PORT_B=Motor, PORT_C=Motor, print_status=False)
+    brick.wait_ready_sensors()
+
+    transfers = sim.spi_transfers
+    snapshot = brick.read_all()
+    assert sim.spi_transfers - transfers == 6
+    assert snapshot.sensors == {"1": 1, "2": (100, 10, 5, 0), "3": (42, 7)}
+    assert snapshot.motors["A"] == (0, 0, 0, 0)
+    assert brick.latest_snapshot() is snapshot
+    with pytest.raises(TypeError):
+        snapshot.sensors["1"] = 0
+
+
+def test_getters_read_from_fresh_snapshot(sim):
+    "Test that getters use the latest snapshot only when enabled, fresh, and in the same sensor mode."
+    sim.set_sensor_value(2, [100, 10, 5])
+    sim.set_sensor_value(3, [42, 7])
+    color, gyro, motor = configure_ports(PORT_2=EV3ColorSensor, PORT_3=EV3GyroSensor, PORT_A=Motor,
+                                         print_status=False)
+    gyro.wait_ready()
+    brick.read_all()
+
+    brick.use_snapshots(max_age=0.05)
+    sim.set_sensor_value(2, [1, 2, 3])
+    transfers = sim.spi_transfers
+    assert color.get_rgb() == [100, 10, 5]
+    assert gyro.get_both_measure() == [42, 7]
+    assert motor.get_status() == [0, 0, 0, 0]
+    assert motor.get_encoder() == 0
+    assert sim.spi_transfers == transfers
+
+    assert gyro.get_abs_measure() == 42  # mode switch, read from the bus
+    time.sleep(0.1)
+    assert color.get_rgb() == [1, 2, 3]  # snapshot too old
+
+    brick.read_all()
+    brick.use_snapshots(None)
+    sim.set_sensor_value(2, [4, 5, 6])
+    assert color.get_rgb() == [4, 5, 6]
+
+
+def test_sampler_buffers_samples_per_sensor(sim):
+    "Test that the sampler reads each sensor at its own rate and getters use the latest sample."
+    sim.set_sensor_timeline(1, [(0, 0), (1, 1)])
+    sim.set_sensor_stream(2, [[i, 2 * i, 3 * i] for i in range(100)])
+    touch, color = configure_ports(PORT_1=TouchSensor, PORT_2=EV3ColorSensor, print_status=False)
+    touch.wait_ready()
+    sampler = brick.SensorSampler([touch, color], rate={"1": 100, "2": 20}, size=8)
+    sampler.running = True
+    for sensor in sampler.sensors:
+        sensor._sampler = sampler
+
+    start = time.monotonic()
+    while time.monotonic() - start < 1.2:
+        time.sleep(sampler.poll())
+
+    assert len(touch.buffer) == 8 and touch.buffer.count > 100
+    assert 20 <= color.buffer.count <= 26
+    assert touch.is_pressed()
+    transfers = sim.spi_transfers
+    last = color.window(3)
+    assert len(last) == 3 and last[0][0] < last[1][0] < last[2][0]
+    assert color.get_rgb() == last[-1][1][:-1]
+    assert sim.spi_transfers == transfers
+
+
+@pytest.fixture
+def realtime_sim():
+    "Simulated brick on the real clock, for tests of background threads."
+    sim = SimulatedBrickPi3(clock=RealClock(), configure_time=0)
+    previous = brick.set_backend(sim)
+    yield sim
+    brick.stop_sampling()
+    brick.set_backend(previous)
+    for port, sensor in brick.Sensor.ALL_SENSORS.items():
+        if isinstance(sensor, TouchSensor):
+            sensor.stop_events()
+        brick.Sensor.ALL_SENSORS[port] = None
+
+
+def test_sampler_thread(realtime_sim):
+    "Test the sampler thread in real time, and that stopping it makes getters read from the bus again."
+    realtime_sim.set_sensor_value(3, [10, 0])
+    gyro = EV3GyroSensor(3, mode="abs")
+    gyro.wait_ready()
+    brick.start_sampling(rate=500, sensors=[gyro])
+    time.sleep(0.05)
+    assert gyro.get_abs_measure() == 10
+    assert len(gyro.window(5)) == 5
+    brick.stop_sampling()
+    realtime_sim.set_sensor_value(3, [20, 0])
+    assert gyro.get_abs_measure() == 20
+
+
+def test_move_can_be_awaited(realtime_sim):
+    "Test that moves can be awaited in asyncio code."
+    motor = Motor("A")
+
+    async def move_back_and_forth():
+        return await motor.move_to(45), await motor.move_to(0, timeout=0.001)
+    assert asyncio.run(move_back_and_forth()) == (True, False)
+
+
+def test_motor_profile_streams_on_thread(realtime_sim):
+    "Test that moves of a motor with a profile stream setpoints on a thread, and that the profile can be removed."
+    motor = Motor("B")
+    motor.set_profile(kind="trapezoidal", max_dps=1200, acceleration=10000)
+    move = motor.move_by(180, timeout=2)
+    assert isinstance(move, ProfiledMove) and move.profile.max_dps == 1200
+    assert move.wait() and abs(motor.get_encoder() - 180) <= move.tolerance
+    assert not move._thread.is_alive()
+    assert motor.move_to(0, dps=600).profile.max_dps == 600
+    motor.set_profile(None)
+    assert type(motor.move_to(0)) is brick.MotorMove
+    assert asyncio.run(motor.move_to(0).wait_async(timeout=1))
+
+
+def test_touch_events_are_debounced(realtime_sim):
+    "Test that a bouncy press gives one press and one release event, with bounded latency."
+    t0 = realtime_sim.clock.time()
+    realtime_sim.set_sensor_timeline(1, [(t0, 0), (t0 + 0.05, 1), (t0 + 0.052, 0), (t0 + 0.055, 1),
+                                         (t0 + 0.15, 0)])
+    touch = TouchSensor(1)
+    presses, releases = [], []
+    touch.on_press(presses.append)
+    touch.on_release(releases.append)
+    assert touch.wait_for_release(timeout=1)
+    assert len(presses) == 1 and len(releases) == 1
+    assert presses[0].pressed and not releases[0].pressed
+    assert presses[0].time >= t0 + 0.05
+    assert presses[0].latency < brick.TOUCH_POLL_INTERVAL + brick.TOUCH_DEBOUNCE + 0.02
+    assert touch.last_event == releases[0] and touch.last_press == presses[0]
+
+
+def test_wait_for_press(realtime_sim):
+    "Test that wait_for_press wakes up on a new press and times out when there is none."
+    t0 = realtime_sim.clock.time()
+    realtime_sim.set_sensor_timeline(1, [(t0, 1), (t0 + 0.05, 0), (t0 + 0.1, 1)])
+    touch = TouchSensor(1)
+    start = time.monotonic()
+    assert touch.wait_for_press(timeout=1)  # the button held at the start does not count
+    assert time.monotonic() - start >= 0.1
+    assert not touch.wait_for_press(timeout=0.05)
+    assert asyncio.run(touch.wait_for_press_async(timeout=0.05)) is False
+
+
+def test_wait_for_press_async(realtime_sim):
+    "Test the asyncio version of wait_for_press."
+    t0 = realtime_sim.clock.time()
+    realtime_sim.set_sensor_timeline(1, [(t0, 0), (t0 + 0.05, 1)])
+    touch = TouchSensor(1)
+    assert asyncio.run(touch.wait_for_press_async(timeout=1))
+
+
+def test_wait_for_press_raises_reading_errors(realtime_sim):
+    "Test that errors from the poller thread reach the waiting thread."
+    def touch_script(sim):
+        raise StopSimulation("done")
+    realtime_sim.set_sensor_function(1, touch_script)
+    touch = TouchSensor(1)
+    with pytest.raises(StopSimulation):
+        touch.wait_for_press(timeout=1)
+
+
+def test_touch_poller_only_runs_while_watched(realtime_sim):
+    "Test that the poller stops once nothing waits on a sensor, and that errors nobody waited for are not raised."
+    reads = []
+
+    def touch_script(sim):
+        reads.append(sim.clock.time())
+        if len(reads) == 2:
+            raise IOError("bus error")
+        return 0
+    realtime_sim.set_sensor_function(1, touch_script)
+    touch = TouchSensor(1)
+    touch.on_press(print)
+    time.sleep(0.05)  # the poller hits the error while nothing waits
+    touch.remove_callback(print)
+    assert not touch.wait_for_press(timeout=0.05)
+    poller = brick._touch_poller
+    assert touch not in poller.sensors
+    time.sleep(brick.TOUCH_POLL_INTERVAL * 4)
+    assert poller._thread is None
+    count = len(reads)
+    time.sleep(brick.TOUCH_POLL_INTERVAL * 4)
+    assert len(reads) == count
+
+
+def test_touch_callbacks_survive_reading_error(realtime_sim):
+    "Test that a sensor with callbacks stays watched after a reading error, and reports the next press."
+    reads = []
+
+    def touch_script(sim):
+        reads.append(sim.clock.time())
+        if len(reads) == 2:
+            raise IOError("bus error")
+        return 1 if len(reads) > 5 else 0
+    realtime_sim.set_sensor_function(1, touch_script)
+    touch = TouchSensor(1)
+    presses = []
+    touch.on_press(presses.append)
+    touch.on_press(lambda event: 1 / 0)  # failing callbacks do not stop the poller
+    touch._listeners["error"].append(lambda error: 1 / 0)
+    try:
+        time.sleep(brick.TOUCH_POLL_INTERVAL * 6 + brick.TOUCH_DEBOUNCE + 0.05)
+        assert touch in brick._touch_poller.sensors
+        assert len(presses) == 1
+    finally:
+        touch.stop_events()
+
+
+def test_replay_session(tmp_path):
+    "Test that a recorded session replays through the sort script, and that changed decisions are reported."
+    path = tmp_path / "session.log"
+    runs = [[(110, 14, 12), (15, 95, 18), (112, 13, 11)], [(14, 96, 17), (111, 15, 12)]]
+    for run, cubes in enumerate(runs):  # cube numbers restart with each run
+        with SessionLog(path) as log:
+            for number, rgb in enumerate(cubes, 1):
+                log.write(time=100.0 + 100 * run + 12 * number, cube=number, samples=[rgb] * 4, color="R",
+                          confidence=0.5, stages={"detect": 0.5})
+    original = read_session_log(path)  # the green cubes were sorted as red
+
+    decisions = diff_sessions(original, replay_decisions(original, script_classifier("DeliverySystem")))
+    assert decisions.cubes == 5 and decisions.changed == [(1, 2, "R", "G"), (2, 1, "R", "G")]
+    assert decisions.missing == []
+
+    replayed, output = replay_session(original, "DeliverySystem")
+    assert list(replayed["color"]) == [b"R", b"G", b"R", b"G", b"R"]
+    assert list(replayed["run"]) == [1, 1, 1, 2, 2] and list(replayed["cube"]) == [1, 2, 3, 1, 2]
+    assert output.count("Touch sensor pressed") == 5
+    diff = diff_sessions(original, replayed)
+    assert diff.changed == decisions.changed and diff.missing == []
+    detect = diff.stages[STAGES.index("detect")]
+    assert detect.original_p50 == pytest.approx(0.5) and 0 < detect.replayed_p50 < 1
+    assert "run 2 cube 1: R -> G" in diff.report()
+    again, _ = replay_session(original, "DeliverySystem")  # no background thread moves the virtual clock
+    assert again["stages"].tobytes() == replayed["stages"].tobytes()
+    assert brick.use_threads() is True  # restored
+
+    missed = diff_sessions(original, replayed[[0, 1, 3, 4]])
+    assert missed.cubes == 4 and missed.missing == [(1, 3)]
+    assert brick.Motor.ALL_MOTORS["A"] is None  # the script's devices are forgotten
+
+
+
+@pytest.mark.parametrize("argv", [[], ["--pipeline"]])
+def test_sort_script_logs_failed_cubes(tmp_path, argv):
+    "Test that a cube whose sampling fails is still logged and traced, as an error."
+    path = tmp_path / "session.log"
+    clock = RealClock(speed=10) if argv else VirtualClock()
+    with contextlib.redirect_stdout(io.StringIO()), simulated_script("DeliverySystem", clock) as (module, sim):
+        start = clock.time()
+
+        def touch(sim):
+            if clock.time() - start > 2:
+                raise StopSimulation("done")
+            return int(1 <= clock.time() - start < 1.1)
+
+        def color(sim):
+            raise RuntimeError("color sensor unplugged")
+        sim.set_sensor_function(1, touch)
+        sim.set_sensor_function(2, color)
+        args = module.add_argparser().parse_args(["--session-log", str(path), "--metrics-port", "0", *argv])
+        errors = module.REJECTS.labels("error").value
+        (module.color_movement_pipeline if argv else module.color_movement)(args)
+        assert [trace.id for trace in module.TRACER.traces] == [1]
+        assert module.REJECTS.labels("error").value == errors + 1
+    records = read_session_log(path)
+    assert len(records) == 1 and OUTCOMES[records[0]["outcome"]] == "error" and records[0]["cube"] == 1
+
+
+if __name__ == "__main__":
+    print("To run the tests, run `pytest` on the command line or use the testing option (🧪) in Visual Studio Code.")
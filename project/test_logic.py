@@ -7,9 +7,19 @@ and can therefore be run on a computer.
 
 # change these imports based on your actual implementation
 
-from logic import get_bin_for_color
+from logic import (get_bin_for_color, ColorClassifier, ColorLookupTable, COLORS, UNKNOWN, normalize_rgb,
+                   read_rgb_log, StreamingColorDetector, TrayPlanner, travel_time, PushController)
+from utils.filters import (RobustAggregator, WidthFunctionFilter, SumFilter, MeanFilter, MaximumFilter,
+                           MinimumFilter, MedianFilter, IntegrationTracker, integration)
+from utils.motion import MotionProfile, Trajectory
+from utils.session_log import SessionLog, read_session_log, STAGES
+from utils.tracing import LatencyHistogram, Tracer, span, current_trace
+from utils.metrics import Registry, MetricsExporter
 
+import numpy as np
 import pytest
+import random
+import statistics
 
 
 def test_pytest_is_working():
@@ -35,6 +45,375 @@ def test_get_bin_for_color():
             get_bin_for_color(bad_color)
 
 
+def test_classify_nearest_color():
+    """
+    Test that single samples, raw or normalized, are classified as the nearest reference color.
+    """
+    classifier = ColorClassifier(COLORS)
+    assert classifier.classify((120, 15, 10)).color == "R"
+    assert classifier.classify((10, 95, 12)).color == "G"
+    assert classifier.classify(normalize_rgb((25, 50, 60))).color == "B"
+
+    result = classifier.classify((200, 150, 0))
+    assert result.color == "Y"
+    assert result.distance == pytest.approx(min(result.distances.values()))
+    assert 0 < result.confidence <= 1
+
+
+def test_classify_unknown():
+    """
+    Test that samples far from every color, or without any light, are classified as unknown.
+    """
+    classifier = ColorClassifier(COLORS, threshold=0.3)
+    assert classifier.classify((10, 10, 200)).color == UNKNOWN
+    assert classifier.classify((0, 0, 0)).color == UNKNOWN
+    assert classifier.classify((0, 0, 0)).confidence == 0
+    assert ColorClassifier(COLORS).classify((10, 10, 200)).color == "B"
+
+
+def test_classify_batch_matches_single_samples():
+    """
+    Test that a vectorized batch gives the same results as classifying each sample.
+    """
+    classifier = ColorClassifier(COLORS, threshold=0.5)
+    samples = np.random.default_rng(0).uniform(0, 255, (500, 3))
+    samples[0] = 0
+    batch = classifier.classify_batch(samples)
+    assert batch.distances.shape == (500, 4)
+    for i in range(0, 500, 25):
+        single = classifier.classify(samples[i])
+        assert batch.colors[i] == single.color
+        assert batch.confidence[i] == pytest.approx(single.confidence)
+    assert batch.indices[0] == -1 and batch.colors[0] == UNKNOWN
+
+
+def test_calibration_table(tmp_path):
+    """
+    Test creating a classifier from calibration samples and saving/loading its table.
+    """
+    classifier = ColorClassifier.from_calibration({
+        "R": [(100, 10, 10), (200, 20, 20)],
+        "G": [(10, 100, 10), (12, 90, 8)],
+    }, threshold=0.4)
+    assert classifier.centroids[0] == pytest.approx(normalize_rgb((10, 1, 1)))
+    path = tmp_path / "calibration.json"
+    classifier.save(path)
+    loaded = ColorClassifier.load(path)
+    assert loaded.names == ["R", "G"]
+    assert loaded.threshold == 0.4
+    assert loaded.centroids == pytest.approx(classifier.centroids)
+
+    log = tmp_path / "music.log"
+    log.write_text("0.9, 0.1, 0.1\n0.1, 0.9, 0.1\n")
+    assert list(loaded.classify_batch(read_rgb_log(log)).colors) == ["R", "G"]
+
+
+def test_lookup_table(tmp_path):
+    """
+    Test that a compiled lookup table agrees with the classifier, and survives saving and memory-mapping.
+    """
+    classifier = ColorClassifier(COLORS, threshold=0.3)
+    table = ColorLookupTable.compile(classifier, bins=32)
+    assert table.table.shape == (32, 32, 32) and table.table.dtype == np.uint8
+    assert table.classify((120, 15, 10)) == "R"
+    assert table.classify((10, 95, 12)) == "G"
+    assert table.classify((10, 10, 200)) == UNKNOWN
+    assert table.classify((300, 20, 20)) == "R"  # beyond max_value, in the last cell
+
+    path = tmp_path / "colors.lut"
+    table.save(path)
+    loaded = ColorLookupTable.load(path)
+    assert isinstance(loaded.table, np.memmap)
+    assert loaded.names == table.names
+    samples = np.random.default_rng(1).uniform(0, 255, (2000, 3))
+    assert np.array_equal(loaded.classify_batch(samples), table.classify_batch(samples))
+    assert np.mean(loaded.classify_batch(samples) == classifier.classify_batch(samples).colors) > 0.95
+
+    (tmp_path / "bad.lut").write_bytes(b"not a table")
+    with pytest.raises(ValueError):
+        ColorLookupTable.load(tmp_path / "bad.lut")
+
+
+def test_robust_aggregator():
+    "Test the running median and trimmed mean, with outliers and missing samples."
+    median = RobustAggregator("median")
+    assert median.estimate() is None
+    for sample in [[10, 20, 30], None, [12, 200, 28], [None, None, None], [11, 21, 29]]:
+        median.append(sample)
+    assert median.estimate() == [11, 21, 29]
+    assert len(median) == 3 and median.missing == 2
+
+    trimmed = RobustAggregator("trimmed_mean", trim=0.2)
+    for value in [4, 100, 1, 3, 2]:
+        trimmed.append(value)
+    assert trimmed.estimate() == 3
+    with pytest.raises(ValueError):
+        RobustAggregator("mean")
+
+
+def test_incremental_window_filters():
+    "Test that the incremental window filters match the window functions as the source grows."
+    rng = random.Random(0)
+    source = []
+    filters = [(SumFilter, sum), (MeanFilter, statistics.mean), (MaximumFilter, max), (MinimumFilter, min),
+               (MedianFilter, statistics.median)]
+    filters = [(cls(source, 4), WidthFunctionFilter(source, 4, func)) for cls, func in filters]
+    for _ in range(60):
+        source.append(rng.choice([rng.randint(-5, 5), rng.uniform(-5, 5)]))
+        if len(source) >= 4:
+            for incremental, direct in filters:
+                assert incremental[:] == pytest.approx(direct[:])
+                assert incremental[-1] == pytest.approx(direct[-1])
+                assert incremental[1:len(source) + 3:2] == pytest.approx(direct[1:len(source) + 3:2])
+
+    median = MedianFilter(source, 4)
+    source[:] = [1, 2, 3, 4, 5]
+    median.reset()  # values were changed in place
+    assert median[:] == [2.5, 3.5, 3.5, 3.5, 3.5] and len(median) == 5
+    source[0] = 100
+    assert median[0] == 2.5  # not detected
+    median.reset()
+    assert median[0] == 3.5
+
+
+def test_filters_on_numpy_arrays():
+    "Test that integration, IntegrationTracker and window filters give the same results on NumPy arrays."
+    samples = [0, 1, 2, 3, 4]
+    assert integration(samples) == [0, 0.5, 2, 4.5, 8]
+    assert np.array_equal(integration(np.array(samples)), [0, 0.5, 2, 4.5, 8])
+    assert np.array_equal(integration(np.array(samples), np.array([1, 1, 2, 2])), integration(samples, [1, 1, 2, 2]))
+
+    tracker, typed = IntegrationTracker(), IntegrationTracker(typed=True)
+    for t in (tracker, typed):
+        t.append(0)
+        t.extend([1, (2, 2)])
+    typed.extend(np.array([[3, 1], [4, 1]]))
+    tracker.extend([3, 4])
+    assert typed[:] == pytest.approx(tracker[:]) and np.array_equal(typed.to_numpy(), tracker[:])
+    assert typed.get_original() == tracker.get_original()
+
+    values = np.random.default_rng(0).normal(size=50)
+    for cls in (SumFilter, MeanFilter, MaximumFilter, MinimumFilter, MedianFilter):
+        vectorized, incremental = cls(values, 5), cls(values.tolist(), 5)
+        assert isinstance(vectorized[:], np.ndarray)
+        assert vectorized[:] == pytest.approx(incremental[:])
+        assert vectorized[-1] == pytest.approx(incremental[-1])
+
+
+def test_streaming_color_detector_stops_early():
+    "Test that detection stops once the color is clear, and only after max_samples otherwise."
+    classifier = ColorClassifier(COLORS, threshold=0.3)
+    detector = StreamingColorDetector(classifier, min_samples=3, max_samples=9)
+    results = [detector.add(sample) for sample in [None, [110, 14, 12], [250, 250, 250], [112, 13, 11]]]
+    assert results[:-1] == [None] * 3
+    assert results[-1].color == "R" and detector.done and detector.samples == 4  # outlier ignored
+    assert detector.add([108, 15, 12]) is results[-1] and detector.samples == 4
+
+    unclear = StreamingColorDetector(classifier, min_samples=3, max_samples=6)
+    while not unclear.done:
+        unclear.add([10, 10, 200])
+    assert unclear.samples == 6 and unclear.result.color == UNKNOWN
+
+    missing = StreamingColorDetector(classifier, max_samples=2)
+    missing.add(None)
+    assert missing.add(None).color == UNKNOWN and missing.estimate() is None
+
+
+def test_tray_planner():
+    "Test that tray moves go straight between bins, with speeds making both motors arrive together."
+    assert travel_time(1500, max_dps=1500, acceleration=15000) == pytest.approx(1.1)  # 0.1 s to speed up and down
+    assert travel_time(15, max_dps=1500, acceleration=15000) == pytest.approx(2 * 0.001 ** 0.5)
+    assert travel_time(-15, 1500, 15000) == travel_time(15, 1500, 15000)
+
+    planner = TrayPlanner({'R': (0, 0), 'G': (60, -60), 'B': (-50, 50)}, max_dps=1500, acceleration=15000,
+                          settle_time=0.1)
+    move = planner.plan((60, -60), 'B')
+    assert move.start == (60, -60) and move.targets == (-50, 50)
+    assert move.dps == (1500, 1500) and move.duration == pytest.approx(travel_time(110, 1500, 15000) + 0.1)
+    move = planner.plan((30, 0), 'G')
+    assert move.dps == (750, 1500)
+    assert planner.plan((0, 0), 'R').duration == 0
+    assert planner.plan((0, 0), 'Y') is None
+
+
+def test_push_controller_slows_down_near_target(tmp_path):
+    "Test that the push runs fast, slows down near the target and stops within the overshoot, either way."
+    for target in (30, -30):
+        controller = PushController(target, max_dps=500, min_dps=40, slow_zone=10, max_overshoot=3)
+        angle, t, lag = 0.0, 0.0, [0.0] * 5  # the angle follows the motor a few steps late
+        while t < 3:
+            lag.append(controller.step(t, angle, lag[0] / 4 * controller.direction) / 4 * controller.direction)
+            angle += lag.pop(0) * 0.01
+            t += 0.01
+        dps = [sample.dps for sample in controller.samples]
+        assert dps[0] == 500 and 40 <= min(d for d in dps if d) < 100 and dps[-1] == 0
+        assert controller.done and 0 < controller.time_to_target < 1
+        assert controller.within_overshoot and abs(controller.error) < 3
+    assert PushController(30).time_to_target is None
+
+    path = tmp_path / "push.log"
+    with open(path, "w") as file:
+        controller.write_csv(file, label=1)
+    assert path.read_text().splitlines()[0] == "1, 0.0000, 0.0, 0.0, 500"
+
+
+def test_motion_profiles():
+    "Test that trajectories end on target, within their speed and acceleration limits, in either direction."
+    for kind in ("trapezoidal", "s-curve"):
+        for start, target in [(0, 1000), (100, 40), (0, 2)]:
+            profile = MotionProfile(kind, max_dps=1200, acceleration=8000, jerk=150000)
+            trajectory = profile.trajectory(start, target)
+            assert trajectory.sample(trajectory.duration) == (target, 0, 0)
+            assert trajectory.sample(trajectory.duration - 1e-9).position == pytest.approx(target)
+            samples = [trajectory.sample(t / 1000) for t in range(int(trajectory.duration * 1000))]
+            assert max(abs(s.velocity) for s in samples) <= 1200 + 1e-6
+            assert max(abs(s.acceleration) for s in samples) <= 8000 + 1e-6
+            positions = [s.position for s in samples]
+            assert positions == sorted(positions, reverse=target < start)  # never goes back
+
+    long_move = Trajectory.trapezoidal(0, 1000, max_dps=1000, acceleration=10000)
+    assert long_move.duration == pytest.approx(1.1) and long_move.peak_velocity == pytest.approx(1000)
+    assert Trajectory.s_curve(0, 1000, 1000, 10000, 100000).duration > long_move.duration
+    assert Trajectory.s_curve(5, 5).duration == 0
+    with pytest.raises(ValueError):
+        MotionProfile("linear").trajectory(0, 10)
+
+
+def test_session_log(tmp_path):
+    "Test that session log records are appended in the background and read back memory-mapped."
+    path = tmp_path / "session.log"
+    with SessionLog(path, buffer_size=2) as log:
+        for cube in range(1, 4):
+            log.write(time=100.0 + cube, cube=cube, samples=[[110, 14, 12], None, [None, 13, 11]],
+                      rgb=(0.99, 0.12, 0.1), color="R", confidence=0.8, targets={"A": 60 * cube},
+                      statuses={"A": "reached"}, stages={"detect": 0.3, "actuate": 0.5})
+    with SessionLog(path) as log:  # appends
+        log.write(cube=4, samples=[], stages={"detect": 0.9})
+    with open(path, "ab") as f:
+        f.write(b"partial")  # record being written
+
+    records = read_session_log(path)
+    assert isinstance(records, np.memmap) and len(records) == 4
+    assert list(records["run"]) == [1, 1, 1, 2]
+    assert list(records["cube"]) == [1, 2, 3, 4]
+    assert list(records["color"]) == [b"R", b"R", b"R", b""]
+    assert list(records["sample_count"]) == [2, 2, 2, 0]
+    assert records[0]["samples"][1].tolist()[1:] == [13, 11] and np.isnan(records[0]["samples"][1][0])
+    assert np.isnan(records[0]["samples"][2:]).all()
+    assert records["targets"][:, 0].tolist()[:3] == [60, 120, 180] and np.isnan(records["targets"][:, 1:]).all()
+    assert records["statuses"][0].tolist() == [2, 0, 0, 0]
+    assert records["stages"][:3, STAGES.index("actuate")] == pytest.approx([0.5] * 3)
+    assert np.isnan(records[3]["rgb"]).all() and np.isnan(records[3]["time"])
+    assert read_session_log(path, mmap=False).tobytes() == records.tobytes()
+
+    with SessionLog(path) as log:  # after a crash: the partial record is cut off
+        log.write(time=200.0, cube=1, color="G")
+    records = read_session_log(path)
+    assert len(records) == 5 and (path.stat().st_size - records.offset) % records.itemsize == 0
+    assert (records[4]["run"], records[4]["cube"], records[4]["color"], records[4]["time"]) == (3, 1, b"G", 200.0)
+
+    (tmp_path / "bad.log").write_bytes(b"not a session log")
+    with pytest.raises(ValueError):
+        read_session_log(tmp_path / "bad.log")
+
+
+def test_latency_histogram():
+    "Test that histogram percentiles are within a bucket width of the exact ones, and exact at the ends."
+    rng = random.Random(3)
+    durations = [rng.uniform(0.1, 0.3) for _ in range(5000)] + [150.0]
+    histogram = LatencyHistogram()
+    for seconds in durations:
+        histogram.add(seconds)
+    durations.sort()
+    for q in (50, 95, 99):
+        assert histogram.percentile(q) == pytest.approx(durations[int(q / 100 * len(durations))], rel=0.1)
+    assert histogram.percentile(0) == min(durations) and histogram.percentile(100) == 150.0
+    assert histogram.counts[-1] == 1  # beyond TRACE_MAX
+    assert np.isnan(LatencyHistogram().percentile(50))
+
+
+def test_tracer_spans():
+    "Test that spans go to the trace active on their thread, and into the histograms of the tracer."
+    tracer = Tracer(keep=2)
+    with span("ignored"):  # no active trace
+        pass
+    for cube in range(3):
+        trace = tracer.start(start=0.0 if cube == 0 else None)
+        with trace.active():
+            assert current_trace() is trace
+            for _ in range(2):
+                with span("sample"):
+                    pass
+            trace.add("touch", trace.start, trace.start + 0.01)
+        assert current_trace() is None
+        trace.finish()
+        trace.finish()  # counted once
+    assert [trace.id for trace in tracer.traces] == [2, 3]
+    assert set(tracer.histograms) == {"sample", "touch", "cycle"}
+    assert tracer.histograms["sample"].count == 6 and tracer.histograms["cycle"].count == 3
+    assert tracer.histograms["cycle"].max > 1  # the first trace started at time 0
+    assert trace.breakdown()["touch"] == pytest.approx(0.01)
+    report = tracer.report()
+    assert report.splitlines()[1].split()[0] == "cycle" and "sample" in report and "ignored" not in report
+
+
+def test_tracer_signal_during_record(capsys):
+    "Test that a report signal arriving while the main thread records a span does not deadlock."
+    import os
+    import signal
+    if not hasattr(signal, "SIGUSR1"):
+        pytest.skip("no SIGUSR1 on this platform")
+    tracer = Tracer()
+    tracer.record("sample", 0.1)
+    previous = signal.getsignal(signal.SIGUSR1)
+    try:
+        tracer.install(at_exit=False)
+        with tracer._lock:  # as in record()
+            os.kill(os.getpid(), signal.SIGUSR1)
+            tracer.record("sample", 0.2)
+    finally:
+        signal.signal(signal.SIGUSR1, previous)
+    assert "sample" in capsys.readouterr().err
+
+
+def test_metrics_registry(tmp_path):
+    "Test counters, gauges and histograms, and their Prometheus text, JSON snapshot and HTTP endpoint."
+    import json
+    import urllib.request
+
+    registry = Registry()
+    cubes = registry.counter("sort_cubes_total", "Cubes sorted", labels=("color",))
+    cubes.labels("R").inc()
+    cubes.labels("R").inc(2)
+    assert registry.counter("sort_cubes_total", "Cubes sorted", labels=("color",)) is cubes
+    with pytest.raises(ValueError):
+        registry.gauge("sort_cubes_total", "Cubes sorted")
+    with pytest.raises(ValueError):
+        cubes.labels("R", "extra")
+    registry.gauge("queue", "Items waiting").set(4)
+    registry.gauge("rate", "Computed when read", function=lambda: 1.5)
+    cycle = registry.histogram("cycle_seconds", "Cycle time")
+    for seconds in (0.5, 0.6, 3.0):
+        cycle.observe(seconds)
+
+    text = registry.exposition()
+    assert '# TYPE sort_cubes_total counter\nsort_cubes_total{color="R"} 3\n' in text
+    assert "queue 4\n" in text and "rate 1.5\n" in text
+    assert 'cycle_seconds_bucket{le="1"} 2\n' in text and 'cycle_seconds_bucket{le="+Inf"} 3\n' in text
+    assert "cycle_seconds_count 3\n" in text
+
+    path = tmp_path / "metrics.json"
+    with MetricsExporter(registry, port=0, json_path=str(path), interval=60) as exporter:
+        host, port = exporter.address
+        with urllib.request.urlopen(f"http://{host}:{port}/metrics") as response:
+            assert response.read().decode() == registry.exposition()
+        with urllib.request.urlopen(f"http://{host}:{port}/metrics.json") as response:
+            snapshot = json.loads(response.read())
+    assert snapshot["metrics"]["sort_cubes_total"]["values"] == [{"labels": {"color": "R"}, "value": 3}]
+    assert snapshot["metrics"]["cycle_seconds"]["values"][0]["value"]["count"] == 3
+    assert json.loads(path.read_text())["metrics"]["rate"]["values"][0]["value"] == 1.5  # written on close
+
+
 if __name__ == "__main__":
     print("To run the tests, first run `pipenv` with the project's virtual environment activated. "
           "This can be done automatically in Visual Studio Code by running the relevant task "
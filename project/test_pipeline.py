@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+"""
+File containing tests for utils.pipeline.
+"""
+
+from utils.pipeline import Pipeline
+
+import threading
+import time
+
+
+def test_stages_overlap_and_keep_order():
+    "Test that stages work on consecutive items at the same time, in order, and report their occupancy."
+    running = set()
+    overlapped = threading.Event()
+
+    def stage(name, seconds):
+        def run(item):
+            running.add(name)
+            if len(running) > 1:
+                overlapped.set()
+            time.sleep(seconds)
+            running.discard(name)
+            return item + [name]
+        return run
+
+    finished = []
+    pipeline = Pipeline([("detect", stage("detect", 0.02)), ("actuate", stage("actuate", 0.05)),
+                         ("confirm", lambda item: finished.append(item) or item)])
+    with pipeline:
+        for i in range(5):
+            pipeline.put([i])
+    assert finished == [[i, "detect", "actuate"] for i in range(5)]
+    assert overlapped.is_set()
+    assert pipeline.elapsed < 5 * (0.02 + 0.05)  # faster than one item at a time
+
+    detect, actuate, confirm = pipeline.stats()
+    assert detect.items == actuate.items == confirm.items == 5
+    assert actuate.occupancy > detect.occupancy and detect.blocked > 0  # waited on the slower stage
+    assert "actuate" in pipeline.report().splitlines()[2] and "bottleneck" in pipeline.report().splitlines()[2]
+
+
+def test_dropped_items_and_errors():
+    "Test that items a stage returns None for, or fails on, are dropped without stopping the pipeline."
+    def classify(item):
+        if item == 2:
+            raise ValueError("cannot classify")
+        return None if item == 3 else item
+
+    finished = []
+    with Pipeline([("classify", classify), ("confirm", finished.append)]) as pipeline:
+        for i in range(5):
+            assert pipeline.put(i, timeout=1)
+    classify_stats, confirm_stats = pipeline.stats()
+    assert finished == [0, 1, 4]
+    assert classify_stats.items == 3 and classify_stats.dropped == 2 and classify_stats.errors == 1
+
+
+if __name__ == "__main__":
+    print("To run the tests, run `pytest` on the command line or use the testing option (🧪) in Visual Studio Code.")
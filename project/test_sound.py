@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+"""
+File containing tests for utils.sound. They are skipped when simpleaudio is not installed.
+"""
+
+import pytest
+
+pytest.importorskip("simpleaudio")
+
+from utils import sound
+
+
+def test_numpy_wave_matches_python_wave():
+    "Test that the NumPy generator gives exactly the same samples as the pure Python one."
+    for params in [(0.5, sound.vol_to_amp(40), 440.0, 0, 0, 0, 0, 1, 0.01, 8000),
+                   (0.2, sound.vol_to_amp(80), 1.0, 440.0, 1, 5, 0.5, 0.5, 0.05, 44100)]:
+        assert sound._gen_wave_numpy(*params) == sound._gen_wave(*params)
+
+
+def test_waves_are_cached():
+    "Test that the same sound is generated once, and that each Sound gets its own copy of the wave."
+    sound._cached_wave.cache_clear()
+    a = sound.Sound(duration=0.1, pitch="C4")
+    b = sound.Sound(duration=0.1, pitch="C4")
+    assert sound._cached_wave.cache_info().hits == 1
+    assert a.audio == b.audio and a.audio is not b.audio
+    a.alter_wave(lambda x, y: 0)
+    assert b.audio != a.audio
+    assert sound._cached_wave.cache_info().maxsize == sound.WAVE_CACHE_SIZE
+
+
+if __name__ == "__main__":
+    print("To run the tests, run `pytest` on the command line or use the testing option (🧪) in Visual Studio Code.")
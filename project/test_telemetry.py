@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+"""
+File containing tests for utils.telemetry. Tests that open a window are skipped without a display.
+"""
+
+import pytest
+import threading
+
+pytest.importorskip("tkinter")
+
+from utils import telemetry
+
+
+@pytest.fixture
+def producers(monkeypatch):
+    "Telemetry that accepts data without a window, to test the producer side alone."
+    monkeypatch.setattr(telemetry, "_EXIT_FLAG", False)
+    monkeypatch.setattr(telemetry, "_PENDING", {})
+    monkeypatch.setattr(telemetry, "_SAMPLES", {})
+    return telemetry
+
+
+def test_add_keeps_latest_value(producers):
+    "Test that add() only keeps the latest value of each key, and plot() the last PLOT_SAMPLES numbers."
+    for i in range(1000):
+        producers.add("counter", i)
+        producers.plot("speed", i)
+    producers.add("color", "red", True)
+    assert producers._PENDING == {"counter": (999, False), "color": ("red", True)}
+    samples = producers._SAMPLES["speed"]
+    assert samples.count == 1000
+    assert [v for _, v in samples.window(producers.PLOT_SAMPLES)] == list(range(1000 - producers.PLOT_SAMPLES, 1000))
+
+
+def test_background_window():
+    "Test that a background window shows values added from another thread, and closes with stop()."
+    try:
+        telemetry.start(background=True, frame_rate=100)
+    except telemetry.TclError:
+        pytest.skip("no display")
+    try:
+        slider = telemetry.create_slider(0, 10, 4)
+        assert slider.get_value() == 4
+
+        def control_loop():
+            for i in range(100):
+                telemetry.add("counter", i, True)
+                telemetry.plot("speed", i % 7)
+
+        thread = threading.Thread(target=control_loop)
+        thread.start()
+        thread.join()
+        rendered = threading.Event()
+        telemetry._call(telemetry.WINDOW.after, 50, rendered.set)
+        assert rendered.wait(5)
+        assert telemetry.LABELS["counter"][2] == "counter : 99"
+        assert telemetry.PLOTS["speed"][4] == 100
+    finally:
+        telemetry.stop()
+    assert not telemetry.isopen() and telemetry.WINDOW is None
+
+
+def test_update_shows_latest_value():
+    "Test that each update() shows the values added just before it, however soon after the last one."
+    try:
+        telemetry.start()
+    except telemetry.TclError:
+        pytest.skip("no display")
+    try:
+        for i in range(3):
+            telemetry.add("counter", i, True)
+            telemetry.update()
+            assert telemetry.LABELS["counter"][2] == "counter : {}".format(i)
+    finally:
+        telemetry.stop()
+        telemetry._EXIT_FLAG = True
+        telemetry.LABELS = {}
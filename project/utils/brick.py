@@ -9,19 +9,47 @@ from __future__ import annotations
 try:
     from brickpi3 import *
 except ModuleNotFoundError:
-    from .brickpi3 import *
+    try:
+        from .brickpi3 import *
+    except ModuleNotFoundError:
+        from .simulation import *
 
-from typing import Literal, Type
+from types import MappingProxyType
+from typing import Callable, Literal, Mapping, NamedTuple, Type
 import math
 import atexit
 import os
-import signal
+import threading
 import time
 import sys
 
+from .filters import RingBuffer
+from .metrics import REGISTRY
+from .motion import MotionProfile, Trajectory
+
 WAIT_READY_INTERVAL = 0.01
+SAMPLING_RATE = 100  # samples per second for each sensor, see start_sampling
+SAMPLING_BUFFER_SIZE = 256  # samples kept per sensor, see start_sampling
+TOUCH_POLL_INTERVAL = 0.005  # seconds between touch sensor reads for press/release events
+TOUCH_DEBOUNCE = 0.02  # seconds a touch sensor state must hold before it counts as an edge
+MOVE_TOLERANCE = 2  # degrees from its target at which a motor move counts as reached
+MOVE_SETTLE_SPEED = 20  # degrees per second under which a motor counts as settled
+MOVE_STALL_TIME = 0.1  # seconds a motor must stay overloaded and still to count as stalled
+MOVE_POLL_INTERVAL = 0.005  # seconds between motor status reads while waiting on a move
+COLOR_CACHE_MAX_AGE = 0.05  # seconds a color sensor value stays fresh for ColorReadScheduler
 INF = float("inf")
 
+BUS_CALLS = REGISTRY.counter("brick_calls_total", "BrickPi3 calls, by method", labels=("method",))
+BUS_ERRORS = REGISTRY.counter("brick_io_errors_total", "BrickPi3 calls that raised IOError, by method",
+                              labels=("method",))
+MOTOR_OVERLOADED = REGISTRY.counter("motor_overloaded_total", "Times a move saw the OVERLOADED flag get set, by port",
+                                    labels=("port",))
+MOTOR_MOVES = REGISTRY.counter("motor_moves_total", "Finished motor moves, by port and status",
+                               labels=("port", "status"))
+_STATUS_CALLS, _STATUS_ERRORS = BUS_CALLS.labels("get_sensor_status"), BUS_ERRORS.labels("get_sensor_status")
+REGISTRY.counter("sensor_status_reads_saved_total", "Status reads skipped for sensors known to be ready",
+                 function=lambda: Sensor.status_reads_saved)
+
 PORTS: dict[str, int] = {
     '1': BrickPi3.PORT_1,
     '2': BrickPi3.PORT_2,
@@ -81,18 +109,58 @@ SENSOR_STATE = Enumeration("""
     """)
 SENSOR_CODES = RevEnumeration(SENSOR_STATE)
 
-BP = None
+PID_FILE = "~/brickpi3_pid"  # process ID of the program using the brick, to force stop it if needed
 
+# BP, the BrickPi3 instance, is created by get_backend() when the first device needs it, not on import.
+# `from utils.brick import BP` creates it too, see __getattr__ below.
+_backend_lock = threading.Lock()
 
-try:
-    import spidev
-    BP = BrickPi3()  # The BrickPi3 instance
-except ModuleNotFoundError as err:
-    class _FakeBP():
-        def reset_all(self):
-            pass
-    print('spidev not found, unable to initialize BP', file=sys.stderr)
-    BP = _FakeBP()
+
+def get_backend() -> BrickPi3:
+    """
+    Return the BrickPi3 instance used by new sensors and motors (BP), creating it on the first call:
+    a BrickPi3 on the robot, or a utils.simulation.SimulatedBrickPi3 if spidev is not installed.
+
+    Creating it also writes PID_FILE and resets the brick when the program exits.
+    """
+    global BP
+    with _backend_lock:
+        if globals().get("BP") is None:
+            try:
+                import spidev
+                BP = BrickPi3()
+            except ModuleNotFoundError:
+                from .simulation import SimulatedBrickPi3
+                print('spidev not found, using a simulated BrickPi3', file=sys.stderr)
+                BP = SimulatedBrickPi3()
+            _write_pid_file()
+            try:
+                atexit.register(reset_brick)
+            except ValueError as err:
+                print(err, "Must create devices in main thread", file=sys.stderr)
+        return BP
+
+
+def __getattr__(name: str):
+    if name == "BP":
+        return get_backend()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def set_backend(backend: BrickPi3) -> BrickPi3:
+    """
+    Replace the BrickPi3 instance used by sensors and motors created from now on,
+    eg, with a utils.simulation.SimulatedBrickPi3 running on a VirtualClock.
+
+    Return the previous instance, None if it was not created yet.
+    """
+    global BP
+    previous = globals().get("BP")
+    if backend is None:
+        globals().pop("BP", None)  # created again when needed
+    else:
+        BP = backend
+    return previous
 
 
 class ColorMapping:
@@ -138,17 +206,128 @@ class Color:
 _color_names_by_code = {c.code: c.name for c in ColorMappings._all_mappings}
 
 
-class Brick(BrickPi3):
+class Snapshot(NamedTuple):
+    """
+    Immutable readings of every configured sensor and registered motor, taken by Brick.read_all().
+
+    time - time.monotonic() when the readings were taken
+    sensors - sensor port ('1' to '4') -> raw value, None if the sensor had no valid data
+    sensor_types - sensor port -> SENSOR_TYPE the sensor was configured with at the time
+    motors - motor port ('A' to 'D') -> (flags, power, encoder, dps), see Motor.get_status
+    """
+    time: float
+    sensors: Mapping[str, object]
+    sensor_types: Mapping[str, int]
+    motors: Mapping[str, tuple]
+
+    def age(self) -> float:
+        "Seconds since the readings were taken."
+        return time.monotonic() - self.time
+
+
+_latest_snapshot: Snapshot = None
+_snapshot_max_age: float = None
+_use_threads = True
+
+
+def use_snapshots(max_age: float | None = 0.05):
+    """
+    Let sensor and motor getters return values from the latest snapshot taken by read_all()
+    when it is at most max_age seconds old, instead of making their own SPI transfer.
+
+    Use max_age=None to always read from the bus (the default).
     """
-    Wrapper class for the BrickPi3 class. Comes with additional methods such get_sensor_status.
+    global _snapshot_max_age
+    _snapshot_max_age = max_age
+
+
+def use_threads(enabled: bool = True) -> bool:
     """
+    Let touch sensor waits and profiled moves use background threads (the default), or not.
+
+    Without threads, wait_for_press reads the sensor on the waiting thread, and profiled moves send their
+    setpoints when polled, eg, by wait. Only the script's own thread then sleeps, so a script run on a
+    simulation VirtualClock takes the same simulated time as on the robot. Callbacks only run during waits.
+    Return the previous setting.
+    """
+    global _use_threads
+    previous, _use_threads = _use_threads, enabled
+    return previous
+
+
+def latest_snapshot(max_age: float = None) -> Snapshot | None:
+    """
+    Return the latest snapshot taken by read_all(), or None if there is none.
+    When max_age is given, also return None if the snapshot is older than max_age seconds.
+    """
+    if _latest_snapshot is None:
+        return None
+    if max_age is not None and _latest_snapshot.age() > max_age:
+        return None
+    return _latest_snapshot
+
+
+def _fresh_snapshot() -> Snapshot | None:
+    "Latest snapshot if getters are allowed to use it, None otherwise."
+    if _snapshot_max_age is None:
+        return None
+    return latest_snapshot(_snapshot_max_age)
+
+
+def _freeze(value):
+    "Make sensor values immutable so they can be stored in a Snapshot."
+    return tuple(value) if isinstance(value, list) else value
 
-    def __init__(self):
-        self.bp = BP
-        child = self.__dict__
-        parent = BP.__dict__
-        for key in parent.keys():
-            setattr(self, str(key), child.get(key, parent.get(key)))
+
+def _thaw(value):
+    "Give sensor values back the type the brick returns."
+    return list(value) if isinstance(value, tuple) else value
+
+
+_brick: Brick = None  # shared handle, see Brick
+
+
+class Brick:
+    """
+    Shared, thread-safe handle to the BrickPi3 instance (BP), used by every sensor and motor.
+    Comes with additional methods such get_sensor_status.
+
+    Brick() returns the same handle as long as the BrickPi3 instance stays the same, see set_backend.
+    Other attributes are those of the BrickPi3 instance, and are set on it too. Its methods hold the lock of
+    the handle, so that threads, eg, the sampler and the touch poller, never interleave their bus transfers.
+    """
+
+    def __new__(cls):
+        global _brick
+        backend = get_backend()
+        if _brick is None or _brick.bp is not backend:
+            _brick = super().__new__(cls)
+            object.__setattr__(_brick, "bp", backend)
+            object.__setattr__(_brick, "lock", threading.RLock())
+        return _brick
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self.bp, name)
+        if not callable(attribute) or isinstance(attribute, type):
+            return attribute
+
+        calls, errors = BUS_CALLS.labels(name), BUS_ERRORS.labels(name)
+
+        def locked(*args, **kwargs):
+            with self.lock:
+                calls.inc()
+                try:
+                    return attribute(*args, **kwargs)
+                except IOError:
+                    errors.inc()
+                    raise
+        locked.__name__ = name
+        object.__setattr__(self, name, locked)  # found directly next time
+        return locked
+
+    def __setattr__(self, name: str, value):
+        self.__dict__.pop(name, None)
+        setattr(self.bp, name, value)
 
     def get_sensor_status(self, port: Literal[1, 2, 4, 8]):
         """
@@ -165,7 +344,19 @@ class Brick(BrickPi3):
         3: NO_DATA
         4: I2C_ERROR
         5: INCORRECT_SENSOR_PORT
+
+        Counted as one bus call in the metrics, like the BrickPi3 methods, and not as its SPI transfers.
         """
+        with self.lock:
+            _STATUS_CALLS.inc()
+            try:
+                return self._get_sensor_status(port)
+            except IOError:
+                _STATUS_ERRORS.inc()
+                raise
+
+    def _get_sensor_status(self, port: Literal[1, 2, 4, 8]):
+        "Body of get_sensor_status, with the lock held. Transfers go straight to the BrickPi3 instance."
         if port == self.PORT_1:
             message_type = self.BPSPI_MESSAGE_TYPE.GET_SENSOR_1
             port_index = 0
@@ -184,7 +375,7 @@ class Brick(BrickPi3):
 
         if self.SensorType[port_index] == self.SENSOR_TYPE.CUSTOM:
             outArray = [self.SPI_Address, message_type, 0, 0, 0, 0, 0, 0, 0, 0]
-            reply = self.spi_transfer_array(outArray)
+            reply = self.bp.spi_transfer_array(outArray)
             if reply[3] == 0xA5:
                 if reply[4] == self.SensorType[port_index]:
                     return reply[5]
@@ -197,7 +388,7 @@ class Brick(BrickPi3):
             outArray = [self.SPI_Address, message_type, 0, 0, 0, 0]
             for b in range(self.I2CInBytes[port_index]):
                 outArray.append(0)
-            reply = self.spi_transfer_array(outArray)
+            reply = self.bp.spi_transfer_array(outArray)
             if reply[3] == 0xA5:
                 if reply[4] == self.SensorType[port_index]:
                     return reply[5]
@@ -216,7 +407,7 @@ class Brick(BrickPi3):
               or self.SensorType[port_index] == self.SENSOR_TYPE.EV3_ULTRASONIC_LISTEN
               or self.SensorType[port_index] == self.SENSOR_TYPE.EV3_INFRARED_PROXIMITY):
             outArray = [self.SPI_Address, message_type, 0, 0, 0, 0, 0]
-            reply = self.spi_transfer_array(outArray)
+            reply = self.bp.spi_transfer_array(outArray)
             if (reply[3] == 0xA5):
                 if ((reply[4] == self.SensorType[port_index] or (self.SensorType[port_index] == self.SENSOR_TYPE.TOUCH
                                                                  and (reply[4] == self.SENSOR_TYPE.NXT_TOUCH or reply[4] == self.SENSOR_TYPE.EV3_TOUCH)))):
@@ -229,7 +420,7 @@ class Brick(BrickPi3):
         elif self.SensorType[port_index] == self.SENSOR_TYPE.NXT_COLOR_FULL:
             outArray = [self.SPI_Address, message_type,
                         0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
-            reply = self.spi_transfer_array(outArray)
+            reply = self.bp.spi_transfer_array(outArray)
             if reply[3] == 0xA5:
                 if reply[4] == self.SensorType[port_index]:
                     return reply[5]
@@ -249,7 +440,7 @@ class Brick(BrickPi3):
               or self.SensorType[port_index] == self.SENSOR_TYPE.EV3_ULTRASONIC_CM
               or self.SensorType[port_index] == self.SENSOR_TYPE.EV3_ULTRASONIC_INCHES):
             outArray = [self.SPI_Address, message_type, 0, 0, 0, 0, 0, 0]
-            reply = self.spi_transfer_array(outArray)
+            reply = self.bp.spi_transfer_array(outArray)
             if reply[3] == 0xA5:
                 if reply[4] == self.SensorType[port_index]:
                     return reply[5]
@@ -261,7 +452,7 @@ class Brick(BrickPi3):
         elif (self.SensorType[port_index] == self.SENSOR_TYPE.EV3_COLOR_RAW_REFLECTED
               or self.SensorType[port_index] == self.SENSOR_TYPE.EV3_GYRO_ABS_DPS):
             outArray = [self.SPI_Address, message_type, 0, 0, 0, 0, 0, 0, 0, 0]
-            reply = self.spi_transfer_array(outArray)
+            reply = self.bp.spi_transfer_array(outArray)
             if reply[3] == 0xA5:
                 if reply[4] == self.SensorType[port_index]:
                     return reply[5]
@@ -273,7 +464,7 @@ class Brick(BrickPi3):
         elif self.SensorType[port_index] == self.SENSOR_TYPE.EV3_COLOR_COLOR_COMPONENTS:
             outArray = [self.SPI_Address, message_type,
                         0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
-            reply = self.spi_transfer_array(outArray)
+            reply = self.bp.spi_transfer_array(outArray)
             if reply[3] == 0xA5:
                 if reply[4] == self.SensorType[port_index]:
                     return reply[5]
@@ -285,7 +476,7 @@ class Brick(BrickPi3):
         elif self.SensorType[port_index] == self.SENSOR_TYPE.EV3_INFRARED_SEEK:
             outArray = [self.SPI_Address, message_type,
                         0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
-            reply = self.spi_transfer_array(outArray)
+            reply = self.bp.spi_transfer_array(outArray)
             if reply[3] == 0xA5:
                 if reply[4] == self.SensorType[port_index]:
                     return reply[5]
@@ -296,7 +487,7 @@ class Brick(BrickPi3):
 
         elif self.SensorType[port_index] == self.SENSOR_TYPE.EV3_INFRARED_REMOTE:
             outArray = [self.SPI_Address, message_type, 0, 0, 0, 0, 0, 0, 0, 0]
-            reply = self.spi_transfer_array(outArray)
+            reply = self.bp.spi_transfer_array(outArray)
             if reply[3] == 0xA5:
                 if reply[4] == self.SensorType[port_index]:
                     return reply[5]
@@ -308,6 +499,40 @@ class Brick(BrickPi3):
         raise IOError(
             "get_sensor error: Sensor not configured or not supported.")
 
+    def read_all(self) -> Snapshot:
+        """
+        Read every sensor in Sensor.ALL_SENSORS and every motor in Motor.ALL_MOTORS, and return the
+        readings as an immutable Snapshot. The snapshot also becomes the latest snapshot, which
+        sensor and motor getters can use instead of the bus (see use_snapshots).
+
+        The BrickPi3 firmware answers one port per message, so this uses one transfer per device:
+        a sensor value reply already carries the sensor state (no get_sensor_status needed),
+        and a motor status reply already carries the encoder.
+        """
+        global _latest_snapshot
+        with self.lock:  # the same bus state for every device of the snapshot
+            sensors, sensor_types, motors = {}, {}, {}
+            for port, sensor in Sensor.ALL_SENSORS.items():
+                if sensor is None:
+                    continue
+                try:
+                    sensors[port] = _freeze(self.get_sensor(sensor.port))
+                    sensor.ready = True
+                except (SensorError, IOError):
+                    sensors[port] = None
+                    sensor.ready = False
+                sensor_types[port] = self.SensorType[int(port) - 1]
+            for port, motor in Motor.ALL_MOTORS.items():
+                if motor is None:
+                    continue
+                try:
+                    motors[port] = tuple(self.get_motor_status(motor.port))
+                except IOError:
+                    motors[port] = (None, None, None, None)
+            _latest_snapshot = Snapshot(time.monotonic(), MappingProxyType(sensors),
+                                        MappingProxyType(sensor_types), MappingProxyType(motors))
+            return _latest_snapshot
+
 
 class Sensor:
     """
@@ -322,11 +547,16 @@ class Sensor:
         INCORRECT_SENSOR_PORT = "INCORRECT_SENSOR_PORT"
 
     ALL_SENSORS = {key:None for key in '1 2 3 4'.split(' ')}
+    status_reads_saved = 0  # get_sensor_status transfers wait_ready skipped for sensors known to be ready
 
     def __init__(self, port: Literal[1, 2, 3, 4]):
         "Initialize sensor with a given port (1, 2, 3, or 4)."
         self.brick = Brick()
         self.port = PORTS[str(port).upper()]
+        self.ready = False  # known to give valid data, until set_mode, set_port or an error reply
+        self.ready_time: float = None  # seconds configure_ports waited for the sensor to be ready
+        self.buffer: RingBuffer = None
+        self._sampler: SensorSampler = None
         Sensor.ALL_SENSORS[str(port)] = self
 
     def get_status(self):
@@ -340,34 +570,82 @@ class Sensor:
         NO_DATA
         I2C_ERROR
         """
-        return SENSOR_CODES[self.brick.get_sensor_status(self.port)]
+        status = SENSOR_CODES[self.brick.get_sensor_status(self.port)]
+        self.ready = status == Sensor.Status.VALID_DATA
+        return status
+
+    def _set_type(self, sensor_type: int):
+        "Configure the port for the given sensor type. The sensor is not ready until it gives valid data again."
+        self.ready = False
+        self.brick.set_sensor_type(self.port, sensor_type)
 
     def set_port(self, port: Literal[1, 2, 3, 4]):
         "Change sensor port number. Does not unassign previous port."
         try:
+            self.ready = False
             self.port = PORTS[str(port).upper()]
             self.set_mode(self.mode)
         except SensorError as error:
             return error
 
     def get_value(self):
-        "Get the raw sensor value. May return a float, int, list or None if error."
+        """
+        Get the raw sensor value. May return a float, int, list or None if error.
+        Comes from the background sampler when it is running (see start_sampling),
+        or else from the latest snapshot when allowed by use_snapshots and taken in the current mode.
+        """
+        sensor_type = self.brick.SensorType[int(self._port_name()) - 1]
+        if self._sampler is not None and self._sampler.running:
+            sample = self.buffer.latest(tag=sensor_type)
+            if sample is not None:
+                return sample[1]
+        snapshot = _fresh_snapshot()
+        if snapshot is not None:
+            if snapshot.sensor_types.get(self._port_name()) == sensor_type:
+                return _thaw(snapshot.sensors[self._port_name()])
+        return self._read_value()
+
+    def _read_value(self):
+        "Get the raw sensor value from the brick, ignoring sampled and snapshot values."
         try:
-            return self.brick.get_sensor(self.port)
+            value = self.brick.get_sensor(self.port)
         except SensorError:
+            self.ready = False
             return None
+        self.ready = True
+        return value
+
+    def window(self, n: int) -> list:
+        """
+        Return the last n samples taken by the background sampler in the current mode,
+        oldest first, as (time, value) pairs. See start_sampling.
+        """
+        if self.buffer is None:
+            return []
+        return self.buffer.window(n, tag=self.brick.SensorType[int(self._port_name()) - 1])
+
+    def _port_name(self) -> str:
+        "Port number as a string, '1' to '4'."
+        return str(int(math.log2(self.port)) + 1)
 
     def get_raw_value(self):
         "Get the raw sensor value. May return a float, int, list or None if error."
         return self.get_value()
 
     def wait_ready(self):
-        "Wait (pause program) until the sensor is initialized."
+        """
+        Wait (pause program) until the sensor is initialized.
+        Returns at once, without reading the status, if the sensor is known to be ready (see Sensor.ready).
+        """
+        if self.ready:
+            Sensor.status_reads_saved += 1
+            return
         while self.get_status() != Sensor.Status.VALID_DATA:
             time.sleep(WAIT_READY_INTERVAL)
 
 
 def wait_ready_sensors(debug=False):
+    "Wait until every sensor in Sensor.ALL_SENSORS is initialized. No bus transfers if all are known to be ready."
     for port, sensor in Sensor.ALL_SENSORS.items():
         if sensor is not None:
             if debug:
@@ -377,10 +655,117 @@ def wait_ready_sensors(debug=False):
         print("All Sensors Initialized")
 
 
+class SensorSampler:
+    """
+    Background thread that reads sensors at a fixed rate into a ring buffer per sensor
+    (sensor.buffer), with timestamps from time.monotonic().
+
+    While it runs, sensor getters such as get_rgb(), is_pressed() and get_abs_measure() return the
+    latest sample immediately instead of waiting for an SPI transfer, and sensor.window(n) returns
+    the last n samples. Use start_sampling() and stop_sampling() rather than creating one directly.
+    """
+
+    def __init__(self, sensors: list[Sensor], rate: float | dict[str, float] = SAMPLING_RATE,
+                 size: int = SAMPLING_BUFFER_SIZE):
+        """
+        sensors - the sensors to sample
+        rate - samples per second, for all sensors or as a dict of port ('1' to '4') to rate
+        size - number of samples kept per sensor
+        """
+        self.sensors = list(sensors)
+        self.periods = {}
+        for sensor in self.sensors:
+            port = sensor._port_name()
+            sensor_rate = rate.get(port, SAMPLING_RATE) if isinstance(rate, dict) else rate
+            self.periods[port] = 1 / sensor_rate
+            if sensor.buffer is None or sensor.buffer.size != size:
+                sensor.buffer = RingBuffer(size, width=4)
+        self.running = False
+        self._next = {}
+        self._thread: threading.Thread = None
+
+    def poll(self) -> float:
+        "Sample every sensor that is due. Return the time until the next sensor is due, in seconds."
+        now = time.monotonic()
+        for sensor in self.sensors:
+            port = sensor._port_name()
+            if self._next.get(port, now) <= now:
+                try:
+                    value = sensor._read_value()
+                except IOError:
+                    value = None
+                sensor.buffer.append(now, value, tag=sensor.brick.SensorType[int(port) - 1])
+                self._next[port] = now + self.periods[port]
+        return max(0, min(self._next.values(), default=now) - time.monotonic())
+
+    def _run(self):
+        while self.running:
+            time.sleep(self.poll())
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        for sensor in self.sensors:
+            sensor._sampler = self
+        self._thread = threading.Thread(target=self._run, name="SensorSampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        "Stop sampling. Buffered samples remain available through sensor.window(n)."
+        self.running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        for sensor in self.sensors:
+            if sensor._sampler is self:
+                sensor._sampler = None
+
+
+_sampler: SensorSampler = None
+
+
+def start_sampling(rate: float | dict[str, float] = SAMPLING_RATE, size: int = SAMPLING_BUFFER_SIZE,
+                   sensors: list[Sensor] = None) -> SensorSampler:
+    """
+    Start reading sensors on a background thread (opt-in), by default every sensor in Sensor.ALL_SENSORS.
+
+    rate - samples per second, for all sensors or as a dict of port ('1' to '4') to rate, eg, {'1': 200, '2': 50}
+    size - number of samples kept per sensor, see Sensor.window
+
+    Example:
+
+    TOUCH_SENSOR, COLOR_SENSOR = configure_ports(PORT_1=TouchSensor, PORT_2=EV3ColorSensor)
+    start_sampling(rate={'1': 200, '2': 20})
+    TOUCH_SENSOR.is_pressed()  # latest sample, no waiting on the brick
+    COLOR_SENSOR.window(9)     # last 9 color samples with their timestamps
+    """
+    global _sampler
+    stop_sampling()
+    if sensors is None:
+        sensors = [sensor for sensor in Sensor.ALL_SENSORS.values() if sensor is not None]
+    _sampler = SensorSampler(sensors, rate, size)
+    _sampler.start()
+    return _sampler
+
+
+def stop_sampling():
+    "Stop the background sampler started by start_sampling, if any."
+    global _sampler
+    if _sampler is not None:
+        _sampler.stop()
+        _sampler = None
+
+
 class TouchSensor(Sensor):
     """
     Basic touch sensor class. There is only one mode.
     Gives values 0 to 1, with 1 meaning the button is being pressed.
+
+    Instead of polling is_pressed() in a loop, use wait_for_press(), wait_for_press_async(),
+    or on_press()/on_release() callbacks. These share one background poller thread that reads
+    the sensor every TOUCH_POLL_INTERVAL seconds and debounces it over TOUCH_DEBOUNCE seconds,
+    so a press is reported within about TOUCH_POLL_INTERVAL + TOUCH_DEBOUNCE (see TouchEvent.latency).
+    The sensor is only read while something waits on it or has callbacks on it.
     """
 
     def __init__(self, port: Literal[1, 2, 3, 4], mode:str="touch"):
@@ -389,6 +774,16 @@ class TouchSensor(Sensor):
         mode does not need to be set and actually does nothing here.
         """
         super(TouchSensor, self).__init__(port)
+        self.debounce = TOUCH_DEBOUNCE
+        self.last_event: TouchEvent = None
+        self.last_press: TouchEvent = None  # the release may already be the last event when a waiter wakes up
+        self._listeners = {"press": [], "release": [], "error": []}
+        self._edges = {"press": 0, "release": 0}
+        self._edge_condition = threading.Condition()
+        self._state = self._candidate = None
+        self._candidate_since = 0.0
+        self._error: Exception = None
+        self._waiters = 0
         self.set_mode(mode.lower())
 
     def set_mode(self, mode:str="touch"):
@@ -397,7 +792,7 @@ class TouchSensor(Sensor):
         This method is useless unless you wish to re-initialize the sensor.
         """
         try:
-            self.brick.set_sensor_type(self.port, BrickPi3.SENSOR_TYPE.TOUCH)
+            self._set_type(BrickPi3.SENSOR_TYPE.TOUCH)
             self.mode = mode.lower()
             return True
         except SensorError as error:
@@ -407,6 +802,228 @@ class TouchSensor(Sensor):
         "Return True if pressed, False otherwise."
         return self.get_value() == 1
 
+    def on_press(self, callback: Callable[[TouchEvent], None]) -> Callable:
+        """
+        Call callback(event) once each time the sensor gets pressed (debounced rising edge).
+        Callbacks run on the shared touch poller thread, so they should return quickly.
+        Return the callback, so this can be used as a decorator.
+        """
+        self._listeners["press"].append(callback)
+        _touch_poller.add(self)
+        return callback
+
+    def on_release(self, callback: Callable[[TouchEvent], None]) -> Callable:
+        "Call callback(event) once each time the sensor gets released (debounced falling edge)."
+        self._listeners["release"].append(callback)
+        _touch_poller.add(self)
+        return callback
+
+    def remove_callback(self, callback: Callable):
+        "Stop calling a callback given to on_press or on_release."
+        for listeners in self._listeners.values():
+            if callback in listeners:
+                listeners.remove(callback)
+        _touch_poller.release(self)
+
+    def _watched(self) -> bool:
+        "Return True if something waits on this sensor or has callbacks on it."
+        return self._waiters > 0 or any(self._listeners.values())
+
+    def _wait_for_edge(self, kind: str, timeout: float = None) -> bool:
+        with self._edge_condition:
+            self._error = None  # an error nobody waited for is not raised later
+            self._waiters += 1
+            target = self._edges[kind] + 1
+        try:
+            _touch_poller.add(self)
+            edge = lambda: self._edges[kind] >= target or self._error is not None
+            if _use_threads:
+                with self._edge_condition:
+                    self._edge_condition.wait_for(edge, timeout)
+            else:
+                _touch_poller.poll_until(edge, timeout)
+            with self._edge_condition:
+                if self._error is not None:
+                    error, self._error = self._error, None
+                    raise error
+                return self._edges[kind] >= target
+        finally:
+            with self._edge_condition:
+                self._waiters -= 1
+            _touch_poller.release(self)
+
+    def wait_for_press(self, timeout: float = None) -> bool:
+        """
+        Sleep until the sensor gets pressed, without using the CPU while waiting.
+        Holding the button down does not count as a new press.
+
+        Return True when pressed, or False if timeout (seconds) runs out first.
+        Errors raised while reading the sensor are raised here.
+        """
+        return self._wait_for_edge("press", timeout)
+
+    def wait_for_release(self, timeout: float = None) -> bool:
+        "Sleep until the sensor gets released. Return False if timeout (seconds) runs out first."
+        return self._wait_for_edge("release", timeout)
+
+    async def wait_for_press_async(self, timeout: float = None) -> bool:
+        "Same as wait_for_press, for asyncio code: `await TOUCH_SENSOR.wait_for_press_async()`."
+        import asyncio  # only imported by asyncio code, which already did
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(result):
+            if not future.done():
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+        def on_edge(event):
+            loop.call_soon_threadsafe(resolve, True)
+
+        def on_error(error):
+            loop.call_soon_threadsafe(resolve, error)
+
+        self._listeners["press"].append(on_edge)
+        self._listeners["error"].append(on_error)
+        _touch_poller.add(self)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.remove_callback(on_edge)
+            self.remove_callback(on_error)
+
+    def stop_events(self):
+        "Stop watching this sensor for presses and releases, and remove its callbacks."
+        _touch_poller.remove(self)
+        for listeners in self._listeners.values():
+            listeners.clear()
+
+    def _update_edges(self, pressed: bool, now: float):
+        "Debounce a new reading. Called by the touch poller."
+        if self._state is None:
+            self._state = self._candidate = pressed
+            return
+        if pressed != self._candidate:
+            self._candidate, self._candidate_since = pressed, now
+        if self._candidate != self._state and now - self._candidate_since >= self.debounce:
+            self._state = self._candidate
+            kind = "press" if pressed else "release"
+            self.last_event = TouchEvent(pressed, self._candidate_since, now)
+            if pressed:
+                self.last_press = self.last_event
+            with self._edge_condition:
+                self._edges[kind] += 1
+                self._edge_condition.notify_all()
+            for callback in list(self._listeners[kind]):
+                try:
+                    callback(self.last_event)
+                except Exception as err:
+                    print("ERROR:", err)
+
+    def _fail(self, error: Exception):
+        "Hand a reading error to everyone waiting on this sensor. Called by the touch poller."
+        with self._edge_condition:
+            if self._waiters:
+                self._error = error
+                self._edge_condition.notify_all()
+        for callback in list(self._listeners["error"]):
+            try:
+                callback(error)
+            except Exception as err:
+                print("ERROR:", err)
+
+
+class TouchEvent(NamedTuple):
+    """
+    A debounced press (pressed=True) or release of a touch sensor.
+
+    time - time.monotonic() when the new state was first read
+    detected - time.monotonic() when the edge was confirmed and reported
+    """
+    pressed: bool
+    time: float
+    detected: float
+
+    @property
+    def latency(self) -> float:
+        "Seconds between the state change being read and being reported."
+        return self.detected - self.time
+
+
+class _TouchPoller:
+    """
+    Single background thread shared by all touch sensors with press/release events or waiters.
+    It only runs while at least one touch sensor is watched, and not at all after use_threads(False).
+    """
+
+    def __init__(self, interval: float = TOUCH_POLL_INTERVAL):
+        self.interval = interval
+        self.sensors: list[TouchSensor] = []
+        self._lock = threading.RLock()  # callbacks may add or remove sensors
+        self._thread: threading.Thread = None
+
+    def add(self, sensor: TouchSensor):
+        with self._lock:
+            if sensor not in self.sensors:
+                sensor._state = None
+                self.sensors.append(sensor)
+                self.poll_sensor(sensor)
+            if _use_threads and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run, name="TouchPoller", daemon=True)
+                self._thread.start()
+
+    def remove(self, sensor: TouchSensor):
+        with self._lock:
+            if sensor in self.sensors:
+                self.sensors.remove(sensor)
+
+    def release(self, sensor: TouchSensor):
+        "Stop reading a sensor once nothing waits on it or has callbacks on it."
+        with self._lock:
+            if not sensor._watched():
+                self.remove(sensor)
+
+    def poll_sensor(self, sensor: TouchSensor):
+        try:
+            pressed = sensor.is_pressed()
+        except Exception as error:  # eg, IOError, or StopSimulation in the simulator
+            sensor._fail(error)
+            self.release(sensor)  # callbacks keep the sensor read, and resume on the next good reading
+            return
+        sensor._update_edges(pressed, time.monotonic())
+
+    def poll(self):
+        "Read every watched touch sensor once."
+        with self._lock:
+            for sensor in list(self.sensors):
+                self.poll_sensor(sensor)
+
+    def poll_until(self, predicate: Callable[[], bool], timeout: float = None) -> bool:
+        "Poll on the calling thread every interval until predicate() is true or timeout (seconds) runs out."
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not predicate():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(self.interval)
+            self.poll()
+        return True
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self.sensors:
+                    self._thread = None
+                    return
+            self.poll()
+            time.sleep(self.interval)
+
+
+_touch_poller = _TouchPoller()
+
 
 class EV3UltrasonicSensor(Sensor):
     """
@@ -436,14 +1053,11 @@ class EV3UltrasonicSensor(Sensor):
         """
         try:
             if mode.lower() == self.Mode.CM:
-                self.brick.set_sensor_type(
-                    self.port, BrickPi3.SENSOR_TYPE.EV3_ULTRASONIC_CM)
+                self._set_type(BrickPi3.SENSOR_TYPE.EV3_ULTRASONIC_CM)
             elif mode.lower() == self.Mode.IN:
-                self.brick.set_sensor_type(
-                    self.port, BrickPi3.SENSOR_TYPE.EV3_ULTRASONIC_INCHES)
+                self._set_type(BrickPi3.SENSOR_TYPE.EV3_ULTRASONIC_INCHES)
             elif mode.lower() == self.Mode.LISTEN:
-                self.brick.set_sensor_type(
-                    self.port, BrickPi3.SENSOR_TYPE.EV3_ULTRASONIC_LISTEN)
+                self._set_type(BrickPi3.SENSOR_TYPE.EV3_ULTRASONIC_LISTEN)
             else:
                 return False
             self.mode = mode.lower()
@@ -491,6 +1105,9 @@ class EV3ColorSensor(Sensor):
 
     def __init__(self, port, mode="component"):
         super(EV3ColorSensor, self).__init__(port)
+        self.mode_switches = 0  # mode switches made by the getters, see read
+        self.mode_switch_time = 0.0  # seconds spent in those switches, waiting for the sensor
+        self.cache: dict[str, tuple[float, object]] = {}  # mode to (time.monotonic(), value) of its last read
         self.set_mode(mode)
 
     def set_mode(self, mode:str):
@@ -506,20 +1123,15 @@ class EV3ColorSensor(Sensor):
         try:
 
             if mode.lower() == self.Mode.COMPONENT:
-                self.brick.set_sensor_type(
-                    self.port, BrickPi3.SENSOR_TYPE.EV3_COLOR_COLOR_COMPONENTS)
+                self._set_type(BrickPi3.SENSOR_TYPE.EV3_COLOR_COLOR_COMPONENTS)
             elif mode.lower() == self.Mode.AMBIENT:
-                self.brick.set_sensor_type(
-                    self.port, BrickPi3.SENSOR_TYPE.EV3_COLOR_AMBIENT)
+                self._set_type(BrickPi3.SENSOR_TYPE.EV3_COLOR_AMBIENT)
             elif mode.lower() == self.Mode.RED:
-                self.brick.set_sensor_type(
-                    self.port, BrickPi3.SENSOR_TYPE.EV3_COLOR_REFLECTED)
+                self._set_type(BrickPi3.SENSOR_TYPE.EV3_COLOR_REFLECTED)
             elif mode.lower() == self.Mode.RAW_RED:
-                self.brick.set_sensor_type(
-                    self.port, BrickPi3.SENSOR_TYPE.EV3_COLOR_RAW_REFLECTED)
+                self._set_type(BrickPi3.SENSOR_TYPE.EV3_COLOR_RAW_REFLECTED)
             elif mode.lower() == self.Mode.ID:
-                self.brick.set_sensor_type(
-                    self.port, BrickPi3.SENSOR_TYPE.EV3_COLOR_COLOR)
+                self._set_type(BrickPi3.SENSOR_TYPE.EV3_COLOR_COLOR)
             else:
                 return False
             self.mode = mode.lower()
@@ -527,34 +1139,145 @@ class EV3ColorSensor(Sensor):
         except SensorError as error:
             return error
 
+    def read(self, mode: str):
+        """
+        Return the value of the given mode, switching the sensor to that mode first if needed,
+        in the same form as the getter of the mode, eg, [r, g, b] for component mode.
+
+        A mode switch takes tens to hundreds of milliseconds. Switches are counted in mode_switches and
+        their time in mode_switch_time. The value is kept in cache, see ColorReadScheduler.
+        """
+        mode = mode.lower()
+        if self.mode != mode:
+            start = time.monotonic()
+            self.set_mode(mode)
+            self.wait_ready()
+            self.mode_switches += 1
+            self.mode_switch_time += time.monotonic() - start
+        value = self.get_value()
+        if value is None:  # failed reads are not cached
+            return {self.Mode.COMPONENT: [None, None, None], self.Mode.ID: Color.UNKNOWN}.get(mode)
+        if mode == self.Mode.COMPONENT:
+            value = value[:-1]
+        elif mode == self.Mode.ID:
+            value = _color_names_by_code.get(value, Color.UNKNOWN)
+        self.cache[mode] = (time.monotonic(), value)
+        return value
+
+    def cached(self, mode: str, max_age: float = COLOR_CACHE_MAX_AGE):
+        "Return the last value read in the given mode if it is at most max_age seconds old, or else None."
+        entry = self.cache.get(mode.lower())
+        if entry is None or time.monotonic() - entry[0] > max_age:
+            return None
+        return entry[1]
+
     def get_ambient(self) -> float:
         "Returns the ambient light detected by the sensor. Light will not turn on."
-        if self.mode != self.Mode.AMBIENT:
-            self.set_mode(self.Mode.AMBIENT)
-            self.wait_ready()
-        return self.get_value()
+        return self.read(self.Mode.AMBIENT)
 
     def get_rgb(self) -> list[float]:
         "Return the RGB values from the sensor. This will switch the sensor to component mode."
-        if self.mode != self.Mode.COMPONENT:
-            self.set_mode(self.Mode.COMPONENT)
-            self.wait_ready()
-        val = self.get_value()
-        return val[:-1] if val is not None else [None, None, None]
+        return self.read(self.Mode.COMPONENT)
 
     def get_red(self) -> float:
         "Returns the red light detected by the sensor. Only red light turns on."
-        if self.mode != self.Mode.RED:
-            self.set_mode(self.Mode.RED)
-            self.wait_ready()
-        return self.get_value()
+        return self.read(self.Mode.RED)
 
     def get_color_name(self) -> str:
         "Return the closest detected color by name. This will switch the sensor to id mode."
-        if self.mode != self.Mode.ID:
-            self.set_mode(self.Mode.ID)
-            self.wait_ready()
-        return _color_names_by_code.get(self.get_value(), Color.UNKNOWN)
+        return self.read(self.Mode.ID)
+
+
+class ColorRead:
+    "A read queued on a ColorReadScheduler. value is set once done, cached tells if it came from the cache."
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.value = None
+        self.time: float = None
+        self.cached = False
+        self.done = False
+
+    def __repr__(self):
+        return f"ColorRead({self.mode}, {self.value if self.done else 'pending'})"
+
+
+class ColorReadStats(NamedTuple):
+    """
+    Statistics of a ColorReadScheduler.
+
+    requests - reads served
+    reads - reads from the sensor, the other requests were served from a cached or shared value
+    mode_switches - mode switches of the sensor since the scheduler was created
+    switch_time - seconds spent in those mode switches
+    """
+    requests: int
+    reads: int
+    mode_switches: int
+    switch_time: float
+
+
+class ColorReadScheduler:
+    """
+    Serves queued reads of a color sensor grouped by mode, so that code mixing, eg, ambient and RGB reads
+    switches the sensor once per batch instead of once per read.
+
+    Reads of the current mode are served first. Each mode is read at most once per batch, and not at all if the
+    sensor cache has a value of that mode at most max_age seconds old.
+
+    Example:
+
+    scheduler = ColorReadScheduler(COLOR_SENSOR)
+    ambient, rgb = scheduler.request("ambient"), scheduler.request("component")
+    scheduler.run()
+    print(ambient.value, rgb.value, scheduler.stats())
+    """
+
+    def __init__(self, sensor: EV3ColorSensor, max_age: float = COLOR_CACHE_MAX_AGE):
+        self.sensor = sensor
+        self.max_age = max_age
+        self.pending: list[ColorRead] = []
+        self.requests = self.reads = 0
+        self._lock = threading.Lock()
+        self._start_switches = sensor.mode_switches
+        self._start_switch_time = sensor.mode_switch_time
+
+    def request(self, mode: str) -> ColorRead:
+        "Queue a read of the given mode, served by the next run."
+        read = ColorRead(mode.lower())
+        with self._lock:
+            self.pending.append(read)
+        return read
+
+    def run(self) -> list[ColorRead]:
+        "Serve every queued read, one mode after the other, starting with the current mode. Return them."
+        with self._lock:
+            batch, self.pending = self.pending, []
+        modes = list(dict.fromkeys(read.mode for read in batch))
+        if self.sensor.mode in modes:
+            modes.remove(self.sensor.mode)
+            modes.insert(0, self.sensor.mode)
+        for mode in modes:
+            value, cached = self.sensor.cached(mode, self.max_age), True
+            if value is None:
+                value, cached = self.sensor.read(mode), False
+                self.reads += 1
+            now = time.monotonic()
+            for read in batch:
+                if read.mode == mode:
+                    read.value, read.time, read.cached, read.done = value, now, cached, True
+        self.requests += len(batch)
+        return batch
+
+    def read(self, mode: str):
+        "Serve one read at once, from the cache if fresh enough, along with the queued reads. Return its value."
+        read = self.request(mode)
+        self.run()
+        return read.value
+
+    def stats(self) -> ColorReadStats:
+        return ColorReadStats(self.requests, self.reads, self.sensor.mode_switches - self._start_switches,
+                              self.sensor.mode_switch_time - self._start_switch_time)
 
 
 class EV3GyroSensor(Sensor):
@@ -586,14 +1309,11 @@ class EV3GyroSensor(Sensor):
         """
         try:
             if mode.lower() == self.Mode.ABS:
-                self.brick.set_sensor_type(
-                    self.port, BrickPi3.SENSOR_TYPE.EV3_GYRO_ABS)
+                self._set_type(BrickPi3.SENSOR_TYPE.EV3_GYRO_ABS)
             elif mode.lower() == self.Mode.DPS:
-                self.brick.set_sensor_type(
-                    self.port, BrickPi3.SENSOR_TYPE.EV3_GYRO_DPS)
+                self._set_type(BrickPi3.SENSOR_TYPE.EV3_GYRO_DPS)
             elif mode.lower() == self.Mode.BOTH:
-                self.brick.set_sensor_type(
-                    self.port, BrickPi3.SENSOR_TYPE.EV3_GYRO_ABS_DPS)
+                self._set_type(BrickPi3.SENSOR_TYPE.EV3_GYRO_ABS_DPS)
             else:
                 return False
             self.mode = mode.lower()
@@ -629,13 +1349,17 @@ class Motor:
     MAX_SPEED = 1560 # positive or negative degree per second speed
     MAX_POWER = 100 # positive or negative percent power
 
+    ALL_MOTORS = {key:None for key in 'A B C D'.split(' ')}
+
     def __init__(self, port: Literal["A", "B", "C", "D"] | list[str]):
         """
         Initialize this Motor object with the ports "A", "B", "C", or "D".
         You may also provide a list of these ports such as ["A", "C"] to run
         both motors at the exact same time (exact combined behavior unknown).
         """
-        self.brick = BP
+        self.brick = Brick()
+        self.profile: MotionProfile = None
+        self.limits = (0, 0)  # (power, dps) last given to set_limits
         self.set_port(port)
 
     def set_port(self, port):
@@ -643,11 +1367,14 @@ class Motor:
         Port can be "A", "B", "C", or "D".
         You may also provide a list of these ports such as ["A", "C"] to run
         both motors at the exact same time (exact combined behavior unknown).
+
+        Single-port motors are registered in Motor.ALL_MOTORS, so that read_all() reads them.
         """
         if isinstance(port, list):
             self.port = sum([PORTS[i] for i in port])
         elif isinstance(port, int) or isinstance(port, str):
             self.port = PORTS[str(port).upper()]
+            Motor.ALL_MOTORS[str(port).upper()] = self
 
     def set_power(self, power):
         """
@@ -670,6 +1397,57 @@ class Motor:
         "Set the relative motor target position in degrees, current position plus the specified degrees."
         self.brick.set_motor_position_relative(self.port, degrees)
 
+    def set_profile(self, profile: MotionProfile = None, **params):
+        """
+        Make the next moves of this motor follow a motion profile, or go straight to their target if None.
+
+        Keyword arguments:
+        profile - a MotionProfile, or None
+        params - MotionProfile fields replacing those of profile, eg, max_dps or acceleration
+
+        Example:
+        motor.set_profile(kind="s-curve", max_dps=1200, acceleration=8000)
+        motor.move_by(90).wait()
+        """
+        if params:
+            profile = (profile or MotionProfile())._replace(**params)
+        self.profile = profile
+
+    def move_to(self, position: float, tolerance: float = MOVE_TOLERANCE, timeout: float = None,
+                dps: float = None, profile: MotionProfile = None) -> MotorMove:
+        """
+        Start moving to an encoder position in degrees, and return a MotorMove to wait on.
+
+        Keyword arguments:
+        position - target encoder position in degrees
+        tolerance - degrees from the target at which the move is done, once the motor has settled
+        timeout - seconds after which the move gives up, None for no limit
+        dps - if given, speed limit for this and the next moves, see set_limits
+        profile - motion profile of this move, by default the one given to set_profile
+
+        With a motion profile, the move is a ProfiledMove, streaming setpoints to the motor on a timer thread.
+
+        Example:
+        if not motor.move_to(90, timeout=1).wait():
+            print("motor did not reach 90 degrees")
+        """
+        profile = profile or self.profile
+        if profile is not None:
+            if dps is not None:
+                profile = profile._replace(max_dps=dps)
+            return ProfiledMove(self, profile.trajectory(self.get_encoder(), position), profile,
+                                tolerance, timeout).start()
+        move = MotorMove(self, position, tolerance, timeout)
+        if dps is not None:
+            self.set_limits(dps=dps)
+        self.set_position(position)
+        return move
+
+    def move_by(self, degrees: float, tolerance: float = MOVE_TOLERANCE, timeout: float = None,
+                dps: float = None, profile: MotionProfile = None) -> MotorMove:
+        "Start moving by degrees from the current position, and return a MotorMove. See move_to."
+        return self.move_to(self.get_encoder() + degrees, tolerance, timeout, dps, profile)
+
     def set_position_kp(self, kp=25):
         """
         Set the motor target position KP constant.
@@ -719,6 +1497,7 @@ class Motor:
         dps - The speed limit in degrees per second, with 0 being no limit
         """
         self.brick.set_motor_limits(self.port, power, dps)
+        self.limits = (power, dps)
 
     def get_status(self):
         """
@@ -734,12 +1513,24 @@ class Motor:
             power - the raw PWM power in percent (-100 to 100)
             encoder - The encoder position
             dps - The current speed in Degrees Per Second
+
+        Comes from the latest snapshot when allowed by use_snapshots.
         """
+        snapshot = _fresh_snapshot()
+        if snapshot is not None and self._port_name() in snapshot.motors:
+            return list(snapshot.motors[self._port_name()])
         try:
             return self.brick.get_motor_status(self.port)
         except IOError:
             return [None, None, None, None]
 
+    def _port_name(self) -> str:
+        "Port letter, 'A' to 'D', or None if this object controls several motors."
+        for letter in "ABCD":
+            if self.port == PORTS[letter]:
+                return letter
+        return None
+
     def get_encoder(self):
         """
         Read a motor encoder in degrees.
@@ -747,8 +1538,11 @@ class Motor:
         Keyword arguments:
         port - The motor port (one at a time). PORT_A, PORT_B, PORT_C, or PORT_D.
 
-        Returns the encoder position in degrees
+        Returns the encoder position in degrees. Comes from the latest snapshot when allowed by use_snapshots.
         """
+        snapshot = _fresh_snapshot()
+        if snapshot is not None and self._port_name() in snapshot.motors:
+            return snapshot.motors[self._port_name()][2]
         return self.brick.get_motor_encoder(self.port)
 
     def get_position(self):
@@ -845,10 +1639,207 @@ class Motor:
 
 
 
+class MotorMove:
+    """
+    A position move of a single motor, started by Motor.move_to or Motor.move_by.
+
+    The move is done once the encoder is within tolerance of the target and the speed is under
+    MOVE_SETTLE_SPEED, or when the motor stalls (OVERLOADED flag while not moving for MOVE_STALL_TIME),
+    or when its timeout runs out. status is then "reached", "stalled" or "timeout".
+
+    Example:
+
+    move = motor.move_by(60, timeout=1)
+    move.wait()                  # blocks until done, returns True if reached
+    await move                   # same, for asyncio code
+    print(move.status, move.elapsed)
+    """
+    MOVING = "moving"
+    REACHED = "reached"
+    STALLED = "stalled"
+    TIMEOUT = "timeout"
+
+    def __init__(self, motor: Motor, target: float, tolerance: float = MOVE_TOLERANCE, timeout: float = None):
+        if motor._port_name() is None:
+            raise ValueError("Motor moves can only be followed on a single motor port")
+        self.motor = motor
+        self.target = target
+        self.tolerance = tolerance
+        self.timeout = timeout
+        self.status = MotorMove.MOVING
+        self.started = time.monotonic()
+        self.finished: float = None
+        self.position: float = None  # last encoder reading
+        self._overloaded = False  # OVERLOADED flag at the last reading
+        self._overloaded_since: float = None
+
+    def poll(self) -> bool:
+        "Read the motor status once and update the move. Return True once the move is done."
+        if self.done():
+            return True
+        flags, power, encoder, dps = self.motor.get_status()
+        now = time.monotonic()
+        if encoder is not None:
+            self.position = encoder
+            overloaded = bool(flags & BrickPi3.MOTOR_STATUS_FLAG.OVERLOADED)
+            if overloaded and not self._overloaded:
+                MOTOR_OVERLOADED.labels(self.motor._port_name()).inc()
+            self._overloaded = overloaded
+            if abs(encoder - self.target) <= self.tolerance and abs(dps) <= MOVE_SETTLE_SPEED:
+                return self._finish(MotorMove.REACHED, now)
+            if overloaded and abs(dps) <= MOVE_SETTLE_SPEED:
+                if self._overloaded_since is None:
+                    self._overloaded_since = now
+                elif now - self._overloaded_since >= MOVE_STALL_TIME:
+                    return self._finish(MotorMove.STALLED, now)
+            else:
+                self._overloaded_since = None
+        if self.timeout is not None and now - self.started >= self.timeout:
+            return self._finish(MotorMove.TIMEOUT, now)
+        return False
+
+    def _finish(self, status: str, now: float) -> bool:
+        self.status = status
+        self.finished = now
+        MOTOR_MOVES.labels(self.motor._port_name(), status).inc()
+        return True
+
+    def done(self) -> bool:
+        return self.status != MotorMove.MOVING
+
+    @property
+    def reached(self) -> bool:
+        return self.status == MotorMove.REACHED
+
+    @property
+    def elapsed(self) -> float:
+        "Seconds from the start of the move until it was done, or until now if still moving."
+        return (self.finished if self.finished is not None else time.monotonic()) - self.started
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Sleep until the move is done, or until timeout (seconds) runs out, which does not end the move.
+        Return True if the motor reached its target.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.poll():
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            time.sleep(MOVE_POLL_INTERVAL)
+        return self.reached
+
+    async def wait_async(self, timeout: float = None) -> bool:
+        "Same as wait, for asyncio code."
+        import asyncio
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.poll():
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            await asyncio.sleep(MOVE_POLL_INTERVAL)
+        return self.reached
+
+    def __await__(self):
+        return self.wait_async().__await__()
+
+    def __repr__(self):
+        return f"MotorMove({self.motor._port_name()} to {self.target}, {self.status}, {self.elapsed:.3f} s)"
+
+
+class ProfiledMove(MotorMove):
+    """
+    A motor move following a trajectory of a motion profile, started by Motor.move_to on a motor with a profile.
+
+    Every profile period, a timer thread sends the motor the trajectory speed, corrected by how far the encoder
+    is behind the trajectory position. At the end of the trajectory, the target is handed to the motor's own
+    position control, and the move is done like a MotorMove. tracking_error is the largest distance, in degrees,
+    seen between the encoder and the trajectory. The motor's speed limit is raised while streaming, and put back
+    once the target is handed over, or the move times out.
+
+    With thread=False, setpoints are sent by poll instead, eg, from wait, which keeps simulations deterministic.
+    By default, a thread is used unless use_threads(False) was called.
+    """
+
+    def __init__(self, motor: Motor, trajectory: Trajectory, profile: MotionProfile = None,
+                 tolerance: float = MOVE_TOLERANCE, timeout: float = None, thread: bool = None):
+        super().__init__(motor, trajectory.target, tolerance, timeout)
+        self.trajectory = trajectory
+        self.profile = profile or MotionProfile()
+        self.tracking_error = 0.0
+        self.streaming = False
+        self._thread: threading.Thread = None
+        self._use_thread = _use_threads if thread is None else thread
+
+    def start(self) -> ProfiledMove:
+        "Start streaming setpoints."
+        # speed limit with room for the position correction
+        self._limits = self.motor.limits
+        self.motor.set_limits(self._limits[0], dps=min(Motor.MAX_SPEED, self.profile.max_dps * 1.2))
+        self.started = time.monotonic()
+        self.streaming = True
+        if self._use_thread:
+            self._thread = threading.Thread(target=self._stream, name=f"Profile-{self.motor._port_name()}",
+                                            daemon=True)
+            self._thread.start()
+        else:
+            self.step()
+        return self
+
+    def step(self) -> bool:
+        "Send the setpoint for now. Return True once the trajectory is over and the target was handed to the motor."
+        if not self.streaming:
+            return True
+        t = time.monotonic() - self.started
+        if t >= self.trajectory.duration or self.done():
+            self.streaming = False
+            self.motor.set_limits(*self._limits)
+            self.motor.set_position(self.target)
+            return True
+        setpoint = self.trajectory.sample(t)
+        encoder = self.motor.get_encoder()
+        dps = setpoint.velocity
+        if encoder is not None:
+            error = setpoint.position - encoder
+            self.tracking_error = max(self.tracking_error, abs(error))
+            dps += self.profile.gain * error
+        self.motor.brick.set_motor_dps(self.motor.port, dps)
+        return False
+
+    def _stream(self):
+        while not self.step():
+            time.sleep(self.profile.period)
+
+    def poll(self) -> bool:
+        "Send the next setpoint if there is no timer thread, then update the move. Return True once done."
+        if self.streaming:
+            if self._thread is None:
+                self.step()
+            if self.timeout is not None and time.monotonic() - self.started >= self.timeout:
+                self._finish(MotorMove.TIMEOUT, time.monotonic())
+                if self._thread is None:
+                    self.step()  # hands the target to the motor
+            return self.done()
+        return super().poll()
+
+    def wait(self, timeout: float = None) -> bool:
+        reached = super().wait(timeout)
+        if self.done() and self._thread is not None:
+            self._thread.join()
+        return reached
+
+    def __repr__(self):
+        return (f"ProfiledMove({self.motor._port_name()} to {self.target}, {self.profile.kind}, {self.status}, "
+                f"{self.elapsed:.3f} s)")
+
+
 def create_motors(motor_ports: list[Literal["A", "B", "C", "D"]] | str):
     return Motor.create_motors(motor_ports)
 
 
+def read_all() -> Snapshot:
+    "Read every configured sensor and registered motor in one sweep. See Brick.read_all."
+    return Brick().read_all()
+
+
 def configure_ports(*,
                     PORT_1: Type[Sensor] = None,
                     PORT_2: Type[Sensor] = None,
@@ -859,7 +1850,9 @@ def configure_ports(*,
                     PORT_C: Type[Motor] = None,
                     PORT_D: Type[Motor] = None,
                     wait: bool = True,
-                    print_status: bool = True) -> Sensor | Motor | list[Sensor | Motor]:
+                    print_status: bool = True,
+                    parallel: bool = True,
+                    timeout: float = None) -> Sensor | Motor | list[Sensor | Motor]:
     """
     Configure the ports to use the specified sensor or motor and return objects for each item,
     ordered by sensor ports followed by motor ports.
@@ -868,6 +1861,12 @@ def configure_ports(*,
     When print_status is True (the default), the function will print two messages, the first to let the user
     know to wait until the ports are configured, and the second to indicate the port configuration is complete.
 
+    Only the color and ultrasonic sensors are waited for, as the other sensors are ready almost at once.
+    When parallel is True (the default), every port is configured first, then these sensors are waited for at once,
+    for at most timeout seconds overall (None for no limit), so configuration takes about as long as the slowest
+    one. The seconds each of them took to be ready are kept in sensor.ready_time, and printed with print_status.
+    When parallel is False, they are waited for one after the other.
+
     Example:
 
     TOUCH_SENSOR, COLOR_SENSOR, MOTOR = configure_ports(PORT_1=TouchSensor, PORT_3=EV3ColorSensor, PORT_A=Motor)
@@ -885,33 +1884,65 @@ def configure_ports(*,
     for n, sensor_type in enumerate(sensor_ports, 1):
         if sensor_type:
             sensor = sensor_type(n)
-            if wait:
-                if isinstance(sensor, (EV3UltrasonicSensor, EV3ColorSensor)):
+            if wait and not parallel:
+                if isinstance(sensor, _SLOW_SENSORS):
                     sensor.wait_ready()
-            if is_single_device:
-                return sensor
             sensors.append(sensor)
     for letter, motor_type in zip("ABCD", motor_ports):
         if motor_type:
-            if is_single_device:
-                return motor_type(letter)
             motors.append(motor_type(letter))
+    slow = [sensor for sensor in sensors if isinstance(sensor, _SLOW_SENSORS)]
+    if wait and parallel and slow:
+        ready_times = wait_ready_all(slow, timeout)
+        for sensor in slow:
+            sensor.ready_time = ready_times[sensor._port_name()]
+            if print_status:
+                ready = f"{sensor.ready_time:.2f} s" if sensor.ready_time is not None else "not ready"
+                print(f"Port {sensor._port_name()} ({type(sensor).__name__}): {ready}")
+        missing = [port for port, ready_time in ready_times.items() if ready_time is None]
+        if missing:
+            print("ERROR:", f"port{'s' if len(missing) > 1 else ''} {', '.join(missing)} not ready after {timeout} s")
     if print_status:
         print("Port configuration complete!")
+    if is_single_device:
+        return (sensors + motors)[0]
     return sensors + motors
 
 
-# Save process ID of this program so we can force stop it later if needed
-os.system(f"echo {os.getpid()} > ~/brickpi3_pid")
+_SLOW_SENSORS = (EV3UltrasonicSensor, EV3ColorSensor)  # sensors configure_ports waits for
 
 
-def reset_brick(*args):
-    "Reset BrickPi devices when program exits ('at exit')."
-    BP.reset_all()
+def wait_ready_all(sensors: list[Sensor], timeout: float = None) -> dict[str, float | None]:
+    """
+    Wait until every sensor is ready, checking them in turn, for at most timeout seconds overall
+    (None for no limit). Return the seconds each sensor took to be ready, by port ('1' to '4'),
+    None for the sensors still not ready.
+    """
+    start = time.monotonic()
+    ready_times: dict[str, float | None] = {sensor._port_name(): None for sensor in sensors}
+    waiting = list(sensors)
+    while waiting:
+        for sensor in list(waiting):
+            if sensor.ready or sensor.get_status() == Sensor.Status.VALID_DATA:
+                ready_times[sensor._port_name()] = time.monotonic() - start
+                waiting.remove(sensor)
+        if not waiting or (timeout is not None and time.monotonic() - start >= timeout):
+            break
+        time.sleep(WAIT_READY_INTERVAL)
+    return ready_times
+
+
+def _write_pid_file():
+    "Save process ID of this program so we can force stop it later if needed."
+    try:
+        with open(os.path.expanduser(PID_FILE), "w") as file:
+            file.write(f"{os.getpid()}\n")
+    except OSError as err:
+        print("ERROR:", err)
 
 
-# Reset brick when the program exits
-try:
-    atexit.register(reset_brick)
-except ValueError as err:
-    print(err, "Must import brick in main thread", file=sys.stderr)
+def reset_brick(*args):
+    "Reset BrickPi devices when program exits ('at exit')."
+    backend = globals().get("BP")
+    if backend is not None:
+        backend.reset_all()
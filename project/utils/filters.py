@@ -2,11 +2,30 @@
 Module for list-like filters that generate statistics based on a source list. 
 Changes to the source list result in changes in the filters' results.
 
+The exceptions are the incremental window filters (SumFilter, MeanFilter, MaximumFilter, MinimumFilter and
+MedianFilter), which cache their results: they follow values appended to the source, or the source getting
+shorter, but their reset() must be called after values already in the source are changed in place.
+
 Author: Ryan Au
 """
 
+from array import array
+from bisect import bisect_left, insort
+from collections import deque
 import math
-from statistics import mean, median
+import sys
+
+
+def mean(values):
+    "statistics.mean, imported on first use: the statistics module is slow to import."
+    from statistics import mean
+    return mean(values)
+
+
+def median(values):
+    "statistics.median, imported on first use."
+    from statistics import median
+    return median(values)
 
 
 def range_limit(value: float, lower: float, upper: float) -> float:
@@ -28,6 +47,15 @@ def _wrap_index(i, l):
         return i
 
 
+def _numpy_array(value):
+    """Returns the numpy module if value is a NumPy array, else None.
+    NumPy is not imported here, so that importing the filters stays fast when it is not used."""
+    np = sys.modules.get("numpy")
+    if np is not None and isinstance(value, np.ndarray):
+        return np
+    return None
+
+
 class AppendingList(object):
     def __init__(self, source: list = None):
         if source is None:
@@ -54,6 +82,154 @@ class AppendingList(object):
         return self.src.append(value)
 
 
+class RingBuffer(object):
+    """RingBuffer is a fixed-size, array-backed buffer of timestamped samples. Old samples are overwritten.
+
+    Each sample has a time, a value (None, a number, or a list of up to `width` numbers)
+    and an optional integer tag. One thread may append while other threads read without any lock:
+    readers copy the samples and start over if the writer overwrote them in the meantime.
+
+    For Example:
+    buffer = RingBuffer(size=4, width=3)
+    buffer.append(0.0, [1, 2, 3])
+    buffer.append(0.1, None)
+    print(buffer.latest())   # gives (0.1, None)
+    print(buffer.window(2))  # gives [(0.0, [1, 2, 3]), (0.1, None)]
+    print(len(buffer))       # gives 2, the number of samples currently stored
+    """
+
+    def __init__(self, size: int = 256, width: int = 1):
+        self.size = size
+        self.width = width
+        self.count = 0  # number of samples ever appended
+        self._started = 0  # number of samples the writer has started to append
+        self._times = array('d', bytes(8 * size))
+        self._values = array('d', bytes(8 * size * width))
+        self._lengths = array('b', bytes(size))  # 0: None, -1: number, n: list of n numbers
+        self._ints = array('b', bytes(size))  # 1 if the numbers were ints
+        self._tags = array('l', bytes(array('l').itemsize * size))
+
+    def append(self, time: float, value, tag: int = 0):
+        i = self.count % self.size
+        self._started = self.count + 1
+        if value is None:
+            self._lengths[i] = 0
+            self._ints[i] = 0
+        else:
+            values = value if isinstance(value, (list, tuple)) else [value]
+            if len(values) > self.width:
+                raise ValueError(f"RingBuffer samples hold at most {self.width} values")
+            offset = i * self.width
+            for j, v in enumerate(values):
+                self._values[offset + j] = v
+            self._lengths[i] = len(values) if values is value else -1
+            self._ints[i] = all(type(v) == int for v in values)
+        self._times[i] = time
+        self._tags[i] = tag
+        self.count += 1  # publish the sample only once it is complete
+
+    def _sample(self, n: int):
+        i = n % self.size
+        length = self._lengths[i]
+        if length == 0:
+            value = None
+        else:
+            offset = i * self.width
+            cast = int if self._ints[i] else float
+            values = [cast(v) for v in self._values[offset:offset + abs(length)]]
+            value = values[0] if length < 0 else values
+        return self._times[i], value, self._tags[i]
+
+    def _copy(self, n: int) -> list:
+        while True:
+            end = self.count
+            n = min(n, end, self.size)
+            samples = [self._sample(k) for k in range(end - n, end)]
+            if self._started <= end - n + self.size:  # nothing copied was overwritten
+                return samples
+
+    def window(self, n: int, tag: int = None) -> list:
+        """Return the last n samples, oldest first, as (time, value) pairs.
+        When tag is given, only the samples appended with that tag are returned."""
+        samples = self._copy(n)
+        return [(t, v) for t, v, g in samples if tag is None or g == tag]
+
+    def latest(self, tag: int = None):
+        """Return the last sample as a (time, value) pair, or None if empty.
+        When tag is given, return None if the last sample was appended with another tag."""
+        samples = self._copy(1)
+        if not samples or (tag is not None and samples[0][2] != tag):
+            return None
+        return samples[0][:2]
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def __repr__(self):
+        return self.window(self.size).__repr__()
+
+
+class RobustAggregator(object):
+    """RobustAggregator keeps a running median or trimmed mean of samples added one at a time.
+
+    Samples can be numbers or lists of numbers (eg, [r, g, b]), each component being aggregated separately.
+    None samples, or samples containing None, are counted as missing and otherwise ignored.
+
+    For Example:
+    agg = RobustAggregator("median")
+    agg.append([10, 20, 30])
+    agg.append(None)            # missing, gives False
+    agg.append([12, 200, 28])   # outlier in the second component
+    agg.append([11, 21, 29])
+    print(agg.estimate())       # gives [11, 21, 29]
+    print(len(agg), agg.missing)  # gives 3 1
+    """
+    METHODS = ("median", "trimmed_mean")
+
+    def __init__(self, method: str = "median", trim: float = 0.2):
+        """method - "median" or "trimmed_mean"
+        trim - for trimmed_mean, fraction of the samples dropped at each end of each component (0 to 0.5)"""
+        if method not in self.METHODS:
+            raise ValueError(f"method must be one of {self.METHODS}")
+        self.method = method
+        self.trim = trim
+        self.missing = 0
+        self._sorted = None  # one sorted list per component
+        self._is_list = False
+
+    def append(self, sample) -> bool:
+        """Add a sample. Return False if it was missing (None or containing None) and was ignored."""
+        values = sample if isinstance(sample, (list, tuple)) else [sample]
+        if sample is None or any(v is None for v in values):
+            self.missing += 1
+            return False
+        if self._sorted is None:
+            self._sorted = [[] for _ in values]
+            self._is_list = isinstance(sample, (list, tuple))
+        for component, v in zip(self._sorted, values):
+            insort(component, v)
+        return True
+
+    def _aggregate(self, values: list) -> float:
+        n = len(values)
+        if self.method == "median":
+            middle = n // 2
+            return values[middle] if n % 2 else (values[middle - 1] + values[middle]) / 2
+        k = int(n * self.trim)
+        kept = values[k:n - k]
+        return sum(kept) / len(kept)
+
+    def estimate(self):
+        """Return the current estimate, a number or a list like the samples, or None without any valid sample."""
+        if not self:
+            return None
+        result = [self._aggregate(component) for component in self._sorted]
+        return result if self._is_list else result[0]
+
+    def __len__(self):
+        return 0 if self._sorted is None else len(self._sorted[0])
+
+
 class BaseFilter(AppendingList):
     def __init__(self, source):
         super().__init__(source)
@@ -70,6 +246,8 @@ class BaseFilter(AppendingList):
             if step is None:
                 step = 1
             l = len(self.src)
+            if stop is None:
+                stop = l
             start = _wrap_index(start, l)
             stop = _wrap_index(stop, l)
             return self._get_by_slice_(start, stop, step, l)
@@ -134,7 +312,8 @@ class WidthFunctionFilter(BaseFilter):
         return [self._get_by_key_(i, len(self.src)) for i in range(start, stop, step)]
 
     def __len__(self):
-        return self.src - self.width
+        return len(self.src)
+
 
 class RangeLimitFilter(SimpleFunctionFilter):
     def __init__(self, source, lower, upper):
@@ -146,29 +325,168 @@ class ModulusFilter(SimpleFunctionFilter):
         super().__init__(source, lambda x: x % mod)
 
 
-class MaximumFilter(WidthFunctionFilter):
+class IncrementalWidthFilter(WidthFunctionFilter):
+    """IncrementalWidthFilter gives the same results as WidthFunctionFilter, but updates a running
+    statistic as the source grows instead of recomputing func over each window, and caches the results.
+
+    Subclasses implement _push(index, value) and _pop(index, value), which add a source value to
+    or remove the oldest value from the window, and _result(), the statistic of the current window.
+    The source is assumed to only grow by appending, like a log of sensor readings. Unlike the other filters,
+    changing values already in the source (eg, source[3] = 0, or an in-place NumPy operation) is not detected:
+    the results stay those of the old values until reset() is called.
+
+    The source can also be a NumPy array, in which case all the results are computed at once by
+    _vectorized(np, array), and slices give NumPy arrays.
+    """
+
+    def __init__(self, source, width, func):
+        super().__init__(source, width, func)
+        self.reset()
+
+    def reset(self):
+        "Forget the running statistic and the cached results."
+        self._end = 0  # number of source values added to the window so far
+        self._results = []  # result of the window starting at each index
+        self._clear()
+
+    def _clear(self):
+        pass
+
+    def _update(self):
+        length = len(self.src)
+        if length < self._end:  # source was shortened
+            self.reset()
+        np = _numpy_array(self.src)
+        if np is not None:
+            if length != self._end and length >= self.width:
+                self._results = self._vectorized(np, self.src)
+            self._end = length
+            return length
+        src, width, results = self.src, self.width, self._results
+        for i in range(self._end, length):
+            self._push(i, src[i])
+            if i >= width:
+                self._pop(i - width, src[i - width])
+            if i >= width - 1:
+                results.append(self._result())
+        self._end = length
+        return length
+
+    def _get_by_key_(self, key: int, length: int):
+        length = self._update()
+        if length < self.width:
+            return self.func(self.src[:length])
+        return self._results[range_limit(key, 0, length - self.width)]
+
+    def _get_by_slice_(self, start, stop, step, l):
+        length = self._update()
+        if length < self.width:
+            return [self.func(self.src[:length])] * len(range(start, stop, step))
+        results = self._results
+        np = _numpy_array(results)
+        if np is not None:
+            return results[np.clip(np.arange(start, stop, step), 0, len(results) - 1)]
+        if 0 <= start and step > 0:  # indices past the last window give its result
+            head = results[start:stop:step]
+            return head + results[-1:] * (len(range(start, stop, step)) - len(head))
+        last = len(results) - 1
+        return [results[range_limit(i, 0, last)] for i in range(start, stop, step)]
+
+
+class SumFilter(IncrementalWidthFilter):
     def __init__(self, source, N):
-        super().__init__(source, N, max)
+        super().__init__(source, N, sum)
+
+    def _clear(self):
+        self._sum = 0
 
+    def _push(self, index, value):
+        self._sum += value
 
-class MinimumFilter(WidthFunctionFilter):
+    def _pop(self, index, value):
+        self._sum -= value
+
+    def _result(self):
+        return self._sum
+
+    def _vectorized(self, np, array):
+        sums = np.cumsum(array)
+        return np.concatenate((sums[self.width - 1:self.width], sums[self.width:] - sums[:-self.width]))
+
+
+class MeanFilter(SumFilter):
     def __init__(self, source, N):
-        super().__init__(source, N, min)
+        IncrementalWidthFilter.__init__(self, source, N, mean)
+
+    def _result(self):
+        return self._sum / self.width
+
+    def _vectorized(self, np, array):
+        return super()._vectorized(np, array) / self.width
+
+
+class MaximumFilter(IncrementalWidthFilter):
+    """Keeps a monotonic deque of (index, value) pairs, the front being the maximum of the window."""
+
+    def __init__(self, source, N):
+        super().__init__(source, N, max)
 
+    def _better(self, a, b):
+        return a >= b
 
-class MeanFilter(WidthFunctionFilter):
+    def _clear(self):
+        self._candidates = deque()
+
+    def _push(self, index, value):
+        candidates = self._candidates
+        while candidates and self._better(value, candidates[-1][1]):
+            candidates.pop()
+        candidates.append((index, value))
+
+    def _pop(self, index, value):
+        if self._candidates[0][0] == index:
+            self._candidates.popleft()
+
+    def _result(self):
+        return self._candidates[0][1]
+
+    def _vectorized(self, np, array):
+        return np.lib.stride_tricks.sliding_window_view(array, self.width).max(axis=1)
+
+
+class MinimumFilter(MaximumFilter):
     def __init__(self, source, N):
-        super().__init__(source, N, mean)
+        IncrementalWidthFilter.__init__(self, source, N, min)
 
+    def _better(self, a, b):
+        return a <= b
+
+    def _vectorized(self, np, array):
+        return np.lib.stride_tricks.sliding_window_view(array, self.width).min(axis=1)
+
+
+class MedianFilter(IncrementalWidthFilter):
+    """Keeps the window sorted, finding where to insert or remove each value by bisection."""
 
-class MedianFilter(WidthFunctionFilter):
     def __init__(self, source, N):
         super().__init__(source, N, median)
 
+    def _clear(self):
+        self._sorted = []
 
-class SumFilter(WidthFunctionFilter):
-    def __init__(self, source, N):
-        super().__init__(source, N, sum)
+    def _push(self, index, value):
+        insort(self._sorted, value)
+
+    def _pop(self, index, value):
+        del self._sorted[bisect_left(self._sorted, value)]
+
+    def _result(self):
+        values = self._sorted
+        middle = len(values) // 2
+        return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+    def _vectorized(self, np, array):
+        return np.median(np.lib.stride_tricks.sliding_window_view(array, self.width), axis=1)
 
 
 class IntegrationTracker(AppendingList):
@@ -191,23 +509,46 @@ class IntegrationTracker(AppendingList):
 
     tracker += [(0,2), (0,3)] # appends each pair from list as y and dx to tracker
     tracker.extend([(0,2), (0,3)]) # appends each pair from list as y and dx to tracker
+
+    With typed=True, the values, delta-x and integrated values are kept in growable typed arrays of floats,
+    and extend takes NumPy arrays of values, or of (y, dx) rows, which are integrated all at once:
+    tracker = IntegrationTracker(typed=True)
+    tracker.extend(np.array([0, 1, 2, 3]))
+    print(tracker)            # gives [0.0, 0.5, 2.0, 4.5]
+    print(tracker.to_numpy()) # gives array([0. , 0.5, 2. , 4.5])
     """
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, typed: bool = False):
+        super().__init__(array('d') if typed else None)
+        self.typed = typed
         self._result = 0
         self._last = 0
-        self._original = []
+        if typed:
+            self._values = array('d')
+            self._dx = array('d')
+        else:
+            self._original = []
 
     def append(self, value, dx=1):
-        if type(value) != float and type(value) != int:
-            raise ValueError(
-                "Parameter 'value' must be an acceptable numerical value, float or int")
-        if type(dx) != float and type(dx) != int:
-            raise ValueError(
-                "Parameter 'dx' must be an acceptable numerical value, float or int")
-
-        self._original.append((value, dx))
+        if self.typed:
+            try:
+                self._values.append(value)
+            except TypeError:
+                raise ValueError("Parameter 'value' must be an acceptable numerical value, float or int")
+            try:
+                self._dx.append(dx)
+            except TypeError:
+                self._values.pop()
+                raise ValueError("Parameter 'dx' must be an acceptable numerical value, float or int")
+        else:
+            if type(value) != float and type(value) != int:
+                raise ValueError(
+                    "Parameter 'value' must be an acceptable numerical value, float or int")
+            if type(dx) != float and type(dx) != int:
+                raise ValueError(
+                    "Parameter 'dx' must be an acceptable numerical value, float or int")
+            self._original.append((value, dx))
+
         if len(self) > 0:
             self._result += (self._last + value) * dx * 0.5
         self._last = value
@@ -216,16 +557,36 @@ class IntegrationTracker(AppendingList):
     def extend(self, ls):
         self.__iadd__(ls)
 
+    def _extend_array(self, np, ls):
+        ls = np.asarray(ls, dtype=float)
+        if ls.ndim == 2:
+            values, dx = ls[:, 0], ls[:, 1]
+        else:
+            values, dx = ls, np.ones(len(ls))
+        if len(values) == 0:
+            return
+        previous = np.concatenate(([self._last], values[:-1]))
+        steps = (previous + values) * dx * 0.5
+        if len(self) == 0:
+            steps[0] = 0
+        results = self._result + np.cumsum(steps)
+        self._values.frombytes(values.tobytes())
+        self._dx.frombytes(dx.tobytes())
+        self.src.frombytes(results.tobytes())
+        self._result = float(results[-1])
+        self._last = float(values[-1])
+
     def __iadd__(self, ls):
-        ls = list(ls)
-        for o in ls:
-            try:
-                i = iter(o)
-                if len(i) > 1:
-                    self.append(i[0], i[1])
-                else:
-                    self.append(i[0])
-            except TypeError:
+        np = _numpy_array(ls)
+        if np is not None:
+            if self.typed:
+                self._extend_array(np, ls)
+                return self
+            ls = ls.tolist()
+        for o in list(ls):
+            if isinstance(o, (tuple, list)):
+                self.append(*o[:2])
+            else:
                 self.append(o)
         return self
 
@@ -234,8 +595,18 @@ class IntegrationTracker(AppendingList):
         self._last = 0
 
     def get_original(self):
+        if self.typed:
+            return tuple(zip(self._values, self._dx))
         return tuple(self._original)
 
+    def to_numpy(self):
+        "Returns a NumPy array (a copy) of the integrated values."
+        import numpy as np
+        return np.array(self.src, dtype=float)
+
+    def __repr__(self):
+        return list(self.src).__repr__()
+
 
 def integration(samples: list, delta_time=1):
     """Returns the trapezoidal integration of the samples, given a constant sample time interval.
@@ -246,15 +617,25 @@ def integration(samples: list, delta_time=1):
     (Equivalent of f(x)=x integrated to g(x)=x^2/2)
 
     delta_time can be a float or a list of floats (the list must be length N-1 as samples N)
+
+    If samples or delta_time is a NumPy array, the integration is vectorized and gives a NumPy array.
     """
+    np = _numpy_array(samples) or _numpy_array(delta_time)
+    if np is not None:
+        samples = np.asarray(samples, dtype=float)
+        delta_time = np.asarray(delta_time, dtype=float)
+        if delta_time.ndim > 0 and len(delta_time) != len(samples) - 1:
+            return None
+        steps = (samples[:-1] + samples[1:]) * delta_time * 0.5
+        return np.concatenate(([0.0], np.cumsum(steps)))
+
     if type(delta_time) == list:
         if not all([type(d) == float or type(d) == int for d in delta_time]):
             return None
         if len(delta_time) != len(samples)-1:
             return None
     elif type(delta_time) == int or type(delta_time) == float:
-        m = float(delta_time)
-        delta_time = [m for m in range(len(samples)-1)]
+        delta_time = [delta_time] * (len(samples) - 1)
     else:
         return None
 
@@ -0,0 +1,152 @@
+"""
+Module for motion profiles: acceleration-limited trajectories from one motor position to another,
+so that a motor can go fast without overshooting its target, see Motor.set_profile.
+
+A trapezoidal profile speeds up at a constant acceleration, cruises, then slows down. An S-curve profile also
+limits how fast the acceleration changes (jerk), which is smoother on the mechanism, at the cost of a slightly
+longer move.
+
+This module does not use the hardware and can be tested on a computer.
+"""
+
+from __future__ import annotations
+from typing import Literal, NamedTuple
+import bisect
+import math
+
+PROFILE_MAX_DPS = 1560  # same as Motor.MAX_SPEED
+PROFILE_ACCELERATION = 10000  # degrees per second squared
+PROFILE_JERK = 200000  # degrees per second cubed, for S-curve profiles
+PROFILE_PERIOD = 0.01  # seconds between setpoints streamed to the motor
+PROFILE_POSITION_GAIN = 10  # degrees per second of correction per degree behind the trajectory
+
+
+class Setpoint(NamedTuple):
+    "State of a trajectory at one time: position (degrees), velocity (dps) and acceleration (dps per second)."
+    position: float
+    velocity: float
+    acceleration: float
+
+
+class Trajectory:
+    """
+    Motion from start to target as segments of constant jerk, each given as (duration, acceleration at its start,
+    jerk). A trapezoidal trajectory only has segments without jerk.
+
+    Example:
+
+    trajectory = Trajectory.trapezoidal(0, 90, max_dps=1000, acceleration=10000)
+    print(trajectory.duration, trajectory.sample(0.05).position)
+    """
+
+    def __init__(self, start: float, target: float, segments: list[tuple[float, float, float]]):
+        self.start = start
+        self.target = target
+        self.segments = segments
+        self.times = [0.0]  # start time of each segment, then the end time
+        self.states = []  # position and velocity at the start of each segment
+        position, velocity = start, 0.0
+        for duration, acceleration, jerk in segments:
+            self.states.append((position, velocity))
+            position, velocity = _advance(position, velocity, acceleration, jerk, duration)
+            self.times.append(self.times[-1] + duration)
+
+    @property
+    def duration(self) -> float:
+        return self.times[-1]
+
+    @property
+    def peak_velocity(self) -> float:
+        return max((abs(self.sample(t).velocity) for t in self.times), default=0.0)
+
+    def sample(self, t: float) -> Setpoint:
+        "Setpoint at t seconds from the start of the motion. Before the start or after the end, the motor is still."
+        if t <= 0 or not self.segments:
+            return Setpoint(self.start, 0.0, 0.0)
+        if t >= self.duration:
+            return Setpoint(self.target, 0.0, 0.0)
+        i = bisect.bisect_right(self.times, t) - 1
+        duration, acceleration, jerk = self.segments[i]
+        position, velocity = _advance(*self.states[i], acceleration, jerk, t - self.times[i])
+        return Setpoint(position, velocity, acceleration + jerk * (t - self.times[i]))
+
+    @classmethod
+    def trapezoidal(cls, start: float, target: float, max_dps: float = PROFILE_MAX_DPS,
+                    acceleration: float = PROFILE_ACCELERATION) -> Trajectory:
+        "Constant acceleration up to max_dps, cruise, then constant deceleration. Short moves never reach max_dps."
+        distance, sign = abs(target - start), math.copysign(1, target - start)
+        if distance == 0:
+            return cls(start, target, [])
+        velocity = min(max_dps, math.sqrt(distance * acceleration))
+        ramp = velocity / acceleration
+        cruise = max(0.0, (distance - velocity * ramp) / velocity)
+        a = sign * acceleration
+        return cls(start, target, [(ramp, a, 0.0), (cruise, 0.0, 0.0), (ramp, -a, 0.0)])
+
+    @classmethod
+    def s_curve(cls, start: float, target: float, max_dps: float = PROFILE_MAX_DPS,
+                acceleration: float = PROFILE_ACCELERATION, jerk: float = PROFILE_JERK) -> Trajectory:
+        "Like trapezoidal, but the acceleration ramps up and down at jerk instead of changing at once."
+        distance, sign = abs(target - start), math.copysign(1, target - start)
+        if distance == 0:
+            return cls(start, target, [])
+        velocity = max_dps
+        if velocity * _s_curve_ramp(velocity, acceleration, jerk)[1] > distance:
+            # too short to reach max_dps: find the peak velocity that covers exactly the distance
+            low, high = 0.0, max_dps
+            for _ in range(60):
+                velocity = (low + high) / 2
+                if velocity * _s_curve_ramp(velocity, acceleration, jerk)[1] > distance:
+                    high = velocity
+                else:
+                    low = velocity
+            velocity = low
+        jerk_time, ramp = _s_curve_ramp(velocity, acceleration, jerk)
+        peak = jerk * jerk_time
+        cruise = max(0.0, (distance - velocity * ramp) / velocity) if velocity > 0 else 0.0
+        constant = max(0.0, ramp - 2 * jerk_time)
+        j, a = sign * jerk, sign * peak
+        return cls(start, target, [(jerk_time, 0.0, j), (constant, a, 0.0), (jerk_time, a, -j),
+                                   (cruise, 0.0, 0.0),
+                                   (jerk_time, 0.0, -j), (constant, -a, 0.0), (jerk_time, -a, j)])
+
+
+def _advance(position: float, velocity: float, acceleration: float, jerk: float, t: float) -> tuple[float, float]:
+    "Position and velocity after t seconds at constant jerk."
+    return (position + velocity * t + acceleration * t ** 2 / 2 + jerk * t ** 3 / 6,
+            velocity + acceleration * t + jerk * t ** 2 / 2)
+
+
+def _s_curve_ramp(velocity: float, acceleration: float, jerk: float) -> tuple[float, float]:
+    "Seconds of changing acceleration, and seconds of the whole ramp, of an S-curve from 0 to velocity."
+    if velocity * jerk < acceleration ** 2:  # acceleration never reaches its limit
+        jerk_time = math.sqrt(velocity / jerk)
+        return jerk_time, 2 * jerk_time
+    jerk_time = acceleration / jerk
+    return jerk_time, jerk_time + velocity / acceleration
+
+
+class MotionProfile(NamedTuple):
+    """
+    Parameters of the moves of one motor, see Motor.set_profile.
+
+    kind - "trapezoidal" or "s-curve"
+    max_dps - cruise speed in degrees per second
+    acceleration - degrees per second squared
+    jerk - degrees per second cubed, only used by S-curve profiles
+    period - seconds between setpoints streamed to the motor
+    gain - degrees per second of correction per degree the motor is behind the trajectory
+    """
+    kind: Literal["trapezoidal", "s-curve"] = "trapezoidal"
+    max_dps: float = PROFILE_MAX_DPS
+    acceleration: float = PROFILE_ACCELERATION
+    jerk: float = PROFILE_JERK
+    period: float = PROFILE_PERIOD
+    gain: float = PROFILE_POSITION_GAIN
+
+    def trajectory(self, start: float, target: float) -> Trajectory:
+        if self.kind == "trapezoidal":
+            return Trajectory.trapezoidal(start, target, self.max_dps, self.acceleration)
+        if self.kind == "s-curve":
+            return Trajectory.s_curve(start, target, self.max_dps, self.acceleration, self.jerk)
+        raise ValueError(f"Unknown motion profile {self.kind}")
@@ -0,0 +1,155 @@
+"""
+Module for running a sequence of processing stages concurrently, each on its own thread, eg,
+detect -> classify -> route -> actuate -> confirm for each cube, so that one stage can work on the
+next cube while a later stage is still busy with the previous one.
+
+Stages are connected by bounded queues: a stage waits when the next one is still busy and its queue is full,
+so cubes never pile up between stages.
+"""
+
+from __future__ import annotations
+from typing import Callable, NamedTuple
+import queue
+import threading
+import time
+
+PIPELINE_QUEUE_SIZE = 1  # items waiting between two stages
+
+_CLOSE = object()
+
+
+class StageStats(NamedTuple):
+    """
+    Statistics of one pipeline stage.
+
+    items - items the stage passed on, or finished for the last stage
+    dropped - items the stage returned None for, or failed on
+    errors - items the stage failed on
+    busy - seconds spent running the stage
+    blocked - seconds spent waiting for the next stage to accept an item
+    occupancy - fraction of the time the stage was busy. The stage closest to 1 limits the throughput.
+    """
+    name: str
+    items: int
+    dropped: int
+    errors: int
+    busy: float
+    blocked: float
+    occupancy: float
+
+
+class _Stage:
+    def __init__(self, name: str, func: Callable, queue_size: int):
+        self.name = name
+        self.func = func
+        self.input = queue.Queue(queue_size)
+        self.output: queue.Queue = None
+        self.items = self.dropped = self.errors = 0
+        self.busy = self.blocked = 0.0
+        self.thread: threading.Thread = None
+
+    def run(self):
+        while True:
+            item = self.input.get()
+            if item is _CLOSE:
+                if self.output is not None:
+                    self.output.put(_CLOSE)
+                return
+            start = time.monotonic()
+            try:
+                result = self.func(item)
+            except Exception as err:
+                print("ERROR:", err)
+                result = None
+                self.errors += 1
+            done = time.monotonic()
+            self.busy += done - start
+            if result is None:
+                self.dropped += 1
+                continue
+            self.items += 1
+            if self.output is not None:
+                self.output.put(result)
+                self.blocked += time.monotonic() - done
+
+
+class Pipeline:
+    """
+    Runs items through stages, each stage on its own thread, with bounded queues in between.
+
+    Each stage is a function taking the item from the previous stage and returning the item for the next one,
+    or None to drop the item, eg, a cube of unknown color. Errors raised by a stage are printed and drop the item.
+
+    Example:
+
+    pipeline = Pipeline([("detect", detect), ("classify", classify), ("actuate", actuate)])
+    pipeline.start()
+    while TOUCH_SENSOR.wait_for_press():
+        pipeline.put({"start": time.time()})  # waits while the detect stage is busy
+    pipeline.close()
+    print(pipeline.report())
+    """
+
+    def __init__(self, stages: list[tuple[str, Callable]], queue_size: int = PIPELINE_QUEUE_SIZE):
+        self.stages = [_Stage(name, func, queue_size) for name, func in stages]
+        for stage, following in zip(self.stages, self.stages[1:]):
+            stage.output = following.input
+        self.started: float = None
+        self.stopped: float = None
+
+    def start(self) -> Pipeline:
+        "Start one thread per stage."
+        self.started = time.monotonic()
+        for stage in self.stages:
+            stage.thread = threading.Thread(target=stage.run, name=f"Pipeline-{stage.name}", daemon=True)
+            stage.thread.start()
+        return self
+
+    def put(self, item, timeout: float = None) -> bool:
+        "Give an item to the first stage. Return False if it was still busy after timeout seconds."
+        try:
+            self.stages[0].input.put(item, timeout=timeout)
+            return True
+        except queue.Full:
+            return False
+
+    def close(self, timeout: float = None):
+        "Let the stages finish the items they have, then stop their threads."
+        self.stages[0].input.put(_CLOSE)
+        for stage in self.stages:
+            stage.thread.join(timeout)
+        self.stopped = time.monotonic()
+
+    def __enter__(self) -> Pipeline:
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def elapsed(self) -> float:
+        "Seconds the pipeline has been running."
+        if self.started is None:
+            return 0.0
+        return (self.stopped if self.stopped is not None else time.monotonic()) - self.started
+
+    def stats(self) -> list[StageStats]:
+        elapsed = self.elapsed or 1.0
+        return [StageStats(stage.name, stage.items, stage.dropped, stage.errors, stage.busy, stage.blocked,
+                           stage.busy / elapsed) for stage in self.stages]
+
+    def throughput(self) -> float:
+        "Items finished by the last stage per minute."
+        return self.stages[-1].items / (self.elapsed or 1.0) * 60
+
+    def report(self) -> str:
+        "Table of the stage statistics, with the stage limiting the throughput marked."
+        stats = self.stats()
+        bottleneck = max(stats, key=lambda s: s.occupancy).name if stats else None
+        lines = [f"{'stage':>10} {'items':>6} {'dropped':>8} {'busy s':>8} {'blocked s':>10} {'occupancy':>10}"]
+        for s in stats:
+            mark = " <- bottleneck" if s.name == bottleneck else ""
+            lines.append(f"{s.name:>10} {s.items:>6} {s.dropped:>8} {s.busy:>8.2f} {s.blocked:>10.2f} "
+                         f"{s.occupancy * 100:>9.1f}%{mark}")
+        lines.append(f"{self.throughput():.1f} items per minute over {self.elapsed:.1f} s")
+        return "\n".join(lines)
@@ -0,0 +1,282 @@
+"""
+Module for replaying session logs (see utils.session_log) through the sort logic on a computer,
+to tune COLORS or the sort script options against recorded cubes instead of at the robot.
+
+There are two ways to replay a session:
+
+replay_decisions - runs the recorded raw color samples of each cube through a StreamingColorDetector and a
+    classifier, without a robot or a clock. Thousands of cubes per second: only the decisions are replayed.
+replay_session - runs a sort script on a SimulatedBrickPi3 with a VirtualClock, as a stand-in for the robot:
+    the touch sensor is pressed at the recorded times and the color sensor returns the recorded samples of
+    each cube. Decisions and stage timings are replayed, the motor moves come from the simulated motors.
+
+Both return records like read_session_log, with the time, run and cube of the original records,
+for diff_sessions to compare with the original session.
+
+Example:
+
+original = read_session_log("session-2026-10-18.log")
+replayed = replay_decisions(original, ColorClassifier(NEW_COLORS))
+print(diff_sessions(original, replayed).report())
+
+Usage: python3 -m utils.replay session.log [--robot] [--script DeliverySystem] [script options, eg, --pipeline]
+"""
+
+from __future__ import annotations
+from typing import NamedTuple
+import argparse
+import contextlib
+import importlib
+import io
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from utils import brick
+from utils.session_log import STAGES, read_session_log
+from utils.simulation import SimulatedBrickPi3, VirtualClock, RealClock, StopSimulation
+
+REPLAY_START = 1.0  # seconds before the first press, for the sensors to get ready
+REPLAY_MAX_GAP = 10.0  # longest wait between presses, idle time beyond it is skipped
+REPLAY_REAL_CLOCK_SPEED = 10  # how much faster than real time scripts with threads replay
+PRESS_DURATION = 0.05
+
+
+def replay_decisions(records: np.ndarray, classifier, **detector_options) -> np.ndarray:
+    """
+    Replay the color decision of each recorded cube with the given classifier and StreamingColorDetector
+    options, eg, max_samples. Return a copy of the records with the new rgb, color and confidence.
+
+    Samples are given to the detector until it is done. A detector needing more samples than were recorded
+    decides with the recorded ones. The stage timings are not replayed, and set to NaN.
+    """
+    from logic import StreamingColorDetector, normalize_rgb
+
+    replayed = np.array(records)
+    replayed["stages"] = np.nan
+    for i in range(len(replayed)):
+        detector = StreamingColorDetector(classifier, **detector_options)
+        for sample in replayed["samples"][i][:replayed["sample_count"][i]]:
+            if detector.done:
+                break
+            detector.add([None if np.isnan(value) else float(value) for value in sample])
+        estimate = detector.estimate()
+        rgb = normalize_rgb(estimate) if estimate is not None else np.full(3, np.nan)
+        replayed["rgb"][i] = rgb
+        if np.isnan(rgb).any():
+            replayed["color"][i], replayed["confidence"][i] = b"", np.nan
+            continue
+        result = classifier.classify(rgb)
+        replayed["color"][i], replayed["confidence"][i] = result.color.encode(), result.confidence
+    return replayed
+
+
+def _presses(records: np.ndarray, max_gap: float) -> list[float]:
+    "Clock times to press the touch sensor at, keeping the recorded intervals up to max_gap."
+    presses = [REPLAY_START]
+    for interval in np.diff(records["time"]):
+        presses.append(presses[-1] + min(max(interval, PRESS_DURATION * 2), max_gap))
+    return presses
+
+
+def script_sensors(sim: SimulatedBrickPi3, records: np.ndarray, max_gap: float = REPLAY_MAX_GAP,
+                   touch_port: int = 1, color_port: int = 2) -> list[float]:
+    """
+    Script the touch and color sensors of the simulator to replay the recorded cubes: one press per cube,
+    then the recorded samples of that cube, one per read, the last one repeated once they run out.
+    The color sensor follows the last press the touch sensor gave, not the clock, so a cube still being sampled
+    keeps its samples even if the time of the next press has come.
+    The run ends with StopSimulation max_gap seconds after the last press.
+    Return the clock times of the presses, one per record.
+    """
+    start = sim.clock.time()
+    presses = _presses(records, max_gap)
+    end = presses[-1] + max_gap
+    samples = [[[None if np.isnan(value) else float(value) for value in sample]
+                for sample in record["samples"][:record["sample_count"]]] for record in records]
+    reads = [0] * len(records)
+    pressed = [-1]  # cube of the last press read
+
+    def current_cube(t: float) -> int:
+        return int(np.searchsorted(presses, t, side="right")) - 1
+
+    def touch(sim):
+        t = sim.clock.time() - start
+        if t > end:
+            raise StopSimulation("all cubes replayed")
+        cube = current_cube(t)
+        if cube >= 0 and t - presses[cube] < PRESS_DURATION:
+            pressed[0] = cube
+            return 1
+        return 0
+
+    def color(sim):
+        cube = pressed[0]
+        if cube < 0 or not samples[cube]:
+            return None
+        sample = samples[cube][min(reads[cube], len(samples[cube]) - 1)]
+        reads[cube] += 1
+        return sample
+
+    sim.set_sensor_function(touch_port, touch)
+    sim.set_sensor_function(color_port, color)
+    return [start + press for press in presses]
+
+
+def _as_original(replayed: np.ndarray, original: np.ndarray, presses: list[float]) -> np.ndarray:
+    """
+    Give each replayed record the time, run and cube of the original record whose press it followed,
+    so cubes match even if the script missed a press or numbered its cubes differently.
+    """
+    index = np.maximum(np.searchsorted(presses, replayed["time"], side="right") - 1, 0)
+    for field in ("time", "run", "cube"):
+        replayed[field] = original[field][index]
+    return replayed
+
+
+@contextlib.contextmanager
+def simulated_script(script: str, clock: RealClock | VirtualClock):
+    """
+    Import a sort script fresh on a simulated robot, with the time module patched to use the clock.
+    Yield the script module and the simulator. The script and its devices are forgotten afterwards.
+    On a VirtualClock, utils.brick uses no background threads, so only the script's thread moves the clock.
+    """
+    previous = brick.set_backend(SimulatedBrickPi3(clock=clock))
+    threads = brick.use_threads(not isinstance(clock, VirtualClock))
+    try:
+        with clock.patch_time_module():
+            sys.modules.pop(script, None)
+            yield importlib.import_module(script), brick.get_backend()
+    finally:
+        sys.modules.pop(script, None)
+        brick.use_threads(threads)
+        brick.set_backend(previous)
+        for port in brick.Sensor.ALL_SENSORS:
+            brick.Sensor.ALL_SENSORS[port] = None
+        for port in brick.Motor.ALL_MOTORS:
+            brick.Motor.ALL_MOTORS[port] = None
+
+
+def script_classifier(script: str = "DeliverySystem"):
+    "Return the CLASSIFIER of a sort script, eg, to replay decisions with the COLORS being tuned in the script."
+    with contextlib.redirect_stdout(io.StringIO()), simulated_script(script, VirtualClock()) as (module, _):
+        return module.CLASSIFIER
+
+
+def replay_session(records: np.ndarray, script: str = "DeliverySystem", argv: list[str] = (), classifier=None,
+                   max_gap: float = REPLAY_MAX_GAP) -> tuple[np.ndarray, str]:
+    """
+    Replay the recorded cubes through a sort script on the simulated robot. Return the records of the replayed
+    run, and what the script printed. The script's CLASSIFIER is replaced if a classifier is given.
+
+    Scripts run with --pipeline use threads, so they run on a sped-up real clock instead of a virtual one,
+    and their stage timings vary a little from run to run. Other scripts run on a VirtualClock without background
+    threads, so their stage timings follow the script's own sleeps and simulated bus transfers, the same on every
+    replay.
+    """
+    pipelined = "--pipeline" in argv
+    clock = RealClock(speed=REPLAY_REAL_CLOCK_SPEED) if pipelined else VirtualClock()
+    output = io.StringIO()
+    fd, path = tempfile.mkstemp(suffix=".log")
+    os.close(fd)
+    os.remove(path)  # created by the script
+    try:
+        with contextlib.redirect_stdout(output), simulated_script(script, clock) as (module, sim):
+            presses = script_sensors(sim, records, max_gap)
+            if classifier is not None:
+                module.CLASSIFIER = classifier
+            args, _ = module.add_argparser().parse_known_args(["--session-log", path, *argv])
+            try:
+                if pipelined:
+                    module.color_movement_pipeline(args)
+                else:
+                    module.color_movement(args)
+            except SystemExit:
+                pass
+        return _as_original(read_session_log(path, mmap=False), records, presses), output.getvalue()
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _percentile(values: np.ndarray, q: float) -> float:
+    values = values[~np.isnan(values)]
+    return float(np.percentile(values, q)) if len(values) else np.nan
+
+
+class StageDiff(NamedTuple):
+    "Seconds spent in one stage in the original and replayed runs, NaN if the stage was not timed."
+    name: str
+    original_p50: float
+    replayed_p50: float
+    original_p95: float
+    replayed_p95: float
+
+
+class SessionDiff(NamedTuple):
+    """
+    Differences between an original and a replayed session, matched by run and cube number.
+
+    cubes - cubes in both sessions
+    changed - (run, cube, original color, replayed color) of the cubes sorted differently
+    missing - (run, cube) of the cubes of the original session the replay did not log, eg, pressed while busy
+    confidence - mean change of confidence of the matched cubes
+    stages - stage timings, see StageDiff
+    """
+    cubes: int
+    changed: list[tuple[int, int, str, str]]
+    missing: list[tuple[int, int]]
+    confidence: float
+    stages: list[StageDiff]
+
+    def report(self) -> str:
+        lines = [f"{self.cubes} cubes replayed, {len(self.changed)} sorted differently, "
+                 f"{len(self.missing)} missing, confidence {self.confidence:+.3f}"]
+        lines += [f"  run {run} cube {cube}: {original or '-'} -> {replayed or '-'}"
+                  for run, cube, original, replayed in self.changed]
+        timed = [stage for stage in self.stages if not np.isnan(stage.original_p50 + stage.replayed_p50)]
+        if timed:
+            lines.append(f"{'stage':>10} {'p50 s':>8} {'replay':>8} {'p95 s':>8} {'replay':>8}")
+            lines += [f"{s.name:>10} {s.original_p50:8.3f} {s.replayed_p50:8.3f} {s.original_p95:8.3f} "
+                      f"{s.replayed_p95:8.3f}" for s in timed]
+        return "\n".join(lines)
+
+
+def _keys(records: np.ndarray) -> np.ndarray:
+    "(run, cube) of each record as one integer, unique within a session log."
+    return records["run"].astype(np.uint64) << np.uint64(32) | records["cube"].astype(np.uint64)
+
+
+def diff_sessions(original: np.ndarray, replayed: np.ndarray) -> SessionDiff:
+    "Compare the decisions and stage timings of two sessions, see SessionDiff."
+    original_keys, replayed_keys = _keys(original), _keys(replayed)
+    _, original_index, replayed_index = np.intersect1d(original_keys, replayed_keys, return_indices=True)
+    a, b = original[original_index], replayed[replayed_index]
+    changed = [(int(run), int(cube), x.decode(), y.decode())
+               for run, cube, x, y in zip(a["run"], a["cube"], a["color"], b["color"]) if x != y]
+    missing = [(int(run), int(cube)) for run, cube in original[~np.isin(original_keys, replayed_keys)][["run", "cube"]]]
+    confidence = b["confidence"] - a["confidence"]
+    confidence = float(np.mean(confidence[~np.isnan(confidence)])) if (~np.isnan(confidence)).any() else 0.0
+    stages = [StageDiff(name, _percentile(a["stages"][:, i], 50), _percentile(b["stages"][:, i], 50),
+                        _percentile(a["stages"][:, i], 95), _percentile(b["stages"][:, i], 95))
+              for i, name in enumerate(STAGES)]
+    return SessionDiff(len(a), changed, missing, confidence, stages)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a session log and compare the decisions and timings.")
+    parser.add_argument("log", help="session log to replay")
+    parser.add_argument("--robot", action="store_true", help="replay through the sort script on the simulated robot")
+    parser.add_argument("--script", default="DeliverySystem", help="sort script whose CLASSIFIER and loop to replay")
+    parser.add_argument("--max-samples", type=int, default=9, help="detector samples, without --robot")
+    parser.add_argument("--max-gap", type=float, default=REPLAY_MAX_GAP, help="longest wait between presses")
+    args, script_argv = parser.parse_known_args()
+
+    original = read_session_log(args.log)
+    if args.robot:
+        replayed, _ = replay_session(original, args.script, script_argv, max_gap=args.max_gap)
+    else:
+        replayed = replay_decisions(original, script_classifier(args.script), max_samples=args.max_samples)
+    print(diff_sessions(original, replayed).report())
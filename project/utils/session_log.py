@@ -0,0 +1,223 @@
+"""
+Module for the session log: one fixed-size binary record per sorted cube, with the raw color samples,
+the normalized color, the verdict, the motor commands and the time spent in each stage.
+
+Records are appended by a background thread, so the control loop does no formatting or file writing, and
+the log of a whole day can be memory-mapped as a NumPy structured array for analysis, without any parsing.
+Each SessionLog opened on a file is a new run, numbered from 1: cube numbers restart with each run,
+so (run, cube) identifies a cube in the log of a whole day.
+
+Example:
+
+with SessionLog("session.log") as log:
+    log.write(cube=1, samples=[[110, 14, 12], [112, 13, 11]], rgb=(0.99, 0.12, 0.1), color="R",
+              confidence=0.9, targets={"A": 60}, statuses={"A": "reached"}, stages={"detect": 0.3})
+
+records = read_session_log("session.log")
+print(records["run"], records["cube"], records["color"], records["stages"].mean(axis=0))
+"""
+
+from __future__ import annotations
+import json
+import os
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+
+MAGIC = b"SLOG"
+SESSION_LOG_SAMPLES = 9  # raw color samples kept per cube, like the max_samples of the sort scripts
+SESSION_LOG_BUFFER_SIZE = 64  # records written at once by the background writer
+SESSION_LOG_FLUSH_INTERVAL = 1.0  # seconds after which buffered records are written anyway
+STAGES = ("detect", "classify", "route", "actuate", "confirm")
+MOTOR_PORTS = "ABCD"
+MOVE_STATUSES = ("", "moving", "reached", "stalled", "timeout")  # codes of utils.brick.MotorMove statuses
+OUTCOMES = ("sorted", "dropped", "error")  # codes of what happened to a cube
+
+_ALIGNMENT = 64
+_CLOSE = object()
+
+RECORD = np.dtype([
+    ("time", "<f8"),  # time.time() when the cube was requested
+    ("run", "<u4"),  # run of the sort script that wrote the record, see SessionLog.run
+    ("cube", "<u4"),  # cube number in the run
+    ("sample_count", "u1"),  # raw samples kept, the others are NaN
+    ("samples", "<f4", (SESSION_LOG_SAMPLES, 3)),  # raw (r, g, b) readings
+    ("rgb", "<f4", (3,)),  # normalized color, NaN if there was no valid sample
+    ("color", "S8"),  # verdict, b"" if none
+    ("confidence", "<f4"),
+    ("outcome", "u1"),  # index in OUTCOMES: sorted, dropped by the sort logic, or stopped by an error
+    ("targets", "<f4", (len(MOTOR_PORTS),)),  # target of the motor on each port, NaN if not moved
+    ("statuses", "u1", (len(MOTOR_PORTS),)),  # index in MOVE_STATUSES of the move of each port
+    ("stages", "<f4", (len(STAGES),)),  # seconds spent in each stage, NaN if skipped
+])
+
+
+def _header() -> bytes:
+    return json.dumps({"version": 2, "descr": RECORD.descr, "stages": STAGES, "ports": MOTOR_PORTS,
+                       "statuses": MOVE_STATUSES, "outcomes": OUTCOMES}).encode()
+
+
+def _data_offset(header_length: int) -> int:
+    "Records start at the first multiple of _ALIGNMENT after the header."
+    return -(-(len(MAGIC) + 4 + header_length) // _ALIGNMENT) * _ALIGNMENT
+
+
+def make_record(time: float = None, run: int = 0, cube: int = 0, samples: list = (), rgb=None, color: str = None,
+                confidence: float = None, targets: dict[str, float] = None, statuses: dict[str, str] = None,
+                stages: dict[str, float] = None, outcome: str = "sorted") -> np.ndarray:
+    """
+    Build one record. Missing values are NaN or empty. Samples beyond SESSION_LOG_SAMPLES are dropped,
+    samples with a None component are kept as NaN.
+    """
+    record = np.zeros((), dtype=RECORD)
+    record["time"] = time if time is not None else np.nan
+    record["run"] = run
+    record["cube"] = cube
+    record["samples"] = np.nan
+    kept = [[np.nan if value is None else value for value in sample[:3]]
+            for sample in samples[:SESSION_LOG_SAMPLES] if sample is not None]
+    record["sample_count"] = len(kept)
+    if kept:
+        record["samples"][:len(kept)] = kept
+    record["rgb"] = rgb if rgb is not None else np.nan
+    record["color"] = (color or "").encode()[:8]
+    record["confidence"] = confidence if confidence is not None else np.nan
+    record["outcome"] = OUTCOMES.index(outcome)
+    record["targets"] = np.nan
+    for port, target in (targets or {}).items():
+        record["targets"][MOTOR_PORTS.index(port)] = target
+    for port, status in (statuses or {}).items():
+        record["statuses"][MOTOR_PORTS.index(port)] = MOVE_STATUSES.index(status)
+    record["stages"] = np.nan
+    for stage, seconds in (stages or {}).items():
+        record["stages"][STAGES.index(stage)] = seconds
+    return record
+
+
+class SessionLog:
+    """
+    Append-only binary log of sorted cubes, written by a background thread in batches of buffer_size records,
+    or every flush_interval seconds. Opening an existing log appends to it, so one file can hold a whole day:
+    the records get the next run number, and a partial record left at the end, eg, by a power loss, is cut off.
+
+    write() only queues its arguments: the record is built and written on the background thread.
+    """
+
+    def __init__(self, path: str, buffer_size: int = SESSION_LOG_BUFFER_SIZE,
+                 flush_interval: float = SESSION_LOG_FLUSH_INTERVAL):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.written = 0  # records written to the file
+        self.errors = 0  # records that could not be built
+        self._queue = queue.Queue()
+        self.run = _next_run(path)  # run number of the records written
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            header = _header()
+            self._file.write(MAGIC + struct.pack("<I", len(header)) + header)
+            self._file.write(b"\0" * (_data_offset(len(header)) - self._file.tell()))
+            self._file.flush()
+        self._thread = threading.Thread(target=self._run, name="SessionLog", daemon=True)
+        self._thread.start()
+
+    def write(self, **fields):
+        "Queue a record, see make_record for the fields. run is this log's run."
+        self._queue.put(fields)
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                fields = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                fields = None
+            if fields is _CLOSE:
+                self._flush(batch)
+                return
+            if fields is not None:
+                try:
+                    batch.append(make_record(run=self.run, **fields))
+                except (TypeError, ValueError) as err:
+                    print("ERROR:", err)
+                    self.errors += 1
+            if len(batch) >= self.buffer_size or time.monotonic() >= deadline:
+                self._flush(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _flush(self, batch: list[np.ndarray]):
+        if batch:
+            self._file.write(np.stack(batch).tobytes())
+            self.written += len(batch)
+        self._file.flush()
+
+    def close(self):
+        "Write the queued records and close the file."
+        if self._thread.is_alive():
+            self._queue.put(_CLOSE)
+            self._thread.join()
+        self._file.close()
+
+    def __enter__(self) -> SessionLog:
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _check_header(path: str) -> int:
+    "Return the offset of the records of a session log, or raise ValueError if it is not a compatible log."
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a session log")
+        (length,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(length))
+    if np.dtype([tuple(field) for field in header["descr"]]) != RECORD:
+        raise ValueError(f"{path} has records of another format")
+    return _data_offset(length)
+
+
+def _next_run(path: str) -> int:
+    """
+    Return the run number following the last record of a session log, 1 for a new log.
+    Cut off a partial record at the end, so the records appended next stay aligned.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return 1
+    offset = _check_header(path)
+    size = os.path.getsize(path)
+    count = max(size - offset, 0) // RECORD.itemsize
+    end = offset + count * RECORD.itemsize
+    if size > end:
+        print("ERROR:", f"{path} ends with {size - end} bytes of a partial record, cut off")
+    if size != end:
+        os.truncate(path, end)  # or pads a header cut short
+    if count == 0:
+        return 1
+    last = np.fromfile(path, dtype=RECORD, offset=end - RECORD.itemsize, count=1)
+    return int(last["run"][0]) + 1
+
+
+def read_session_log(path: str, mmap: bool = True) -> np.ndarray:
+    """
+    Return the records of a session log as a structured array with the RECORD dtype, memory-mapped by default.
+    A record still being written at the end of the file is left out.
+
+    Example:
+    records = read_session_log("session.log")
+    red = records[records["color"] == b"R"]
+    print(len(red), np.nanmean(red["stages"], axis=0))
+    """
+    offset = _check_header(path)
+    with open(path, "rb") as f:
+        count = (f.seek(0, 2) - offset) // RECORD.itemsize
+    if count <= 0:
+        return np.zeros(0, dtype=RECORD)
+    if mmap:
+        return np.memmap(path, dtype=RECORD, mode="r", offset=offset, shape=(count,))
+    return np.fromfile(path, dtype=RECORD, offset=offset, count=count)
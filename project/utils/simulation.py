@@ -0,0 +1,660 @@
+"""
+Module for simulating the BrickPi hardware, eg, sensors and motors, on a computer.
+
+SimulatedBrickPi3 implements the parts of the brickpi3.BrickPi3 interface used by utils.brick,
+so Motor, TouchSensor, EV3ColorSensor, EV3GyroSensor and configure_ports work without a robot.
+Combined with a VirtualClock, a sort loop that takes minutes on the robot runs in milliseconds,
+which makes it possible to measure and test it anywhere.
+
+Example:
+
+clock = VirtualClock()
+sim = SimulatedBrickPi3(clock=clock)
+brick.set_backend(sim)                             # devices created from now on use the simulator
+sim.set_sensor_timeline(1, [(0, 0), (2, 1), (2.1, 0)])  # touch sensor on port 1 pressed at t=2s
+sim.set_sensor_value(2, [120, 15, 12])             # color sensor on port 2 sees a red cube
+with clock.patch_time_module():                    # time.sleep() and time.time() use the clock
+    import DeliverySystem
+"""
+
+from __future__ import annotations
+
+from bisect import bisect_right
+from contextlib import contextmanager
+from typing import Callable, Iterable
+import threading
+import time
+
+__all__ = ["Enumeration", "SensorError", "FirmwareVersionError", "BrickPi3",
+           "SimulatedBrickPi3", "VirtualClock", "RealClock", "StopSimulation"]
+
+SPI_LATENCY = 0.0003  # seconds per SPI transfer, close to a BrickPi3 on a Raspberry Pi 3
+MOTOR_STEP = 0.001  # seconds per motor kinematics integration step
+MOTOR_MAX_DPS = 1560  # same as Motor.MAX_SPEED
+MOTOR_ACCELERATION = 15000  # degrees per second squared
+MOTOR_POSITION_GAIN = 1.2  # proportional gain (1/s) per unit of the position KP constant
+MOTOR_SETTLE_TOLERANCE = 0.5  # degrees
+
+# Seconds between set_sensor_type() and the first VALID_DATA reply
+SENSOR_CONFIGURE_TIME = {
+    "TOUCH": 0.005,
+    "COLOR": 0.15,
+    "GYRO": 0.1,
+    "ULTRASONIC": 0.2,
+    "OTHER": 0.05,
+}
+
+# Keep references to the real functions so they still work while the time module is patched
+_real_monotonic = time.monotonic
+_real_sleep = time.sleep
+
+
+class Enumeration(object):
+    """
+    Same as brickpi3.Enumeration: turns a comma separated list of names into integer attributes,
+    starting at 0 unless a value is given with NAME = value.
+    """
+
+    def __init__(self, names: str):
+        number = 0
+        for name in names.split(","):
+            name = name.strip()
+            if not name:
+                continue
+            if "=" in name:
+                name, value = name.split("=")
+                name = name.strip()
+                number = int(value.strip(), 0)
+            setattr(self, name, number)
+            number += 1
+
+
+class SensorError(Exception):
+    "Exception raised if a sensor is not yet configured when trying to read it."
+
+
+class FirmwareVersionError(Exception):
+    "Exception raised if the BrickPi3 firmware needs to be updated."
+
+
+class StopSimulation(Exception):
+    """
+    Raised from a sensor script to end a simulated run, eg, to break out of a `while True` polling loop.
+    Scripts usually catch Exception around their polling loop, so this ends them cleanly.
+    """
+
+
+class _Clock:
+    @contextmanager
+    def patch_time_module(self):
+        """
+        Route time.time, time.monotonic, time.perf_counter and time.sleep through this clock,
+        so that scripts doing `import time` run on simulated time. Restored on exit.
+        """
+        names = ["time", "monotonic", "perf_counter", "sleep"]
+        saved = {name: getattr(time, name) for name in names}
+        time.time = time.monotonic = time.perf_counter = self.time
+        time.sleep = self.sleep
+        try:
+            yield self
+        finally:
+            for name, func in saved.items():
+                setattr(time, name, func)
+
+
+class RealClock(_Clock):
+    """
+    Clock that follows the wall clock. Used by default so simulated devices behave in real time.
+
+    With speed > 1, simulated time runs that many times faster than the wall clock, eg, to run
+    scripts with several threads faster than real time, which a VirtualClock cannot do.
+    """
+
+    def __init__(self, speed: float = 1.0):
+        self.speed = speed
+        self._start = _real_monotonic()
+
+    def time(self) -> float:
+        if self.speed == 1:
+            return _real_monotonic()
+        return self._start + (_real_monotonic() - self._start) * self.speed
+
+    def sleep(self, seconds: float):
+        if seconds > 0:
+            _real_sleep(seconds / self.speed)
+
+
+class VirtualClock(_Clock):
+    """
+    Deterministic clock that only moves forward when sleep() or advance() is called.
+
+    Time spent in simulated SPI transfers also advances this clock, so polling loops
+    without any sleep still make progress.
+
+    Note: every thread sleeping moves the clock forward, so scripts with background threads
+    run faster than they would on the robot. Use RealClock(speed=...) for those, or call
+    utils.brick.use_threads(False) so touch sensor waits and profiled moves run on the script's thread.
+    """
+
+    def __init__(self, start: float = 0.0):
+        self._now = float(start)
+        self._lock = threading.Lock()
+
+    def time(self) -> float:
+        return self._now
+
+    def sleep(self, seconds: float):
+        if seconds > 0:
+            with self._lock:
+                self._now += seconds
+
+    def advance(self, seconds: float):
+        "Move the clock forward by the given number of seconds."
+        self.sleep(seconds)
+
+
+class _SimMotor:
+    "Kinematic model of one motor: acceleration-limited velocity tracking a power, speed or position target."
+    FLOAT, POWER, DPS, POSITION = "float", "power", "dps", "position"
+
+    def __init__(self, max_dps: float, acceleration: float):
+        self.max_dps = max_dps
+        self.acceleration = acceleration
+        self.position = 0.0  # raw degrees, the encoder is position - offset
+        self.velocity = 0.0
+        self.offset = 0
+        self.mode = self.FLOAT
+        self.target = 0.0
+        self.power_limit = 0
+        self.dps_limit = 0
+        self.kp = 25
+        self.kd = 70
+        self.stalled = False
+
+    def speed_limit(self) -> float:
+        limit = self.max_dps
+        if self.dps_limit > 0:
+            limit = min(limit, self.dps_limit)
+        if self.power_limit > 0:
+            limit = min(limit, self.max_dps * self.power_limit / 100)
+        return limit
+
+    def target_velocity(self) -> float:
+        if self.mode == self.POWER:
+            v = self.target / 100 * self.max_dps
+        elif self.mode == self.DPS:
+            v = self.target
+        elif self.mode == self.POSITION:
+            v = (self.target - self.position) * self.kp * MOTOR_POSITION_GAIN
+        else:
+            v = 0.0
+        limit = self.speed_limit()
+        return max(-limit, min(limit, v))
+
+    def is_settled(self) -> bool:
+        if self.stalled:
+            return True
+        if self.mode == self.POSITION:
+            return self.velocity == 0 and self.position == self.target
+        return self.velocity == self.target_velocity()
+
+    def is_overloaded(self) -> bool:
+        "Like the firmware OVERLOADED flag: commanded to move, but not getting there."
+        if not self.stalled:
+            return False
+        if self.mode == self.POSITION:
+            return abs(self.target - self.position) > MOTOR_SETTLE_TOLERANCE
+        return self.mode != self.FLOAT and self.target != 0
+
+    def advance(self, duration: float):
+        "Integrate the motion over the given duration in seconds."
+        if self.stalled:
+            self.velocity = 0.0
+            return
+        while duration > 0:
+            if self.is_settled():
+                # constant velocity (or stopped) from here on, no need to integrate step by step
+                self.position += self.velocity * duration
+                return
+            dt = min(MOTOR_STEP, duration)
+            duration -= dt
+            dv = self.target_velocity() - self.velocity
+            max_dv = self.acceleration * dt
+            self.velocity += max(-max_dv, min(max_dv, dv))
+            self.position += self.velocity * dt
+            if (self.mode == self.POSITION and abs(self.target - self.position) < MOTOR_SETTLE_TOLERANCE
+                    and abs(self.velocity) < self.acceleration * MOTOR_STEP):
+                self.position = self.target
+                self.velocity = 0.0
+
+    def get_power(self) -> int:
+        if self.stalled and self.is_overloaded():
+            return 100 if self.target_velocity() > 0 else -100
+        return int(round(self.velocity / self.max_dps * 100))
+
+
+class _SimSensor:
+    "A sensor port: its configured type, when it becomes ready and where its values come from."
+
+    def __init__(self):
+        self.type = None
+        self.ready_at = 0.0
+        self.state = None  # forced state, overrides the configuration state when set
+        self.source = ("value", None)
+
+
+class _SimBus:
+    "Shared SPI bus state: latency, transfer counter, and a lock for threads using the simulator."
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.transfers = 0
+        self.lock = threading.Lock()
+
+
+class SimulatedBrickPi3:
+    """
+    Simulated BrickPi3. Offers the same constants and methods as brickpi3.BrickPi3 that are used
+    by utils.brick, plus methods to script sensor values and inspect motors.
+
+    Keyword arguments:
+    clock - RealClock (default) or VirtualClock that drives motor motion and sensor scripts
+    spi_latency - seconds spent per SPI transfer, advancing the clock (default SPI_LATENCY)
+    motor_max_dps - top speed of the simulated motors in degrees per second
+    motor_acceleration - acceleration of the simulated motors in degrees per second squared
+    configure_time - seconds until sensors are ready, a float for all sensors or a dict like SENSOR_CONFIGURE_TIME
+
+    Every sensor and motor reaches this object through the one shared utils.brick.Brick handle
+    (see utils.brick.set_backend), whose lock keeps threads from interleaving their calls.
+    """
+    PORT_1 = 0x01
+    PORT_2 = 0x02
+    PORT_3 = 0x04
+    PORT_4 = 0x08
+
+    PORT_A = 0x01
+    PORT_B = 0x02
+    PORT_C = 0x04
+    PORT_D = 0x08
+
+    MOTOR_FLOAT = -128
+
+    BPSPI_MESSAGE_TYPE = Enumeration("""
+        NONE,
+        GET_MANUFACTURER,
+        GET_NAME,
+        GET_HARDWARE_VERSION,
+        GET_FIRMWARE_VERSION,
+        GET_ID,
+        SET_LED,
+        GET_VOLTAGE_3V3,
+        GET_VOLTAGE_5V,
+        GET_VOLTAGE_9V,
+        GET_VOLTAGE_VCC,
+        SET_ADDRESS,
+        SET_SENSOR_TYPE,
+        GET_SENSOR_1,
+        GET_SENSOR_2,
+        GET_SENSOR_3,
+        GET_SENSOR_4,
+        I2C_TRANSACT_1,
+        I2C_TRANSACT_2,
+        I2C_TRANSACT_3,
+        I2C_TRANSACT_4,
+        SET_MOTOR_POWER,
+        SET_MOTOR_POSITION,
+        SET_MOTOR_POSITION_KP,
+        SET_MOTOR_POSITION_KD,
+        SET_MOTOR_DPS,
+        SET_MOTOR_DPS_KP,
+        SET_MOTOR_DPS_KD,
+        SET_MOTOR_LIMITS,
+        OFFSET_MOTOR_ENCODER,
+        GET_MOTOR_A_ENCODER,
+        GET_MOTOR_B_ENCODER,
+        GET_MOTOR_C_ENCODER,
+        GET_MOTOR_D_ENCODER,
+        GET_MOTOR_A_STATUS,
+        GET_MOTOR_B_STATUS,
+        GET_MOTOR_C_STATUS,
+        GET_MOTOR_D_STATUS,
+    """)
+
+    SENSOR_TYPE = Enumeration("""
+        NONE = 1,
+        I2C,
+        CUSTOM,
+
+        TOUCH,
+        NXT_TOUCH,
+        EV3_TOUCH,
+
+        NXT_LIGHT_ON,
+        NXT_LIGHT_OFF,
+
+        NXT_COLOR_RED,
+        NXT_COLOR_GREEN,
+        NXT_COLOR_BLUE,
+        NXT_COLOR_FULL,
+        NXT_COLOR_OFF,
+
+        NXT_ULTRASONIC,
+
+        EV3_GYRO_ABS,
+        EV3_GYRO_DPS,
+        EV3_GYRO_ABS_DPS,
+
+        EV3_COLOR_REFLECTED,
+        EV3_COLOR_AMBIENT,
+        EV3_COLOR_COLOR,
+        EV3_COLOR_RAW_REFLECTED,
+        EV3_COLOR_COLOR_COMPONENTS,
+
+        EV3_ULTRASONIC_CM,
+        EV3_ULTRASONIC_INCHES,
+        EV3_ULTRASONIC_LISTEN,
+
+        EV3_INFRARED_PROXIMITY,
+        EV3_INFRARED_SEEK,
+        EV3_INFRARED_REMOTE,
+    """)
+
+    SENSOR_STATE = Enumeration("""
+        VALID_DATA,
+        NOT_CONFIGURED,
+        CONFIGURING,
+        NO_DATA,
+        I2C_ERROR,
+    """)
+
+    MOTOR_STATUS_FLAG = Enumeration("""
+        LOW_VOLTAGE_FLOAT = 0x01,
+        OVERLOADED = 0x02,
+    """)
+
+    def __init__(self, addr=1, detect=True, *, clock: RealClock | VirtualClock = None,
+                 spi_latency: float = SPI_LATENCY, motor_max_dps: float = MOTOR_MAX_DPS,
+                 motor_acceleration: float = MOTOR_ACCELERATION, configure_time: float | dict = None):
+        self.SPI_Address = addr
+        self.clock = clock if clock is not None else RealClock()
+        self.bus = _SimBus(spi_latency)
+        self.SensorType = [self.SENSOR_TYPE.NONE] * 4
+        self.I2CInBytes = [0] * 4
+        self.sensors = [_SimSensor() for _ in range(4)]
+        self.motors = [_SimMotor(motor_max_dps, motor_acceleration) for _ in range(4)]
+        self.motor_time = [self.clock.time()]  # time up to which motors were integrated
+        if configure_time is None:
+            configure_time = SENSOR_CONFIGURE_TIME
+        elif not isinstance(configure_time, dict):
+            configure_time = {key: configure_time for key in SENSOR_CONFIGURE_TIME}
+        self.configure_time = dict(configure_time)
+
+    # ---------------- simulation helpers ----------------
+
+    @property
+    def spi_transfers(self) -> int:
+        "Number of SPI transfers made so far."
+        return self.bus.transfers
+
+    @property
+    def spi_latency(self) -> float:
+        return self.bus.latency
+
+    @spi_latency.setter
+    def spi_latency(self, latency: float):
+        self.bus.latency = latency
+
+    def _transfer(self, count: int = 1):
+        "Account for SPI transfers: count them and spend the bus latency on the clock."
+        with self.bus.lock:
+            self.bus.transfers += count
+        self.clock.sleep(self.bus.latency * count)
+        self._update_motors()
+
+    def _update_motors(self):
+        with self.bus.lock:
+            now = self.clock.time()
+            elapsed = now - self.motor_time[0]
+            if elapsed > 0:
+                self.motor_time[0] = now
+                for motor in self.motors:
+                    motor.advance(elapsed)
+
+    @staticmethod
+    def _port_indices(port: int) -> list[int]:
+        return [i for i in range(4) if port & (1 << i)]
+
+    def _port_index(self, port: int) -> int:
+        indices = self._port_indices(port)
+        if len(indices) != 1:
+            raise IOError("Must be one port at a time. PORT_1/A, PORT_2/B, PORT_3/C, or PORT_4/D.")
+        return indices[0]
+
+    def _configure_time_for(self, sensor_type: int) -> float:
+        T = self.SENSOR_TYPE
+        if sensor_type in (T.TOUCH, T.NXT_TOUCH, T.EV3_TOUCH):
+            return self.configure_time["TOUCH"]
+        if sensor_type in (T.EV3_COLOR_REFLECTED, T.EV3_COLOR_AMBIENT, T.EV3_COLOR_COLOR,
+                           T.EV3_COLOR_RAW_REFLECTED, T.EV3_COLOR_COLOR_COMPONENTS):
+            return self.configure_time["COLOR"]
+        if sensor_type in (T.EV3_GYRO_ABS, T.EV3_GYRO_DPS, T.EV3_GYRO_ABS_DPS):
+            return self.configure_time["GYRO"]
+        if sensor_type in (T.EV3_ULTRASONIC_CM, T.EV3_ULTRASONIC_INCHES, T.EV3_ULTRASONIC_LISTEN):
+            return self.configure_time["ULTRASONIC"]
+        return self.configure_time["OTHER"]
+
+    def set_sensor_value(self, port: int, value):
+        "Make the sensor on the given port (1 to 4) always read the given value."
+        self.sensors[self._sensor_index(port)].source = ("value", value)
+
+    def set_sensor_stream(self, port: int, values: Iterable, loop: bool = False):
+        """
+        Make the sensor on the given port return the given values, one per read.
+        The last value is repeated once the values run out, unless loop is True.
+        """
+        values = list(values)
+        self.sensors[self._sensor_index(port)].source = ("stream", values, [0], loop)
+
+    def set_sensor_timeline(self, port: int, timeline: Iterable[tuple[float, object]]):
+        """
+        Make the sensor on the given port follow a timeline of (time, value) pairs, sorted by time.
+        Each value is read from its time until the next one. Times are in seconds on the clock.
+        """
+        timeline = sorted(timeline, key=lambda pair: pair[0])
+        times = [t for t, _ in timeline]
+        values = [v for _, v in timeline]
+        self.sensors[self._sensor_index(port)].source = ("timeline", times, values)
+
+    def set_sensor_function(self, port: int, func: Callable[[SimulatedBrickPi3], object]):
+        """
+        Make the sensor on the given port read func(sim) each time, eg, to link a gyro sensor to a motor:
+        sim.set_sensor_function(3, lambda sim: [sim.get_motor_encoder(sim.PORT_D) / 4, 0])
+        func may raise StopSimulation to end the run.
+        """
+        self.sensors[self._sensor_index(port)].source = ("function", func)
+
+    def set_sensor_state(self, port: int, state: int = None):
+        "Force the state (SENSOR_STATE) reported for a sensor, eg, to simulate errors. None to clear."
+        self.sensors[self._sensor_index(port)].state = state
+
+    def set_motor_stalled(self, port: int, stalled: bool = True):
+        "Block the motor(s) on the given port(s), eg, to simulate a jammed piston."
+        self._update_motors()
+        for i in self._port_indices(port):
+            self.motors[i].stalled = stalled
+
+    def get_motor_velocity(self, port: int) -> float:
+        "Exact simulated speed in degrees per second, without an SPI transfer."
+        self._update_motors()
+        return self.motors[self._port_index(port)].velocity
+
+    def get_motor_position(self, port: int) -> float:
+        "Exact simulated encoder position in degrees, without an SPI transfer."
+        self._update_motors()
+        motor = self.motors[self._port_index(port)]
+        return motor.position - motor.offset
+
+    def _sensor_index(self, port: int | str) -> int:
+        "Sensor helpers take port numbers 1 to 4, like utils.brick.Sensor."
+        if str(port) not in ("1", "2", "3", "4"):
+            raise IOError("Sensor port must be 1, 2, 3, or 4.")
+        return int(port) - 1
+
+    def _sensor_state(self, index: int) -> int:
+        sensor = self.sensors[index]
+        if sensor.state is not None:
+            return sensor.state
+        if self.SensorType[index] == self.SENSOR_TYPE.NONE:
+            return self.SENSOR_STATE.NOT_CONFIGURED
+        if self.clock.time() < sensor.ready_at:
+            return self.SENSOR_STATE.CONFIGURING
+        return self.SENSOR_STATE.VALID_DATA
+
+    def _sensor_source_value(self, sensor: _SimSensor):
+        kind = sensor.source[0]
+        if kind == "value":
+            return sensor.source[1]
+        if kind == "stream":
+            _, values, position, loop = sensor.source
+            if not values:
+                return None
+            i = position[0]
+            if i >= len(values):
+                i = i % len(values) if loop else len(values) - 1
+            position[0] = i + 1
+            return values[i]
+        if kind == "timeline":
+            _, times, values = sensor.source
+            i = bisect_right(times, self.clock.time()) - 1
+            return values[i] if i >= 0 else None
+        return sensor.source[1](self)
+
+    def _format_sensor_value(self, sensor_type: int, value):
+        "Shape a scripted value like the value brickpi3 returns for the sensor type."
+        T = self.SENSOR_TYPE
+        is_list = isinstance(value, (list, tuple))
+        if sensor_type == T.EV3_COLOR_COLOR_COMPONENTS:
+            if value is None:
+                return [0, 0, 0, 0]
+            value = list(value)
+            return value + [0] * (4 - len(value))
+        if sensor_type == T.EV3_GYRO_ABS_DPS:
+            if value is None:
+                return [0, 0]
+            return list(value) if is_list else [value, 0]
+        if sensor_type == T.EV3_GYRO_ABS:
+            return (value[0] if is_list else value) or 0
+        if sensor_type == T.EV3_GYRO_DPS:
+            return (value[1] if is_list else value) or 0
+        if sensor_type in (T.EV3_ULTRASONIC_CM, T.EV3_ULTRASONIC_INCHES):
+            return 255.0 if value is None else value
+        if value is None:
+            return 0
+        return list(value) if is_list else value
+
+    # ---------------- brickpi3.BrickPi3 interface ----------------
+
+    def spi_transfer_array(self, data_out: list[int]) -> list[int]:
+        "Answer GET_SENSOR_n messages like the BrickPi3 firmware, as used by utils.brick.Brick.get_sensor_status."
+        self._transfer()
+        reply = [0] * len(data_out)
+        message_type = data_out[1]
+        first = self.BPSPI_MESSAGE_TYPE.GET_SENSOR_1
+        if first <= message_type < first + 4 and len(reply) > 5:
+            index = message_type - first
+            reply[3] = 0xA5
+            reply[4] = self.SensorType[index]
+            reply[5] = self._sensor_state(index)
+        return reply
+
+    def set_sensor_type(self, port: int, type: int, params=0):
+        self._transfer()
+        for i in self._port_indices(port):
+            self.SensorType[i] = type
+            self.sensors[i].ready_at = self.clock.time() + self._configure_time_for(type)
+
+    def get_sensor(self, port: int):
+        self._transfer()
+        index = self._port_index(port)
+        state = self._sensor_state(index)
+        if state != self.SENSOR_STATE.VALID_DATA:
+            raise SensorError("get_sensor error: Invalid sensor data")
+        value = self._sensor_source_value(self.sensors[index])
+        return self._format_sensor_value(self.SensorType[index], value)
+
+    def set_motor_power(self, port: int, power: int):
+        self._transfer()
+        for i in self._port_indices(port):
+            motor = self.motors[i]
+            if power == self.MOTOR_FLOAT:
+                motor.mode, motor.target = motor.FLOAT, 0
+            else:
+                motor.mode, motor.target = motor.POWER, max(-100, min(100, power))
+
+    def set_motor_position(self, port: int, position: float):
+        self._transfer()
+        for i in self._port_indices(port):
+            motor = self.motors[i]
+            motor.mode, motor.target = motor.POSITION, float(int(position) + motor.offset)
+
+    def set_motor_position_relative(self, port: int, degrees: float):
+        for i in self._port_indices(port):
+            self.set_motor_position(1 << i, self.get_motor_encoder(1 << i) + degrees)
+
+    def set_motor_position_kp(self, port: int, kp: float = 25):
+        self._transfer()
+        for i in self._port_indices(port):
+            self.motors[i].kp = kp
+
+    def set_motor_position_kd(self, port: int, kd: float = 70):
+        self._transfer()
+        for i in self._port_indices(port):
+            self.motors[i].kd = kd
+
+    def set_motor_dps(self, port: int, dps: float):
+        self._transfer()
+        for i in self._port_indices(port):
+            motor = self.motors[i]
+            motor.mode, motor.target = motor.DPS, float(dps)
+
+    def set_motor_limits(self, port: int, power: int = 0, dps: int = 0):
+        self._transfer()
+        for i in self._port_indices(port):
+            self.motors[i].power_limit = power
+            self.motors[i].dps_limit = dps
+
+    def get_motor_status(self, port: int) -> list:
+        self._transfer()
+        motor = self.motors[self._port_index(port)]
+        flags = self.MOTOR_STATUS_FLAG.OVERLOADED if motor.is_overloaded() else 0
+        return [flags, motor.get_power(), int(motor.position - motor.offset), int(motor.velocity)]
+
+    def get_motor_encoder(self, port: int) -> int:
+        self._transfer()
+        motor = self.motors[self._port_index(port)]
+        return int(motor.position - motor.offset)
+
+    def offset_motor_encoder(self, port: int, position: int):
+        self._transfer()
+        for i in self._port_indices(port):
+            self.motors[i].offset += int(position)
+
+    def reset_motor_encoder(self, port: int):
+        for i in self._port_indices(port):
+            self.offset_motor_encoder(1 << i, self.get_motor_encoder(1 << i))
+
+    def get_voltage_battery(self) -> float:
+        self._transfer()
+        return 9.0
+
+    def reset_all(self):
+        "Unconfigure all sensors and float all motors, like brickpi3.BrickPi3.reset_all."
+        self._transfer(3)
+        for i in range(4):
+            self.SensorType[i] = self.SENSOR_TYPE.NONE
+            motor = self.motors[i]
+            motor.mode, motor.target = motor.FLOAT, 0
+            motor.power_limit = motor.dps_limit = 0
+
+
+BrickPi3 = SimulatedBrickPi3
@@ -15,10 +15,16 @@ import math
 import functools
 import array
 
+try:
+    import numpy as np
+except ImportError:  # synthesize with the pure Python loop instead
+    np = None
+
 LIMIT_MAX_VOLUME = True
+WAVE_CACHE_SIZE = 256  # number of generated waves kept, keyed by all their parameters
 
 
-@functools.lru_cache()
+@functools.lru_cache(maxsize=4096)
 def sin(x: float) -> float:
     return math.sin(x)
 
@@ -88,7 +94,38 @@ def gen_wave(duration=1, volume=40, pitch: Union[str, float] = "A4", mod_f: Unio
     # Convert volume using decibel underneath
     volume = vol_to_amp(volume)
 
-    return _gen_wave(duration, volume, pitch, mod_f, mod_k, amp_f, amp_ka, amp_ac, cutoff, fs)
+    # copy, since Sound.alter_wave and Sound.update_audio change the array in place
+    return array.array('h', _cached_wave(duration, volume, pitch, mod_f, mod_k, amp_f, amp_ka, amp_ac, cutoff, fs))
+
+
+@functools.lru_cache(maxsize=WAVE_CACHE_SIZE)
+def _cached_wave(duration, volume, pitch, mod_f, mod_k, amp_f, amp_ka, amp_ac, cutoff, fs) -> bytes:
+    """Generates the wave as bytes of int16 samples, cached so that the same sound is only generated once."""
+    generate = _gen_wave if np is None else _gen_wave_numpy
+    return generate(duration, volume, pitch, mod_f, mod_k, amp_f, amp_ka, amp_ac, cutoff, fs).tobytes()
+
+
+def _gen_wave_numpy(duration, volume, pitch, mod_f, mod_k, amp_f, amp_ka, amp_ac, cutoff, fs):
+    """Same as _gen_wave, computing all the samples at once with NumPy, in the same order of operations."""
+    n = int(duration * fs)
+    x = np.arange(n) / fs
+    # carrier wave, frequency modulated, then amplitude modulated
+    y = np.cos((2 * math.pi * x * pitch) + mod_k * np.sin(2 * math.pi * mod_f * x))
+    y = y * (amp_ac * (1 + (amp_ka * np.sin(2 * math.pi * amp_f * x))))
+    maximum = np.abs(y).max() if n > 0 else -2**31
+
+    # do volume and cutoff calculation
+    max16 = (2**15 - 1)
+    cutoff = min(int(n/2), int(fs * cutoff))
+    k = (1/3) * (1/math.log(2))
+    y = y * volume
+    if cutoff > 0:
+        fade = np.log(np.arange(cutoff) / cutoff * 7 + 1) * k
+        y[:cutoff] *= fade
+        y[n - cutoff:] *= fade[::-1]
+
+    # pull down value to int16
+    return array.array('h', np.clip(np.trunc(y * max16 / maximum), -32768, 32767).astype(np.int16).tobytes())
 
 
 def _gen_wave(duration, volume, pitch, mod_f, mod_k, amp_f, amp_ka, amp_ac, cutoff, fs):
@@ -2,38 +2,124 @@
 Module for providing access to a single, simple, GUI that can easily display data.
 It also allows the creation of buttons and sliders for adjusting starting parameters.
 
+Sending data does no GUI work: add() only keeps the latest value of each key, and plot() appends a sample
+to the ring buffer of its key. The window shows the latest values on the next update(), on each frame of
+mainloop(), or FRAME_RATE times per second on its own thread with start(background=True),
+so control loops never wait on drawing.
+
 Author: Ryan Au
 """
 
 from tkinter import Scale, ttk, StringVar, TclError, Button as TkButton
 
+import queue
+import threading
+import time
 import tkinter as tk
 from tkinter.constants import HORIZONTAL
 
+try:
+    from .filters import RingBuffer
+except ImportError:  # run as a script
+    from filters import RingBuffer
+
+FRAME_RATE = 20  # frames per second at most
+PLOT_SAMPLES = 200  # samples kept and drawn per plot
+PLOT_WIDTH = 200  # pixels
+PLOT_HEIGHT = 40  # pixels
+
 WINDOW: tk.Tk = None
-LABELS = {}
+LABELS = {}  # key: (label, StringVar, text shown)
+PLOTS = {}  # key: (canvas, line, label, StringVar, samples drawn)
 _EXIT_FLAG = True
+_PENDING = {}  # key: (data, showkey), latest value only, see add()
+_SAMPLES = {}  # key: RingBuffer, see plot()
+_COMMANDS = queue.SimpleQueue()  # GUI calls made from other threads, run by the UI thread
+_UI_THREAD: threading.Thread = None
 
 
 def _on_closing():
     """Private method: cleans up internal values on window destruction"""
-    global WINDOW, _EXIT_FLAG, LABELS
+    global WINDOW, _EXIT_FLAG, LABELS, PLOTS
     _EXIT_FLAG = True
     WINDOW.destroy()
     WINDOW = None
     LABELS = {}
+    PLOTS = {}
 
 
-def start():
-    """Open the telemetry window"""
-    global WINDOW, _EXIT_FLAG
+def start(background=False, frame_rate=FRAME_RATE):
+    """Open the telemetry window.
+    With background=True, the window runs on its own thread and redraws frame_rate times per second:
+    update() is then not needed."""
+    global WINDOW, _EXIT_FLAG, _UI_THREAD, FRAME_RATE
+    FRAME_RATE = frame_rate
     _EXIT_FLAG = False
+    if background:
+        if _UI_THREAD is None or not _UI_THREAD.is_alive():
+            ready = threading.Event()
+            errors = []
+            _UI_THREAD = threading.Thread(target=_run_window, args=(ready, errors), name="Telemetry", daemon=True)
+            _UI_THREAD.start()
+            ready.wait()
+            if errors:  # eg, no display
+                _EXIT_FLAG = True
+                raise errors[0]
+        return
     if WINDOW is None:
         WINDOW = tk.Tk()
     WINDOW.protocol("WM_DELETE_WINDOW", _on_closing)
     update()
 
 
+def _run_window(ready: threading.Event, errors: list):
+    "Private method: body of the UI thread, which owns the window."
+    global WINDOW, _UI_THREAD
+    try:
+        WINDOW = tk.Tk()
+    except TclError as err:
+        errors.append(err)
+        _UI_THREAD = None
+        ready.set()
+        return
+    WINDOW.protocol("WM_DELETE_WINDOW", _on_closing)
+    ready.set()
+    WINDOW.after(0, _frame)
+    try:
+        WINDOW.mainloop()
+    finally:
+        _UI_THREAD = None
+
+
+def _frame():
+    "Private method: draw one frame and schedule the next one, on the thread that owns the window."
+    if WINDOW is None:
+        return
+    if _EXIT_FLAG:
+        _on_closing()
+        return
+    _render()
+    WINDOW.after(max(1, int(1000 / FRAME_RATE)), _frame)
+
+
+def _on_ui_thread():
+    return _UI_THREAD is None or threading.current_thread() is _UI_THREAD
+
+
+def _call(func, *args):
+    """Private method: run a GUI call on the thread that owns the window, and return its result."""
+    if _on_ui_thread():
+        return func(*args)
+    done = threading.Event()
+    result = []
+    thread = _UI_THREAD
+    _COMMANDS.put((func, args, result, done))
+    while not done.wait(0.1):
+        if not thread.is_alive():  # window closed meanwhile
+            return None
+    return result[0]
+
+
 def isopen():
     """Determines if the telemtry window has been opened or closed"""
     return not _EXIT_FLAG
@@ -43,12 +129,18 @@ def resize(width=100, height=100):
     """Resize telemtry to a set width and height in pixels"""
     if WINDOW is None:
         return
-    WINDOW.geometry("{}x{}".format(width, height))
+    _call(WINDOW.geometry, "{}x{}".format(width, height))
 
 
 def stop():
     """Closes telemtry window"""
-    global WINDOW
+    global WINDOW, _EXIT_FLAG
+    if _UI_THREAD is not None:
+        thread = _UI_THREAD
+        _EXIT_FLAG = True  # the UI thread closes the window on its next frame
+        if thread is not threading.current_thread():
+            thread.join()
+        return
     if WINDOW is not None:
         WINDOW.quit()
         WINDOW = None
@@ -57,9 +149,14 @@ def stop():
 class _Slider:
     def __init__(self, scale: Scale):
         self.scale = scale
+        self.value = scale.get()
+        scale.configure(command=self._on_change)
+
+    def _on_change(self, value):
+        self.value = self.scale.get()
 
     def get_value(self):
-        return self.scale.get()
+        return self.value  # kept up to date by the window, so reading it does no GUI call
 
 
 def create_slider(lower, upper=None, value=None):
@@ -73,6 +170,10 @@ def create_slider(lower, upper=None, value=None):
 
     if WINDOW is None or not isopen():
         return
+    return _call(_create_slider, lower, upper, value)
+
+
+def _create_slider(lower, upper, value):
     s = Scale(WINDOW, from_=lower, to=upper, orient=HORIZONTAL)
     s.set(value)
     s.pack()
@@ -102,7 +203,7 @@ def create_button(name, func=None):
     if WINDOW is None or not isopen():
         return
 
-    return _Button(name, func)
+    return _call(_Button, name, func)
 
 
 def label(key, data, showkey=False):
@@ -111,27 +212,94 @@ def label(key, data, showkey=False):
 
 
 def add(key, data, showkey=False):
-    """Adds/Sets data by a key to the telemetry window"""
-    if WINDOW is None or not isopen():
+    """Adds/Sets data by a key to the telemetry window.
+    Only keeps the value: the window shows the latest value of each key on its next frame."""
+    if _EXIT_FLAG:
         return
-    key = str(key)
-    data = str(data)
-    if showkey:
-        data = "{} : {}".format(key, data)
+    _PENDING[key] = (data, showkey)
+
+
+def plot(key, value):
+    """Adds a number to the scrolling plot of a key in the telemetry window.
+    Only appends it to the ring buffer of the key: each key should be plotted from a single thread."""
+    if _EXIT_FLAG:
+        return
+    samples = _SAMPLES.get(key)
+    if samples is None:
+        samples = _SAMPLES.setdefault(key, RingBuffer(PLOT_SAMPLES))
+    samples.append(time.monotonic(), value)
+
+
+def _render():
+    """Private method: run the GUI calls of other threads, and show the latest values and plots, on the UI thread."""
+    while True:
+        try:
+            func, args, result, done = _COMMANDS.get_nowait()
+        except queue.Empty:
+            break
+        try:
+            result.append(func(*args))
+        except Exception as err:
+            print("ERROR:", err)
+            result.append(None)
+        done.set()
+    while _PENDING:
+        try:
+            key, (data, showkey) = _PENDING.popitem()  # a newer value may arrive meanwhile, for the next frame
+        except KeyError:
+            break
+        _show_label(str(key), str(data) if not showkey else "{} : {}".format(key, data))
+    for key, samples in list(_SAMPLES.items()):
+        _show_plot(str(key), samples)
+
+
+def _show_label(key, text):
     if key in LABELS:
-        LABELS[key][1].set(data)
+        if LABELS[key][2] != text:  # Tk only redraws what changed
+            LABELS[key][1].set(text)
+            LABELS[key] = LABELS[key][:2] + (text,)
     else:
         var = StringVar()
-        var.set(data)
-        LABELS[key] = (tk.Label(WINDOW, textvariable=var), var)
+        var.set(text)
+        LABELS[key] = (tk.Label(WINDOW, textvariable=var), var, text)
         LABELS[key][0].pack()
 
 
+def _show_plot(key, samples):
+    if key not in PLOTS:
+        var = StringVar()
+        text = tk.Label(WINDOW, textvariable=var)
+        text.pack()
+        canvas = tk.Canvas(WINDOW, width=PLOT_WIDTH, height=PLOT_HEIGHT, highlightthickness=0)
+        canvas.pack()
+        PLOTS[key] = (canvas, canvas.create_line(0, 0, 0, 0), text, var, -1)
+    canvas, line, text, var, drawn = PLOTS[key]
+    if samples.count == drawn:
+        return
+    values = [v for _, v in samples.window(PLOT_SAMPLES) if isinstance(v, (int, float))]
+    PLOTS[key] = (canvas, line, text, var, samples.count)
+    if not values:
+        return
+    var.set("{} : {:g}".format(key, values[-1]))
+    low, high = min(values), max(values)
+    scale = (PLOT_HEIGHT - 2) / (high - low) if high > low else 0
+    step = PLOT_WIDTH / max(len(values) - 1, 1)
+    points = []
+    for i, v in enumerate(values):
+        points += [i * step, PLOT_HEIGHT - 1 - (v - low) * scale if scale else PLOT_HEIGHT / 2]
+    if len(points) == 2:
+        points += points
+    canvas.coords(line, *points)
+
+
 def update(retries=1):
-    """Updates display with latest telemetry values"""
+    """Updates display with latest telemetry values.
+    Each call draws a frame, so loops should call it at their own display rate, not on every reading.
+    Not needed when the window runs in the background."""
     global WINDOW
-    if WINDOW is not None:
+    if WINDOW is not None and _UI_THREAD is None:
         try:
+            _render()
             for i in range(retries):
                 WINDOW.update()
         except TclError as e:
@@ -142,47 +310,62 @@ def update(retries=1):
 
 def clear():
     """Destroy and remove all LABELS of telemetry"""
-    global LABELS
-    for i, widget in LABELS.items():
+    if WINDOW is not None:
+        _call(_clear)
+
+
+def _clear():
+    global LABELS, PLOTS
+    _PENDING.clear()
+    _SAMPLES.clear()
+    widgets = [label for label, _, _ in LABELS.values()]
+    widgets += [widget for canvas, _, label, _, _ in PLOTS.values() for widget in (canvas, label)]
+    for widget in widgets:
         try:
-            widget[0].destroy()
+            widget.destroy()
         except TclError:
             pass
     LABELS = {}
+    PLOTS = {}
 
 
 def mainloop():
-    """Starts a while loop that calls update for you! 
-    Usage of telemetry.update not needed when using this"""
+    """Starts a while loop that calls update for you!
+    Usage of telemetry.update not needed when using this.
+    With a background window, waits until it is closed."""
+    thread = _UI_THREAD
+    if thread is not None:
+        try:
+            thread.join()
+        except KeyboardInterrupt:
+            return
+        return
     if WINDOW is not None and isopen():
         try:
+            WINDOW.after(0, _frame)
             WINDOW.mainloop()
         except KeyboardInterrupt:
             return
 
 
 if __name__ == '__main__':
-    import time
-    start()
-    resize(500, 200)
+    import math
+    start(background=True)
+    resize(500, 300)
     i = 0
     add("word", "heyo this is the start")
-    update()
     while True:
-        time.sleep(1)
+        time.sleep(0.01)
 
         ### Test clearing window despite still updating ###
         if i == 10:
             clear()
             if not isopen():
-                start()
+                start(background=True)
 
-        # Adding data
+        # Adding data, as fast as a control loop would: the window shows 20 frames per second
         add("color", "red", True)
         i = i + 2 if i < 40 else 0
 
-        print(i, isopen())
         add("counter", "*"*i)
-
-        # Must update window to see changes
-        update()
+        plot("sine", math.sin(time.monotonic() * 3))
@@ -0,0 +1,227 @@
+"""
+Module for tracing where the cycle time of each sorted cube goes.
+
+Each cube gets a CubeTrace with an ID, and records spans: named intervals of the monotonic clock, eg,
+touch edge, each color sample, classify, each motor command and its settling, and the trailing idle.
+The durations of every span name go into a LatencyHistogram with fixed log-spaced buckets, so memory does not
+grow with the number of cubes, and the tracer reports p50/p95/p99 per span name, on exit or on a signal.
+
+Code deep in the sort loop records spans with span(name), into the trace active on its thread, if any,
+so functions do not need the trace as an argument.
+
+Example:
+
+TRACER = Tracer()
+TRACER.install()                       # report on exit and on `kill -USR1 <pid>`
+trace = TRACER.start(cube_number)
+with trace.active():
+    with span("sample"):               # same as trace.span("sample")
+        COLOR_SENSOR.get_rgb()
+trace.finish()                         # records the whole cycle as "cycle"
+print(TRACER.report())
+"""
+
+from __future__ import annotations
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from typing import NamedTuple
+import math
+import sys
+import threading
+import time
+
+TRACE_MIN = 1e-5  # seconds, upper bound of the first histogram bucket
+TRACE_MAX = 100.0  # seconds, longer durations go in the overflow bucket
+TRACE_BUCKETS_PER_DECADE = 10  # about 26% wide buckets
+TRACE_KEEP = 100  # finished cube traces kept, for inspection
+CYCLE = "cycle"  # span name of whole cubes, from the start of their trace to finish()
+
+_local = threading.local()
+
+
+class LatencyHistogram:
+    """
+    Histogram of durations in log-spaced buckets from TRACE_MIN to TRACE_MAX seconds, plus an overflow bucket.
+    Percentiles are interpolated within their bucket, and are exact for the minimum and maximum.
+
+    bounds - upper bound of each bucket, the last one being infinity
+    counts - durations in each bucket
+    """
+
+    def __init__(self, minimum: float = TRACE_MIN, maximum: float = TRACE_MAX,
+                 buckets_per_decade: int = TRACE_BUCKETS_PER_DECADE):
+        decades = math.log10(maximum / minimum)
+        n = round(decades * buckets_per_decade)
+        self.bounds = [minimum * 10 ** (i / buckets_per_decade) for i in range(n + 1)] + [math.inf]
+        self.counts = [0] * len(self.bounds)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q: float) -> float:
+        "Return the q-th percentile (0 to 100) of the durations, or NaN if there are none."
+        if self.count == 0:
+            return math.nan
+        rank = q / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = max(self.bounds[i - 1] if i else 0.0, self.min)
+                upper = min(self.bounds[i], self.max)
+                return lower + (upper - lower) * max(rank - seen, 0) / count
+            seen += count
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else math.nan
+
+
+class Span(NamedTuple):
+    "A named interval of a cube trace, in time.monotonic() seconds."
+    name: str
+    start: float
+    duration: float
+
+
+class CubeTrace:
+    """
+    Spans of one cube, started by Tracer.start. Every span is also added to the histograms of the tracer.
+    """
+
+    def __init__(self, tracer: Tracer, id: int, start: float = None):
+        self.tracer = tracer
+        self.id = id
+        self.start = start if start is not None else time.monotonic()
+        self.end: float = None
+        self.spans: list[Span] = []
+
+    def add(self, name: str, start: float, end: float = None):
+        "Record a span measured elsewhere, eg, from the time of a touch event. end defaults to now."
+        duration = (end if end is not None else time.monotonic()) - start
+        self.spans.append(Span(name, start, duration))
+        self.tracer.record(name, duration)
+
+    @contextmanager
+    def span(self, name: str):
+        "Record the time spent in the `with` block as a span."
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, start)
+
+    @contextmanager
+    def active(self):
+        "Make this the trace span() records into on this thread, for the `with` block."
+        previous = getattr(_local, "trace", None)
+        _local.trace = self
+        try:
+            yield self
+        finally:
+            _local.trace = previous
+
+    def finish(self):
+        "Record the whole cube, from the start of the trace, as a CYCLE span. Only the first call counts."
+        if self.end is None:
+            self.end = time.monotonic()
+            self.tracer.record(CYCLE, self.end - self.start)
+            self.tracer.finished(self)
+
+    def breakdown(self) -> dict[str, float]:
+        "Total seconds per span name."
+        totals = {}
+        for span in self.spans:
+            totals[span.name] = totals.get(span.name, 0.0) + span.duration
+        return totals
+
+
+def current_trace() -> CubeTrace | None:
+    "Return the trace active on this thread, see CubeTrace.active."
+    return getattr(_local, "trace", None)
+
+
+@contextmanager
+def span(name: str):
+    "Record the `with` block as a span of the trace active on this thread. Does nothing without one."
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+
+class Tracer:
+    """
+    Creates cube traces and keeps one LatencyHistogram per span name. Safe to use from several threads,
+    eg, the stages of a utils.pipeline.Pipeline.
+    """
+
+    def __init__(self, keep: int = TRACE_KEEP):
+        self.histograms: dict[str, LatencyHistogram] = {}
+        self.traces: deque[CubeTrace] = deque(maxlen=keep)  # last finished traces
+        self._lock = threading.RLock()  # the signal handler of install() may interrupt the thread holding it
+        self._next_id = 1
+
+    def start(self, id: int = None, start: float = None) -> CubeTrace:
+        """
+        Start the trace of a new cube, now or at an earlier time.monotonic() time, eg, when its request was read.
+        IDs are numbered from 1 unless given.
+        """
+        with self._lock:
+            if id is None:
+                id = self._next_id
+            self._next_id = id + 1
+        return CubeTrace(self, id, start)
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.add(seconds)
+
+    def finished(self, trace: CubeTrace):
+        with self._lock:
+            self.traces.append(trace)
+
+    def report(self) -> str:
+        "Return a table of the span names by total time: count, total, share of the cycle time and percentiles."
+        with self._lock:
+            histograms = sorted(self.histograms.items(), key=lambda item: -item[1].sum)
+            cycle = self.histograms.get(CYCLE)
+            cycle_time = cycle.sum if cycle is not None else 0.0
+            lines = [f"{'span':>14} {'count':>6} {'total s':>9} {'cycle':>6} {'p50 s':>8} {'p95 s':>8} "
+                     f"{'p99 s':>8} {'max s':>8}"]
+            for name, h in histograms:
+                share = f"{h.sum / cycle_time * 100:5.1f}%" if cycle_time else "     -"
+                lines.append(f"{name:>14} {h.count:>6} {h.sum:>9.3f} {share} {h.percentile(50):>8.4f} "
+                             f"{h.percentile(95):>8.4f} {h.percentile(99):>8.4f} {h.max:>8.4f}")
+        return "\n".join(lines)
+
+    def dump(self, file=None):
+        "Print the report, to stderr by default."
+        print(self.report(), file=file or sys.stderr, flush=True)
+
+    def install(self, signals: tuple[str, ...] = ("SIGUSR1",), at_exit: bool = True):
+        """
+        Dump the report when the program exits, and when it receives one of the given signals.
+        Signals missing on this platform are skipped. Must be called from the main thread.
+        """
+        import signal
+        for name in signals:
+            if hasattr(signal, name):
+                signal.signal(getattr(signal, name), lambda signum, frame: self.dump())
+        if at_exit:
+            import atexit
+            atexit.register(self.dump)